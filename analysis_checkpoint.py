@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+長時間影片分析的斷點續跑 (checkpoint / resume)。
+
+逐幀分析每隔 checkpoint_every 幀把目前狀態寫入 <output_dir>/checkpoint.pkl：
+已處理的幀數、追蹤器狀態、各 track 累積的特徵與統計、取樣器狀態等。
+寫入時先寫暫存檔、fsync 後再以 os.replace 取代，程式在任何時間點中斷都不會留下
+半寫入的檔案。加上 --resume 重新執行時會跳到斷點的幀繼續分析，分析完成後刪除 checkpoint。
+
+追蹤器狀態取自 ultralytics 的 model.predictor.trackers (連同 BaseTrack 的 ID 計數器)
+以 pickle 保存。某些追蹤器設定 (例如帶有 ReID 模型或 cv2 物件的 BoT-SORT GMC) 無法序列化，
+此時改為從新的追蹤器開始，並把之後的 track ID 加上已出現過的最大 ID，避免與斷點前的 ID 重複
+(斷點前後的同一個物件會變成兩個 track)。
+"""
+import os
+import pickle
+import cv2
+
+CHECKPOINT_NAME = "checkpoint.pkl"
+CHECKPOINT_VERSION = 2
+
+
+def checkpoint_path(output_dir):
+    return os.path.join(str(output_dir), CHECKPOINT_NAME)
+
+
+def video_signature(video_path):
+    st = os.stat(video_path)
+    return {"path": os.path.abspath(video_path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def save_checkpoint(path, state):
+    """以暫存檔 + fsync + os.replace 原子寫入 checkpoint。"""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(dict(state, version=CHECKPOINT_VERSION), f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path, video_path):
+    """讀取 checkpoint；不存在、版本不符或對應的影片已改變時回傳 None。"""
+    if not os.path.exists(path):
+        print(f"No checkpoint at {path}; starting from the beginning.")
+        return None
+    try:
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+        print(f"Warning: could not read checkpoint {path}: {e}. Starting from the beginning.")
+        return None
+    if state.get("version") != CHECKPOINT_VERSION:
+        print(f"Warning: checkpoint {path} was written by another version. Starting from the beginning.")
+        return None
+    if state.get("video") != video_signature(video_path):
+        print(f"Warning: checkpoint {path} belongs to a different video file. Starting from the beginning.")
+        return None
+    return state
+
+
+def remove_checkpoint(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def tracker_state(model):
+    """序列化 model 目前的追蹤器；無法序列化時回傳 None。"""
+    trackers = getattr(getattr(model, "predictor", None), "trackers", None)
+    if not trackers:
+        return None
+    try:
+        from ultralytics.trackers.basetrack import BaseTrack
+        return pickle.dumps({"trackers": trackers, "next_id": BaseTrack._count}, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return None
+
+
+def restore_tracker(model, blob, frame, tracker):
+    """
+    還原追蹤器狀態。predictor 在第一次 track() 時才會建立，因此先以 frame 呼叫一次
+    (結果丟棄)，再換上保存的追蹤器與 ID 計數器。成功時回傳 True。
+    """
+    if blob is None:
+        return False
+    try:
+        from ultralytics.trackers.basetrack import BaseTrack
+        state = pickle.loads(blob)
+        model.track(frame, persist=True, tracker=tracker, verbose=False)
+        model.predictor.trackers = state["trackers"]
+        BaseTrack._count = state["next_id"]
+        return True
+    except Exception as e:
+        print(f"Warning: could not restore tracker state ({e}); continuing with a fresh tracker.")
+        return False
+
+
+def seek(cap, frame_idx):
+    """把 cap 移到第 frame_idx 幀 (0 起算)，無法精準 seek 的編碼以 grab() 補足；回傳實際位置。"""
+    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+    pos = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    if pos > frame_idx:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        pos = 0
+    while pos < frame_idx and cap.grab():
+        pos += 1
+    return pos
+
+
+class Checkpointer:
+    """
+    分析迴圈使用的小幫手：
+        ckpt = Checkpointer(output_dir, video_path, every=500, resume=args.resume)
+        state = ckpt.state             # 續跑時為上次保存的 dict，否則為 None
+        ...
+        if ckpt.due(frame_idx): ckpt.save(frame_idx, model, {...})
+        ckpt.done()
+    """
+
+    def __init__(self, output_dir, video_path, every=500, resume=False):
+        self.path = checkpoint_path(output_dir)
+        self.video_path = video_path
+        self.every = max(0, int(every))
+        self.state = load_checkpoint(self.path, video_path) if resume else None
+        self.id_offset = self.state.get("id_offset", 0) if self.state else 0
+        self.max_track_id = self.state.get("max_track_id", 0) if self.state else 0
+
+    @property
+    def start_frame(self):
+        return self.state["frame"] if self.state else 0
+
+    def resume(self, cap, model, tracker):
+        """seek 到斷點並還原追蹤器；回傳實際的起始幀。"""
+        if not self.state:
+            return 0
+        pos = seek(cap, self.state["frame"])
+        if pos != self.state["frame"]:
+            print(f"Warning: could only seek to frame {pos} of {self.state['frame']}.")
+        ok, frame = cap.read()
+        restored = ok and restore_tracker(model, self.state.get("tracker"), frame, tracker)
+        seek(cap, pos)
+        if not restored:
+            self.id_offset = self.max_track_id
+        print(f"Resumed from frame {pos} (tracker state {'restored' if restored else 'reset, track IDs offset by ' + str(self.id_offset)}).")
+        return pos
+
+    def track_id(self, raw_id):
+        """把追蹤器輸出的 ID 轉成全域 ID，並記錄出現過的最大值。"""
+        track_id = raw_id + self.id_offset
+        if track_id > self.max_track_id:
+            self.max_track_id = track_id
+        return track_id
+
+    def due(self, frame_idx):
+        return self.every and frame_idx and frame_idx % self.every == 0
+
+    def save(self, frame_idx, model, data):
+        save_checkpoint(self.path, dict(data, frame=frame_idx, video=video_signature(self.video_path),
+                                        tracker=tracker_state(model), id_offset=self.id_offset,
+                                        max_track_id=self.max_track_id))
+
+    def done(self):
+        remove_checkpoint(self.path)
+
+
+def add_checkpoint_args(parser):
+    group = parser.add_argument_group("checkpointing")
+    group.add_argument("--resume", action="store_true", help="Continue from <output_dir>/checkpoint.pkl if it exists.")
+    group.add_argument("--checkpoint_every", type=int, default=500, help="Write a checkpoint every N frames (0 = off).")
+    return parser
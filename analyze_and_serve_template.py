@@ -1,10 +1,6 @@
 import os, sys, json, csv
 from pathlib import Path
 import yaml
-import pandas as pd
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 import cv2
 from flask import Flask, send_from_directory, render_template_string
 import plotly.graph_objs as go
@@ -34,39 +30,45 @@ cap = cv2.VideoCapture(video_source)
 # 如果無法開啟 (例如純 URL 或斷線的串流)，則使用預設值
 fps = cap.get(cv2.CAP_PROP_FPS) if cap.isOpened() and cap.get(cv2.CAP_PROP_FPS) > 0 else 30.0
 frames_total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if cap.isOpened() and cap.get(cv2.CAP_PROP_FRAME_COUNT) > 0 else None
+frame_size = None
+if cap.isOpened() and cap.get(cv2.CAP_PROP_FRAME_WIDTH) > 0 and cap.get(cv2.CAP_PROP_FRAME_HEIGHT) > 0:
+    frame_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
 cap.release()
 
-rows = []
-for txt in sorted(labels_dir.glob("*.txt"), key=lambda p: p.name):
-    stem = txt.stem
-    try:
-        frame_index = int(float(stem))
-    except:
-        frame_index = stem
-    for ln in txt.read_text(encoding="utf-8").splitlines():
-        p = ln.strip().split()
-        if len(p) >= 7:
-            cid, xc, yc, w, h, conf, tid = p[:7]
-            try:
-                cid_i = int(float(cid)); tid_i = int(float(tid)); conf_f = float(conf)
-            except:
-                continue
-            rows.append({
-                "frame": frame_index,
-                "cls": cid_i,
-                "cls_name": names.get(cid_i, f"cls{cid_i}"),
-                "conf": conf_f,
-                "track_id": tid_i
-            })
-
-if not rows:
-    print("No tracking data parsed."); sys.exit(0)
+# 偵測資料存成單一欄式檔案 (session 目錄下的 detections.npz)，labels 有變動時才重新轉換；
+# 這裡只讀取統計用得到的欄位
+sys.path.insert(0, r"__BASE__")
+from detection_store import STORE_NAME, ensure_store, update_track_ids
+from timeseries_downsample import downsample, window, range_loader_script
+from chart_render import CHARTS, ensure_chart
+from spatial_analytics import write_spatial_reports, spatial_summary, spatial_figures, DEFAULT_GRID
+from track_stitching import stitch_tracks, load_track_embeddings
+
+# 互動圖的點數上限 (LTTB)，縮放時再由 /api/objects_per_frame 取得該範圍的資料
+PLOT_POINTS = 2000
+# 統計前先離線縫合被追蹤器切斷的 track (track_stitching.py)；session 目錄有 embeddings.npz 時一併比對特徵
+STITCH_TRACKS = True
 
-import pandas as pd
-df = pd.DataFrame(rows)
+with ensure_store(labels_dir, out_dir / STORE_NAME) as store:
+    df = store.dataframe(["frame", "cls", "conf", "raw_track_id", "bbox"]).rename(columns={"raw_track_id": "track_id"})
 
-# 確保 'frame' 是數值類型，以便繪圖/計算
-df['frame'] = pd.to_numeric(df['frame'], errors='coerce').fillna(0).astype(int)
+if df.empty:
+    print("No tracking data parsed."); sys.exit(0)
+
+tracks_raw = int(df.loc[df["track_id"] >= 0, "track_id"].nunique())
+if STITCH_TRACKS:
+    emb_path = out_dir / "embeddings.npz"
+    stitched, links = stitch_tracks(df["frame"].to_numpy(), df["track_id"].to_numpy(), df["xc"].to_numpy(),
+                                    df["yc"].to_numpy(), df["cls"].to_numpy(), fps,
+                                    load_track_embeddings(emb_path) if emb_path.exists() else None)
+    df["track_id"] = stitched
+    links.to_csv(out_dir / "track_links.csv", index=False)
+    print(f"Track stitching: {tracks_raw} tracklets -> {tracks_raw - len(links)} tracks")
+# detections.npz 的 track_id 與下方的 CSV 使用相同的 (縫合後) ID，原始 ID 保留在 raw_track_id
+update_track_ids(out_dir / STORE_NAME, df["track_id"].to_numpy())
+
+cls_names = {int(c): names.get(int(c), f"cls{int(c)}") for c in df["cls"].unique()}
+df["cls_name"] = df["cls"].map(cls_names)
 
 frame_counts = df.groupby("frame")["track_id"].nunique().rename("objects").reset_index()
 
@@ -86,10 +88,13 @@ life.to_csv(out_dir / "track_lifespans.csv", index=False)
 class_totals.to_csv(out_dir / "class_totals.csv", index=False)
 avg_dwell.to_csv(out_dir / "avg_dwell_by_class.csv", index=False)
 
-plt.figure(figsize=(10,4)); plt.plot(frame_counts["frame"], frame_counts["objects"]); plt.title("Objects per Frame"); plt.tight_layout(); plt.savefig(out_dir/"objects_per_frame.png", dpi=150); plt.close()
-plt.figure(figsize=(6,4)); plt.hist(life["seconds"], bins=20); plt.title("Track Lifespan (seconds)"); plt.tight_layout(); plt.savefig(out_dir/"track_lifespan_seconds.png", dpi=150); plt.close()
-plt.figure(figsize=(7,4)); plt.bar(class_totals["class"], class_totals["count"]); plt.xticks(rotation=45, ha="right"); plt.title("Class Distribution"); plt.tight_layout(); plt.savefig(out_dir/"class_distribution.png", dpi=150); plt.close()
-plt.figure(figsize=(7,4)); plt.bar(avg_dwell["cls_name"], avg_dwell["avg_seconds"]); plt.xticks(rotation=45, ha="right"); plt.title("Average Dwell by Class"); plt.tight_layout(); plt.savefig(out_dir/"avg_dwell_by_class.png", dpi=150); plt.close()
+# 各類別的空間佔用熱圖與各 track 的路徑長度 / 速度 / 靜止比例 (occupancy_grid.csv, trajectory_stats.csv)
+occupancy, trajectories = write_spatial_reports(
+    out_dir, df["frame"].to_numpy(), df["cls"].to_numpy(), df["track_id"].to_numpy(), df["xc"].to_numpy(),
+    df["yc"].to_numpy(), df["h"].to_numpy(), fps, lambda c: cls_names.get(c, f"cls{c}"), frame_size)
+
+# PNG 圖表在第一次被請求時才由上面的 CSV 繪製並存在 session 目錄 (chart_render.py)；
+# 需要一次產生全部圖表時加上 --prerender (在另一個行程以 process pool 平行繪製)
 
 # 影片名稱處理：如果是本地檔案，則取名稱；如果是 URL/Stream 則顯示完整來源
 video_display_name = video_source
@@ -107,13 +112,18 @@ summary = {
     "fps": fps,
     "frames": frames_total if frames_total is not None else "N/A", # 可能是串流或無法讀取
     "tracks_total": int(life.shape[0]),
+    "tracks_raw": tracks_raw,
     "avg_lifespan_sec": float(life["seconds"].mean()),
-    "objects_total": int(df.shape[0])
+    "objects_total": int(df.shape[0]),
+    **spatial_summary(frame_size=frame_size),
 }
 (out_dir/"summary.json").write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
 
+series_x, series_y = frame_counts["frame"].to_numpy(), frame_counts["objects"].to_numpy()
+
 def fig_objects_over_time():
-    return go.Figure([go.Scatter(x=frame_counts["frame"], y=frame_counts["objects"], mode="lines")])
+    xs, ys = downsample(series_x, series_y, PLOT_POINTS, "lttb")
+    return go.Figure([go.Scatter(x=xs, y=ys, mode="lines")])
 def fig_class_distribution():
     return go.Figure([go.Bar(x=class_totals["class"], y=class_totals["count"])])
 def fig_avg_dwell():
@@ -130,7 +140,7 @@ INDEX = """
 </head><body>
 <h1>YOLOv12 追蹤分析儀表板</h1>
 <div class="card mono">
-<b>Video:</b> {{ summary.video }} &nbsp; <b>FPS:</b> {{ summary.fps }} &nbsp; <b>Frames:</b> {{ summary.frames }} &nbsp; <b>Total tracks:</b> {{ summary.tracks_total }} &nbsp; <b>Avg lifespan (s):</b> {{ '%.2f'|format(summary.avg_lifespan_sec) }}
+<b>Video:</b> {{ summary.video }} &nbsp; <b>FPS:</b> {{ summary.fps }} &nbsp; <b>Frames:</b> {{ summary.frames }} &nbsp; <b>Total tracks:</b> {{ summary.tracks_total }}{% if summary.tracks_raw != summary.tracks_total %} (stitched from {{ summary.tracks_raw }}){% endif %} &nbsp; <b>Avg lifespan (s):</b> {{ '%.2f'|format(summary.avg_lifespan_sec) }}
 </div>
 <div class="grid">
   <div class="card"><h2>Objects per Frame</h2><img src="objects_per_frame.png"></div>
@@ -140,9 +150,13 @@ INDEX = """
   <div class="card"><h2>Class Distribution</h2><img src="class_distribution.png"></div>
   <div class="card"><h2>Average Dwell by Class</h2><img src="avg_dwell_by_class.png"></div>
 </div>
-<div class="card"><h2>Interactive: Objects over Time</h2>{{ plot_objects|safe }}</div>
+<div class="card" id="objects-card"><h2>Interactive: Objects over Time</h2>{{ plot_objects|safe }}{{ range_script|safe }}</div>
 <div class="card"><h2>Interactive: Class Distribution</h2>{{ plot_classes|safe }}</div>
 <div class="card"><h2>Interactive: Avg Dwell</h2>{{ plot_dwell|safe }}</div>
+<div class="grid">
+  <div class="card"><h2>Occupancy Heatmap</h2>{{ plot_heatmap|safe }}</div>
+  <div class="card"><h2>Movement by Class</h2>{{ plot_motion|safe }}</div>
+</div>
 <div class="card"><h2>下載資料</h2>
 <ul>
 <li><a href="summary.json">summary.json</a></li>
@@ -150,28 +164,54 @@ INDEX = """
 <li><a href="track_lifespans.csv">track_lifespans.csv</a></li>
 <li><a href="class_totals.csv">class_totals.csv</a></li>
 <li><a href="avg_dwell_by_class.csv">avg_dwell_by_class.csv</a></li>
+<li><a href="occupancy_grid.csv">occupancy_grid.csv</a></li>
+<li><a href="trajectory_stats.csv">trajectory_stats.csv</a></li>
 </ul>
 </div>
 </body></html>
 """
 
+plot_divs = {}
+
 @app.route("/")
 def index():
     with open(out_dir/"summary.json","r",encoding="utf-8") as f:
         summary = json.load(f)
-    po = plot(fig_objects_over_time(), include_plotlyjs="cdn", output_type="div")
-    pc = plot(fig_class_distribution(), include_plotlyjs=False, output_type="div")
-    pdw= plot(fig_avg_dwell(), include_plotlyjs=False, output_type="div")
-    return render_template_string(INDEX, summary=summary, plot_objects=po, plot_classes=pc, plot_dwell=pdw)
+    if not plot_divs:  # 資料不再變動，Plotly div 只產生一次
+        plot_divs["objects"] = plot(fig_objects_over_time(), include_plotlyjs="cdn", output_type="div")
+        plot_divs["classes"] = plot(fig_class_distribution(), include_plotlyjs=False, output_type="div")
+        plot_divs["dwell"] = plot(fig_avg_dwell(), include_plotlyjs=False, output_type="div")
+        for key, fig in spatial_figures(occupancy, trajectories, DEFAULT_GRID).items():
+            plot_divs[key] = plot(fig, include_plotlyjs=False, output_type="div") if fig is not None else ""
+    rs = range_loader_script("#objects-card .plotly-graph-div", "api/objects_per_frame")
+    return render_template_string(INDEX, summary=summary, plot_objects=plot_divs["objects"], plot_classes=plot_divs["classes"],
+                                  plot_dwell=plot_divs["dwell"], plot_heatmap=plot_divs["heatmap"],
+                                  plot_motion=plot_divs["motion"], range_script=rs)
+
+@app.route("/api/objects_per_frame")
+def objects_per_frame_range():
+    """縮放用的範圍 API：/api/objects_per_frame?start=1000&end=5000&points=2000"""
+    from flask import request, jsonify
+    points = min(max(request.args.get("points", PLOT_POINTS, type=int), 3), 20000)
+    return jsonify(window(series_x, series_y, request.args.get("start", type=float),
+                          request.args.get("end", type=float), points, "lttb"))
 
 @app.route("/<path:path>")
 def static_proxy(path):
+    if path in CHARTS:
+        ensure_chart(out_dir, path)
     return send_from_directory(str(out_dir), path)
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", type=int, default=5050)
+    parser.add_argument("--prerender", action="store_true", help="Render all PNG charts in a background process pool.")
+    parser.add_argument("--workers", type=int, default=None)
     args = parser.parse_args()
+    if args.prerender:
+        import subprocess
+        cmd = [sys.executable, str(Path(r"__BASE__") / "chart_render.py"), "--session_dir", str(out_dir)]
+        subprocess.Popen(cmd + (["--workers", str(args.workers)] if args.workers else []))
     print("Dashboard ready.")
     app.run(port=args.port)
@@ -3,17 +3,44 @@
 YOLOv12 追蹤分析 — 多 Session 常駐儀表板
 使用方式：
     python app_dashboard.py --base runs/analyze --port 5050
+    python app_dashboard.py --base runs/analyze --gallery runs/reid_gallery   # 啟用 Re-ID 查詢 API
+偵測資料 API (讀取各 session 的 detections.npz)：/api/detections/<session>?columns=frame,track_id
+各 session 解析後的資料與 Plotly 圖表快取在記憶體中 (session_cache.py)，檔案改變時才重新讀取。
+Objects per Frame 以 LTTB 降取樣到 --max_points 點，縮放時由 /api/series/<session>/objects_per_frame?start=&end= 取得細節。
+跨 session 趨勢 (/trends)：背景定期把各 session 同步到 SQLite 目錄 (session_catalog.py)，
+查詢 API：/api/catalog/<dwell_by_day|detections_by_day|activity_by_hour|sessions>?start=&end=&cls=
+即時計數：live_stream_server*.py 以本機 UDP (--live_port) 發佈畫面中物件數、各類別數量、active tracks 與 FPS，
+由 /api/live/events (Server-Sent Events) 只推送變動的欄位給瀏覽器 (live_pubsub.py)。
+資料下載 API (data_stream.py)：/api/data/<session>/<table>?frame_start=&frame_end=&cls=&track_id=&columns=&format=csv|ndjson
+先篩選再分段輸出，用戶端接受時以 gzip 串流壓縮，並以 ETag 快取；/static 與 /api/video/<session> 支援 Range。
 """
-import os, json, argparse
+import os, json, time, argparse, threading, itertools
 from pathlib import Path
 import pandas as pd
 import plotly.graph_objs as go
 from plotly.offline import plot
-from flask import Flask, render_template_string, send_from_directory, request
+from flask import Flask, Response, render_template_string, send_from_directory, request, jsonify
+from reid_gallery import ReIDGallery
+from detection_store import READ_COLUMNS, STORE_NAME, DetectionStore
+from session_cache import SessionCache
+from timeseries_downsample import downsample, window, range_loader_script
+import session_catalog
+from chart_render import CHARTS, ensure_chart
+from spatial_analytics import spatial_figures, DEFAULT_GRID
+from live_pubsub import LiveCounterHub, DEFAULT_PORT as LIVE_PORT
+import data_stream
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--base", default="runs/analyze", help="分析輸出根目錄（包含多個 track_YYYYMMDD_HHMMSS）")
 parser.add_argument("--port", type=int, default=5050)
+parser.add_argument("--gallery", default=None, help="Re-ID gallery 目錄 (reid_gallery.py)，啟用 /api/gallery/search")
+parser.add_argument("--cache_size", type=int, default=16, help="記憶體中最多快取幾個 session 的圖表")
+parser.add_argument("--max_points", type=int, default=2000, help="Objects per Frame 互動圖的點數上限 (LTTB 降取樣)")
+parser.add_argument("--catalog", default=None, help=f"跨 session SQLite 目錄 (預設 <base>/{session_catalog.CATALOG_NAME})")
+parser.add_argument("--catalog_sync_interval", type=float, default=60.0, help="幾秒同步一次跨 session 目錄 (0 = 只在啟動時)")
+parser.add_argument("--live_port", type=int, default=LIVE_PORT, help="接收串流伺服器即時計數的本機 UDP 埠 (0 = 關閉)")
+parser.add_argument("--video_dir", default=None, help="/api/video/<session> 尋找 summary.json 中影片檔的目錄 (預設只找 session 目錄)")
+parser.add_argument("--cache_check_interval", type=float, default=1.0, help="幾秒內重複載入同一頁面時不檢查檔案是否變更")
 args = parser.parse_args()
 
 BASE = Path(args.base)
@@ -21,7 +48,10 @@ if not BASE.exists():
     print(f"❌ 找不到目錄：{BASE.resolve()}")
     exit(1)
 
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)  # /static/ 由下方的 static_files 提供 (session 目錄)
+cache = SessionCache(args.cache_size, args.cache_check_interval)
+SESSION_FILES = ("summary.json", "objects_per_frame.csv", "class_totals.csv", "avg_dwell_by_class.csv",
+                 "occupancy_grid.csv", "trajectory_stats.csv")
 
 HTML = """
 <!DOCTYPE html>
@@ -41,6 +71,43 @@ img { max-width: 100%; border-radius: 6px; }
 </head>
 <body>
 <h1>YOLOv12 Tracking Analytics — Multi-Session</h1>
+<p><a href="/trends">跨 Session 趨勢 →</a></p>
+{% if live %}
+<div class="card mono" id="live-card">
+  <h2>Live Streams</h2>
+  <div id="live">等待串流伺服器…</div>
+</div>
+<script>
+(function () {
+  var state = {};
+  function row(cells, tag) {
+    // 來源與類別名稱來自 UDP 封包，一律以 textContent 寫入
+    var tr = document.createElement("tr");
+    cells.forEach(function (v) { var td = document.createElement(tag); td.textContent = v; tr.appendChild(td); });
+    return tr;
+  }
+  function render() {
+    var names = Object.keys(state).sort(), live = document.getElementById("live");
+    if (!names.length) { live.textContent = "等待串流伺服器…"; return; }
+    var table = document.createElement("table");
+    table.appendChild(row(["Source", "Status", "FPS", "Objects", "Active tracks", "Total tracks", "Classes"], "th"));
+    names.forEach(function (n) {
+      var s = state[n], classes = Object.keys(s.classes || {}).map(function (c) { return c + ": " + s.classes[c]; });
+      table.appendChild(row([n, s.online ? "🟢" : "⚪ offline", s.fps, s.objects, s.active_tracks, s.tracks_total,
+                             classes.join(", ")], "td"));
+    });
+    live.replaceChildren(table);
+  }
+  var source = new EventSource("/api/live/events");
+  source.onmessage = function (e) {
+    var msg = JSON.parse(e.data);
+    if (msg.type === "snapshot") { state = msg.data; }
+    else { state[msg.source] = Object.assign(state[msg.source] || {}, msg.data); }
+    render();
+  };
+})();
+</script>
+{% endif %}
 <form method="get" action="/">
 <b>選擇 Session：</b>
 <select name="session" onchange="this.form.submit()">
@@ -50,12 +117,21 @@ img { max-width: 100%; border-radius: 6px; }
 </select>
 </form>
 
-{% if summary %}
+{% if summary and summary.reid_eval and summary.reid_eval.mAP is not none %}
+<div class="card mono">
+  <b>Re-ID mAP:</b> {{ "%.3f"|format(summary.reid_eval.mAP) }} |
+  {% for k, v in summary.reid_eval.cmc.items() %}<b>{{ k }}:</b> {{ "%.3f"|format(v) }} | {% endfor %}
+  <b>Queries:</b> {{ summary.reid_eval.n_queries }} |
+  <b>IDs:</b> {{ summary.reid_eval.n_ids }}
+</div>
+{% endif %}
+
+{% if summary and summary.frames is defined %}
 <div class="card mono">
   <b>Video:</b> {{ summary.video }} |
   <b>FPS:</b> {{ summary.fps }} |
   <b>Frames:</b> {{ summary.frames }} |
-  <b>Total tracks:</b> {{ summary.tracks_total }} |
+  <b>Total tracks:</b> {{ summary.tracks_total }}{% if summary.tracks_raw is defined and summary.tracks_raw != summary.tracks_total %} (stitched from {{ summary.tracks_raw }}){% endif %} |
   <b>Avg lifespan (s):</b> {{ "%.2f"|format(summary.avg_lifespan_sec) }}
 </div>
 
@@ -68,9 +144,10 @@ img { max-width: 100%; border-radius: 6px; }
   <div class="card"><h2>Average Dwell by Class</h2><img src="/static/{{ selected }}/avg_dwell_by_class.png"></div>
 </div>
 
-<div class="card">
+<div class="card" id="objects-card">
   <h2>Interactive: Objects over Time</h2>
   {{ plots.objects|safe }}
+  {{ range_script|safe }}
 </div>
 <div class="card">
   <h2>Interactive: Class Distribution</h2>
@@ -80,64 +157,368 @@ img { max-width: 100%; border-radius: 6px; }
   <h2>Interactive: Average Dwell</h2>
   {{ plots.dwell|safe }}
 </div>
+{% if plots.heatmap or plots.motion %}
+<div class="grid">
+  <div class="card"><h2>Occupancy Heatmap</h2>{{ plots.heatmap|safe }}</div>
+  <div class="card"><h2>Movement by Class</h2>{{ plots.motion|safe }}</div>
+</div>
+{% endif %}
 
 <div class="card">
   <h2>下載資料</h2>
   <ul>
     <li><a href="/static/{{ selected }}/summary.json">summary.json</a></li>
-    <li><a href="/static/{{ selected }}/objects_per_frame.csv">objects_per_frame.csv</a></li>
-    <li><a href="/static/{{ selected }}/track_lifespans.csv">track_lifespans.csv</a></li>
-    <li><a href="/static/{{ selected }}/class_totals.csv">class_totals.csv</a></li>
-    <li><a href="/static/{{ selected }}/avg_dwell_by_class.csv">avg_dwell_by_class.csv</a></li>
+    <li><a href="/api/data/{{ selected }}/objects_per_frame">objects_per_frame.csv</a></li>
+    <li><a href="/api/data/{{ selected }}/track_lifespans">track_lifespans.csv</a></li>
+    <li><a href="/api/data/{{ selected }}/class_totals">class_totals.csv</a></li>
+    <li><a href="/api/data/{{ selected }}/avg_dwell_by_class">avg_dwell_by_class.csv</a></li>
+    {% if plots.heatmap %}<li><a href="/api/data/{{ selected }}/occupancy_grid">occupancy_grid.csv</a></li>{% endif %}
+    {% if plots.motion %}<li><a href="/api/data/{{ selected }}/trajectory_stats">trajectory_stats.csv</a></li>{% endif %}
+    {% if summary.tracks_raw is defined %}<li><a href="/api/data/{{ selected }}/track_links">track_links.csv</a></li>{% endif %}
   </ul>
+  <p class="mono">篩選：/api/data/{{ selected }}/&lt;table&gt;?frame_start=&amp;frame_end=&amp;cls=&amp;track_id=&amp;columns=&amp;format=csv|ndjson
+  (table: detections, objects_per_frame, track_lifespans, trajectory_stats, …)</p>
 </div>
 {% endif %}
 </body></html>
 """
 
+def scan_sessions():
+    """列出有 summary.json 的 session；其餘子目錄記為 pending (分析中)。"""
+    sessions, pending = [], []
+    for p in BASE.iterdir():
+        if p.is_dir():
+            (sessions if (p / "summary.json").exists() else pending).append(p.name)
+    sessions.sort(reverse=True)
+    return {"sessions": sessions, "pending": pending}
+
+def list_sessions():
+    """
+    新增 session 目錄會改變 BASE 的 mtime；pending 目錄寫入 summary.json 會改變該目錄的 mtime，
+    因此只需 stat BASE 與 pending 目錄。
+    """
+    prev = cache.peek("__sessions__")
+    paths = [BASE] + [BASE / p for p in (prev["pending"] if prev else [])]
+    return cache.get("__sessions__", paths, scan_sessions)["sessions"]
+
+def load_session(sess):
+    """讀取 summary.json 與各 CSV，產生 Plotly div。"""
+    summary = None
+    plots = {"objects":"", "classes":"", "dwell":"", "heatmap":"", "motion":""}
+    try:
+        with open(sess / "summary.json", "r", encoding="utf-8") as f:
+            summary = json.load(f)
+    except Exception as e:
+        summary = None
+
+    try:
+        df_frame = pd.read_csv(sess / "objects_per_frame.csv")
+        df_class = pd.read_csv(sess / "class_totals.csv")
+        df_dwell = pd.read_csv(sess / "avg_dwell_by_class.csv")
+    except:
+        df_frame = df_class = df_dwell = None
+
+    if df_frame is not None and not df_frame.empty:
+        xs, ys = downsample(df_frame["frame"].to_numpy(), df_frame["objects"].to_numpy(), args.max_points, "lttb")
+        fig = go.Figure([go.Scatter(x=xs, y=ys, mode="lines")])
+        fig.update_layout(title="Objects per Frame", xaxis_title="Frame", yaxis_title="Objects")
+        plots["objects"] = plot(fig, include_plotlyjs="cdn", output_type="div")
+    if df_class is not None and not df_class.empty:
+        fig = go.Figure([go.Bar(x=df_class["class"], y=df_class["count"])])
+        fig.update_layout(title="Class Distribution", xaxis_title="Class", yaxis_title="Count")
+        plots["classes"] = plot(fig, include_plotlyjs=False, output_type="div")
+    if df_dwell is not None and not df_dwell.empty:
+        fig = go.Figure([go.Bar(x=df_dwell["cls_name"], y=df_dwell["avg_seconds"])])
+        fig.update_layout(title="Average Dwell by Class", xaxis_title="Class", yaxis_title="Seconds")
+        plots["dwell"] = plot(fig, include_plotlyjs=False, output_type="div")
+
+    # 空間佔用熱圖與軌跡統計 (較舊的 session 沒有這兩個 CSV)
+    occupancy = pd.read_csv(sess / "occupancy_grid.csv") if (sess / "occupancy_grid.csv").exists() else None
+    trajectories = pd.read_csv(sess / "trajectory_stats.csv") if (sess / "trajectory_stats.csv").exists() else None
+    grid = tuple((summary or {}).get("occupancy_grid") or DEFAULT_GRID)
+    for key, fig in spatial_figures(occupancy, trajectories, grid).items():
+        plots[key] = plot(fig, include_plotlyjs=False, output_type="div") if fig is not None else ""
+    return summary, plots
+
 @app.route("/")
 def index():
-    sessions = [p.name for p in BASE.iterdir() if p.is_dir() and (p / "summary.json").exists()]
-    sessions.sort(reverse=True)
+    sessions = list_sessions()
     selected = (request.args.get("session") or (sessions[0] if sessions else None))
     summary = None
-    plots = {"objects":"", "classes":"", "dwell":""}
+    plots = {"objects":"", "classes":"", "dwell":"", "heatmap":"", "motion":""}
 
-    if selected:
+    if selected in sessions:
         sess = BASE / selected
+        summary, plots = cache.get(("session", selected), [sess / name for name in SESSION_FILES],
+                                   lambda: load_session(sess))
+
+    range_script = range_loader_script("#objects-card .plotly-graph-div", f"/api/series/{selected}/objects_per_frame") if plots["objects"] else ""
+    return render_template_string(HTML, sessions=sessions, selected=selected, summary=summary, plots=plots,
+                                  range_script=range_script, live=LIVE_HUB is not None)
+
+def load_series(sess):
+    df = pd.read_csv(sess / "objects_per_frame.csv")
+    return df["frame"].to_numpy(), df["objects"].to_numpy()
+
+@app.route("/api/series/<session>/objects_per_frame")
+def objects_per_frame_range(session):
+    """縮放用的範圍 API：/api/series/<session>/objects_per_frame?start=1000&end=5000&points=2000"""
+    if session not in list_sessions():
+        return jsonify({"error": f"Unknown session {session}."}), 404
+    path = BASE / session / "objects_per_frame.csv"
+    try:
+        x, y = cache.get(("series", session), [path], lambda: load_series(BASE / session))
+    except Exception as e:
+        return jsonify({"error": f"Could not read {path.name}: {e}"}), 404
+    points = min(max(request.args.get("points", args.max_points, type=int), 3), 20000)
+    return jsonify(window(x, y, request.args.get("start", type=float), request.args.get("end", type=float), points, "lttb"))
+
+@app.route("/api/cache")
+def cache_stats():
+    return jsonify(cache.stats())
+
+_gallery_cache = {"mtime": None, "gallery": None}
+
+def get_gallery():
+    """分析程式會持續寫入 gallery；gallery.json 變更時才重新載入。"""
+    state_path = Path(args.gallery) / "gallery.json"
+    if not state_path.exists():
+        return None
+    mtime = state_path.stat().st_mtime
+    if _gallery_cache["mtime"] != mtime:
+        _gallery_cache.update(mtime=mtime, gallery=ReIDGallery(args.gallery))
+    return _gallery_cache["gallery"]
+
+@app.route("/api/gallery/search")
+def gallery_search():
+    """查詢某支影片的某個 track 是否出現在其他錄影中：/api/gallery/search?video=xxx.mp4&track_id=12&k=10"""
+    gallery = get_gallery() if args.gallery else None
+    if gallery is None:
+        return jsonify({"error": "Re-ID gallery is not configured or empty."}), 404
+    video = request.args.get("video")
+    track_id = request.args.get("track_id", type=int)
+    k = request.args.get("k", default=10, type=int)
+    if not video or track_id is None:
+        return jsonify({"error": "video and track_id are required."}), 400
+    entry = gallery.find(Path(video).name, track_id)
+    if entry is None:
+        return jsonify({"error": f"track {track_id} of {video} is not in the gallery."}), 404
+    same_video = request.args.get("include_same_video", "0") == "1"
+    results = gallery.search(gallery.vector(entry["id"]), k=k, exclude_video=None if same_video else entry["video"])
+    return jsonify({"query": entry, "results": [dict(m, similarity=sim) for sim, m in results]})
+
+@app.route("/api/detections/<session>")
+def session_detections(session):
+    """
+    讀取 session 的 detections.npz，只解壓縮要求的欄位：
+    /api/detections/<session>?columns=frame,track_id&frame_start=100&frame_end=200
+    """
+    if session not in list_sessions():
+        return jsonify({"error": f"Unknown session {session}."}), 404
+    store_path = BASE / session / STORE_NAME
+    if not store_path.exists():
+        return jsonify({"error": f"{session} has no {STORE_NAME}."}), 404
+    columns = [c for c in request.args.get("columns", "frame,cls,conf,track_id").split(",") if c]
+    if not set(columns) <= set(READ_COLUMNS):
+        return jsonify({"error": f"columns must be a subset of {', '.join(READ_COLUMNS)}."}), 400
+    with DetectionStore(store_path) as store:
+        data = store.read(columns, request.args.get("frame_start", type=int), request.args.get("frame_end", type=int))
+    return jsonify({c: v.tolist() for c, v in data.items()})
+
+@app.route("/api/data/<session>/<table>")
+def session_data(session, table):
+    """
+    篩選後分段輸出：/api/data/<session>/detections?frame_start=100&frame_end=900&cls=0&columns=frame,track_id,xc,yc
+    /api/data/<session>/track_lifespans?cls=monkey&format=ndjson
+    """
+    if session not in list_sessions():
+        return jsonify({"error": f"Unknown session {session}."}), 404
+    if table not in data_stream.TABLES:
+        return jsonify({"error": f"Unknown table {table}; choose from {', '.join(data_stream.TABLES)}."}), 404
+    sess = BASE / session
+    if not (sess / data_stream.TABLES[table]).exists():
+        return jsonify({"error": f"{session} has no {data_stream.TABLES[table]}."}), 404
+    fmt = request.args.get("format", "csv")
+    if fmt not in data_stream.FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(data_stream.FORMATS)}."}), 400
+    coding = "gzip" if "gzip" in request.headers.get("Accept-Encoding", "") else None
+    etag = data_stream.data_etag(sess, table, request.args.items(multi=True), coding)
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={"ETag": f'"{etag}"'})
+    try:
+        filters = data_stream.parse_filters(request.args)
+        pieces = data_stream.serialize(data_stream.table_chunks(sess, table, filters), fmt)
+        # 先取第一段：篩選條件或欄位錯誤在開始串流前就回報
+        first = next(pieces, b"")
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": str(e).strip("'\"")}), 400
+    body = itertools.chain([first], pieces)
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache", "Vary": "Accept-Encoding",
+               "Content-Disposition": f'inline; filename="{session}_{table}.{fmt}"'}
+    if coding == "gzip":
+        body = data_stream.gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, mimetype=data_stream.FORMATS[fmt], headers=headers)
+
+@app.route("/api/video/<session>")
+def session_video(session):
+    """session 的影片 (summary.json 的 video)；支援 Range，瀏覽器可直接拖曳播放。"""
+    if session not in list_sessions():
+        return jsonify({"error": f"Unknown session {session}."}), 404
+    try:
+        name = Path(json.loads((BASE / session / "summary.json").read_text(encoding="utf-8")).get("video") or "").name
+    except (OSError, ValueError):
+        name = ""
+    dirs = [BASE / session] + ([Path(args.video_dir)] if args.video_dir else [])
+    for d in dirs:
+        if name and (d / name).is_file():
+            return send_from_directory(str(d.resolve()), name, conditional=True, max_age=3600)
+    return jsonify({"error": f"Video {name or '(unknown)'} of {session} not found."}), 404
+
+CATALOG = Path(args.catalog) if args.catalog else BASE / session_catalog.CATALOG_NAME
+
+def catalog_sync_loop():
+    """背景同步：只重新匯入 mtime/size 有變動的 session。"""
+    while True:
         try:
-            with open(sess / "summary.json", "r", encoding="utf-8") as f:
-                summary = json.load(f)
+            conn = session_catalog.connect(CATALOG)
+            t0 = time.perf_counter()
+            imported, removed = session_catalog.sync(conn, BASE)
+            conn.close()
+            if imported or removed:
+                print(f"Catalog: imported {imported}, removed {removed} session(s) in {time.perf_counter() - t0:.1f}s")
         except Exception as e:
-            summary = None
+            print(f"Warning: catalog sync failed: {e}")
+        if args.catalog_sync_interval <= 0:
+            return
+        time.sleep(args.catalog_sync_interval)
 
-        try:
-            df_frame = pd.read_csv(sess / "objects_per_frame.csv")
-            df_class = pd.read_csv(sess / "class_totals.csv")
-            df_dwell = pd.read_csv(sess / "avg_dwell_by_class.csv")
-        except:
-            df_frame = df_class = df_dwell = None
-
-        if df_frame is not None and not df_frame.empty:
-            fig = go.Figure([go.Scatter(x=df_frame["frame"], y=df_frame["objects"], mode="lines")])
-            fig.update_layout(title="Objects per Frame", xaxis_title="Frame", yaxis_title="Objects")
-            plots["objects"] = plot(fig, include_plotlyjs="cdn", output_type="div")
-        if df_class is not None and not df_class.empty:
-            fig = go.Figure([go.Bar(x=df_class["class"], y=df_class["count"])])
-            fig.update_layout(title="Class Distribution", xaxis_title="Class", yaxis_title="Count")
-            plots["classes"] = plot(fig, include_plotlyjs=False, output_type="div")
-        if df_dwell is not None and not df_dwell.empty:
-            fig = go.Figure([go.Bar(x=df_dwell["cls_name"], y=df_dwell["avg_seconds"])])
-            fig.update_layout(title="Average Dwell by Class", xaxis_title="Class", yaxis_title="Seconds")
-            plots["dwell"] = plot(fig, include_plotlyjs=False, output_type="div")
-
-    return render_template_string(HTML, sessions=sessions, selected=selected, summary=summary, plots=plots)
+TRENDS_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>YOLOv12 Multi-Session Trends</title>
+<script src="https://cdn.plot.ly/plotly-2.35.2.min.js"></script>
+<style>
+body { font-family: 'Segoe UI', Arial; margin: 24px; }
+input, select { padding: 6px; font-size: 16px; }
+.card { border: 1px solid #ddd; border-radius: 8px; padding: 16px; margin: 12px 0; }
+h1, h2 { margin-top: 0; }
+table { border-collapse: collapse; } td, th { padding: 4px 10px; border-bottom: 1px solid #eee; text-align: left; }
+</style>
+</head>
+<body>
+<h1>跨 Session 趨勢</h1>
+<p><a href="/">← 單一 Session</a></p>
+<div class="card">
+  <b>從</b> <input type="date" id="start" value="{{ start }}">
+  <b>到</b> <input type="date" id="end" value="{{ end }}">
+  <b>類別</b> <select id="cls"><option value="">(全部)</option>{% for c in classes %}<option>{{ c }}</option>{% endfor %}</select>
+  <button onclick="load()">查詢</button> <span id="took"></span>
+</div>
+<div class="card"><h2>Total Dwell per Day (seconds)</h2><div id="dwell"></div></div>
+<div class="card"><h2>Detections per Day</h2><div id="detections"></div></div>
+<div class="card"><h2>Activity by Hour of Day</h2><div id="hourly"></div></div>
+<div class="card"><h2>Sessions</h2><div id="sessions"></div></div>
+<script>
+function q() {
+  return "?start=" + document.getElementById("start").value + "&end=" + document.getElementById("end").value +
+         "&cls=" + encodeURIComponent(document.getElementById("cls").value);
+}
+function byClass(rows, x, y, type) {
+  var groups = {};
+  rows.forEach(function (r) { (groups[r.cls_name] = groups[r.cls_name] || {x: [], y: [], name: r.cls_name, type: type})
+                                .x.push(r[x]); groups[r.cls_name].y.push(r[y]); });
+  return Object.values(groups);
+}
+function cells(tr, values, tag) {
+  values.forEach(function (v) { var td = document.createElement(tag); td.textContent = v; tr.appendChild(td); });
+  return tr;
+}
+function get(name) { return fetch("/api/catalog/" + name + q()).then(function (r) { return r.json(); }); }
+function load() {
+  var t0 = performance.now();
+  Promise.all([get("dwell_by_day"), get("detections_by_day"), get("activity_by_hour"), get("sessions")]).then(function (d) {
+    Plotly.react("dwell", byClass(d[0].rows, "day", "dwell_seconds", "bar"), {barmode: "stack"});
+    Plotly.react("detections", byClass(d[1].rows, "day", "detections", "bar"), {barmode: "stack"});
+    Plotly.react("hourly", byClass(d[2].rows, "hour", "detections", "bar"), {barmode: "group", xaxis: {dtick: 1}});
+    // session / 影片名稱來自檔案系統，一律以 textContent 寫入
+    var table = document.createElement("table");
+    table.appendChild(cells(document.createElement("tr"), ["Session", "Start", "Video", "Tracks", "Objects"], "th"));
+    d[3].rows.forEach(function (r) {
+      var tr = document.createElement("tr"), td = document.createElement("td"), a = document.createElement("a");
+      a.href = "/?session=" + encodeURIComponent(r.name);
+      a.textContent = r.name;
+      td.appendChild(a);
+      tr.appendChild(td);
+      table.appendChild(cells(tr, [r.started_at, r.video, r.tracks_total, r.objects_total], "td"));
+    });
+    document.getElementById("sessions").replaceChildren(table);
+    document.getElementById("took").textContent = (performance.now() - t0).toFixed(0) + " ms";
+  });
+}
+load();
+</script>
+</body></html>
+"""
+
+@app.route("/trends")
+def trends():
+    conn = session_catalog.connect(CATALOG)
+    try:
+        classes = session_catalog.class_names(conn)
+        first, last = conn.execute("SELECT MIN(day), MAX(day) FROM sessions").fetchone()
+    finally:
+        conn.close()
+    start = request.args.get("start") or first or ""
+    end = request.args.get("end") or last or ""
+    return render_template_string(TRENDS_HTML, classes=classes, start=start, end=end)
+
+@app.route("/api/catalog/<name>")
+def catalog_query(name):
+    """跨 session 查詢：/api/catalog/dwell_by_day?start=2025-10-01&end=2025-10-31&cls=monkey"""
+    if name not in session_catalog.QUERIES:
+        return jsonify({"error": f"Unknown query {name}; choose from {', '.join(sorted(session_catalog.QUERIES))}."}), 404
+    conn = session_catalog.connect(CATALOG)
+    try:
+        t0 = time.perf_counter()
+        df = session_catalog.QUERIES[name](conn, request.args.get("start") or None, request.args.get("end") or None,
+                                           request.args.get("cls") or None)
+    finally:
+        conn.close()
+    return jsonify({"rows": json.loads(df.to_json(orient="records")), "ms": round(1000 * (time.perf_counter() - t0), 1)})
+
+LIVE_HUB = LiveCounterHub(port=args.live_port) if args.live_port else None
+
+@app.route("/api/live")
+def live_snapshot():
+    if LIVE_HUB is None:
+        return jsonify({"error": "Live counters are disabled (--live_port 0)."}), 404
+    return jsonify(LIVE_HUB.snapshot())
+
+@app.route("/api/live/events")
+def live_events():
+    """SSE：連線時送出完整快照，之後只推送各串流有變動的計數。"""
+    if LIVE_HUB is None:
+        return jsonify({"error": "Live counters are disabled (--live_port 0)."}), 404
+    return Response(LIVE_HUB.events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/static/<path:subpath>")
 def static_files(subpath):
-    target = BASE / subpath
-    return send_from_directory(str(target.parent), target.name)
+    parts = Path(subpath).parts
+    if len(parts) == 2 and parts[1] in CHARTS and parts[0] in list_sessions():
+        ensure_chart(BASE / parts[0], parts[1])  # PNG 在第一次被請求時才繪製
+    return send_from_directory(str(BASE), subpath)  # 拒絕 BASE 以外的路徑 (例如 ../)
 
 if __name__ == "__main__":
+    threading.Thread(target=catalog_sync_loop, daemon=True).start()
+    if LIVE_HUB is not None:
+        try:
+            LIVE_HUB.start()
+            print(f"Live counters: listening on udp://127.0.0.1:{args.live_port}")
+        except OSError as e:
+            print(f"Warning: live counters disabled, cannot bind UDP port {args.live_port}: {e}")
     print(f"🚀 Dashboard on http://127.0.0.1:{args.port}/")
     app.run(host="127.0.0.1", port=args.port, debug=False)
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+以陣列實作的 ByteTrack，供離線重新追蹤 (offline_retrack.py) 使用。
+
+ultralytics 的 BYTETracker 每個 track 是一個 STrack 物件，每一幀要建立偵測物件、逐一呼叫 Kalman update、
+反覆組 list；離線重新追蹤時 95% 的時間都花在這些 Python 物件操作上。
+這裡把所有 track 的狀態 (Kalman mean / covariance、狀態、id、分數...) 放在 numpy 陣列中，
+每一幀的 predict / update / IoU 都以批次運算處理，關聯的步驟與 ultralytics 8.x 的 BYTETracker 逐步對應：
+
+1. 依 track_high_thresh / track_low_thresh 分成高分與低分偵測
+2. 已確認的 tracked + lost 做 Kalman predict，與高分偵測以 IoU (可融合分數) 關聯
+3. 剩下的 tracked 與低分偵測以 IoU 關聯 (門檻 0.5)，仍未配對者標記為 lost
+4. 未確認的 track 與剩下的高分偵測關聯 (門檻 0.7)，未配對者移除
+5. 分數 >= new_track_thresh 的剩餘偵測建立新 track；lost 超過 track_buffer 幀者移除
+6. 合併 tracked / lost 並移除 IoU > 0.85 的重複 track (保留存活較久者)
+
+線性指派以 scipy 解 lap.lapjv(extend_cost=True, cost_limit=thresh) 的擴充矩陣，最佳解相同。
+輸出與 BYTETracker.update() 相同：每列 [x1, y1, x2, y2, track_id, score, cls, idx]。
+"""
+from collections import deque
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+NEW, TRACKED, LOST, REMOVED = 0, 1, 2, 3
+STD_WEIGHT_POSITION = 1.0 / 20
+STD_WEIGHT_VELOCITY = 1.0 / 160
+REMOVED_BUFFER = 1000
+DUPLICATE_IOU_DIST = 0.15
+
+# Kalman 雜訊的標準差 = h * 權重 + 常數 (順序 x, y, a, h, vx, vy, va, vh)
+_PROCESS_W = np.array([STD_WEIGHT_POSITION] * 2 + [0, STD_WEIGHT_POSITION] + [STD_WEIGHT_VELOCITY] * 2 + [0, STD_WEIGHT_VELOCITY])
+_PROCESS_C = np.array([0, 0, 1e-2, 0, 0, 0, 1e-5, 0])
+_MEASURE_W = _PROCESS_W[:4]
+_MEASURE_C = np.array([0, 0, 1e-1, 0])
+_INITIAL_W = np.array([2 * STD_WEIGHT_POSITION] * 2 + [0, 2 * STD_WEIGHT_POSITION]
+                      + [10 * STD_WEIGHT_VELOCITY] * 2 + [0, 10 * STD_WEIGHT_VELOCITY])
+_EYE4, _EYE8 = np.eye(4), np.eye(8)
+
+
+def xyah_to_xyxy(xyah):
+    """Kalman 狀態 (xc, yc, aspect, h) -> (x1, y1, x2, y2)，運算順序與 STrack.xyxy 相同。"""
+    out = np.empty((len(xyah), 4))
+    out[:, 2:] = xyah[:, 2:]
+    out[:, 2] *= xyah[:, 3]
+    out[:, :2] = xyah[:, :2] - out[:, 2:] / 2
+    out[:, 2:] += out[:, :2]
+    return out
+
+
+def detection_arrays(xywh, conf, cls):
+    """
+    偵測 (像素 xc yc w h) -> 追蹤需要的陣列：與 STrack 相同以 float32 的 tlwh 為準換算 xyah (Kalman 量測) 與 xyxy (IoU)。
+    離線時整段影片一次換算，不必每幀重算。
+    """
+    xywh = np.asarray(xywh, dtype=np.float64)
+    tlwh = np.empty((len(xywh), 4))
+    tlwh[:, :2] = xywh[:, :2] - xywh[:, 2:] / 2
+    tlwh[:, 2:] = xywh[:, 2:]
+    tlwh = tlwh.astype(np.float32)
+    xyah = tlwh.copy()
+    xyah[:, :2] += xyah[:, 2:] / 2
+    xyah[:, 2] /= xyah[:, 3]
+    xyxy = tlwh
+    xyxy[:, 2:] += xyxy[:, :2]
+    return {"xyah": xyah, "xyxy": xyxy, "conf": np.asarray(conf), "cls": np.asarray(cls),
+            "valid": (xywh[:, 2] > 0) & (xywh[:, 3] > 0)}
+
+
+def iou_distance(a, b, eps=1e-7):
+    """1 - IoU (float32，與 ultralytics 的 bbox_ioa 相同)。"""
+    if not len(a) or not len(b):
+        return np.ones((len(a), len(b)), dtype=np.float32)
+    ax1, ay1, ax2, ay2 = np.asarray(a, dtype=np.float32).T
+    bx1, by1, bx2, by2 = np.asarray(b, dtype=np.float32).T
+    ax1, ay1, ax2, ay2 = ax1[:, None], ay1[:, None], ax2[:, None], ay2[:, None]
+    inter = (np.minimum(ax2, bx2) - np.maximum(ax1, bx1)).clip(0) * (np.minimum(ay2, by2) - np.maximum(ay1, by1)).clip(0)
+    return 1 - inter / ((bx2 - bx1) * (by2 - by1) + (ax2 - ax1) * (ay2 - ay1) - inter + eps)
+
+
+def linear_assignment(cost, thresh):
+    """
+    與 lap.lapjv(cost, extend_cost=True, cost_limit=thresh) 相同：每一列 / 行都可以用 thresh / 2 的代價不配對。
+    回傳 (matches (K, 2), 未配對的列, 未配對的行)，皆為遞增排序。
+    """
+    n, m = cost.shape
+    if n == 0 or m == 0:
+        return np.zeros((0, 2), dtype=np.int64), np.arange(n), np.arange(m)
+    ext = np.full((n + m, n + m), thresh / 2.0)
+    ext[:n, :m] = cost
+    ext[n:, m:] = 0.0
+    rows, cols = linear_sum_assignment(ext)
+    real = (rows < n) & (cols < m)
+    matches = np.column_stack([rows[real], cols[real]])
+    matched_rows = np.zeros(n, dtype=bool)
+    matched_cols = np.zeros(m, dtype=bool)
+    matched_rows[matches[:, 0]] = True
+    matched_cols[matches[:, 1]] = True
+    return matches, np.flatnonzero(~matched_rows), np.flatnonzero(~matched_cols)
+
+
+class ArrayByteTracker:
+    """
+    與 ultralytics BYTETracker 相同的介面：update(results) 的 results 需有 xywh / conf / cls (像素座標)。
+    離線處理整段影片時用 track()，偵測的換算一次做完。
+    args 為 bytetrack.yaml 的設定 (track_high_thresh、track_low_thresh、new_track_thresh、track_buffer、
+    match_thresh、fuse_score)。track 的索引 i 對應 track_id = i + 1。
+    """
+
+    def __init__(self, args, capacity=1024):
+        self.args = args
+        self.max_frames_lost = int(args.track_buffer)
+        self.fuse = bool(getattr(args, "fuse_score", False))
+        self.frame_id = 0
+        self.size = 0
+        self.capacity = 0
+        self._allocate(capacity)
+        self.tracked = []   # 順序與 BYTETracker.tracked_stracks 相同
+        self.lost = []
+        self.removed = deque()
+        self.removed_count = {}
+
+    def _allocate(self, capacity):
+        def grow(name, shape, dtype):
+            new = np.zeros((capacity, *shape), dtype)
+            if self.size:
+                new[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, new)
+        grow("mean", (8,), np.float64)
+        grow("cov", (8, 8), np.float64)
+        grow("state", (), np.int8)
+        grow("activated", (), bool)
+        grow("last_frame", (), np.int64)
+        grow("start_frame", (), np.int64)
+        grow("score", (), np.float64)
+        grow("cls", (), np.float64)
+        grow("idx", (), np.float64)
+        self.capacity = capacity
+
+    # ---- Kalman filter (KalmanFilterXYAH 的批次版，浮點運算順序相同) ----
+
+    def _predict(self, ids):
+        mean = self.mean[ids]
+        mean[self.state[ids] != TRACKED, 7] = 0
+        std = mean[:, 3:4] * _PROCESS_W + _PROCESS_C
+        cov = self.cov[ids]
+        cov[:, :4] += cov[:, 4:]          # F @ P
+        cov[:, :, :4] += cov[:, :, 4:]    # (F @ P) @ F.T
+        cov += np.square(std)[:, :, None] * _EYE8
+        mean[:, :4] += mean[:, 4:]
+        self.mean[ids] = mean
+        self.cov[ids] = cov
+
+    def _update(self, ids, xyah):
+        mean, cov = self.mean[ids], self.cov[ids]
+        std = mean[:, 3:4] * _MEASURE_W + _MEASURE_C
+        projected = cov[:, :4, :4] + np.square(std)[:, :, None] * _EYE4
+        gain = np.linalg.solve(projected, cov[:, :, :4].transpose(0, 2, 1)).transpose(0, 2, 1)
+        innovation = xyah - mean[:, :4]
+        self.mean[ids] = mean + np.einsum("ki,kji->kj", innovation, gain)
+        self.cov[ids] = cov - gain @ projected @ gain.transpose(0, 2, 1)
+
+    # ---- track 狀態 ----
+
+    def _xyxy(self, ids):
+        return xyah_to_xyxy(self.mean[ids, :4])
+
+    def _apply(self, ids, dets, rows):
+        """配對成功：Kalman update 並更新分數、類別 (update 與 re_activate 相同)。"""
+        self._update(ids, dets["xyah"][rows])
+        self.state[ids] = TRACKED
+        self.activated[ids] = True
+        self.last_frame[ids] = self.frame_id
+        self.score[ids] = dets["conf"][rows]
+        self.cls[ids] = dets["cls"][rows]
+        self.idx[ids] = dets["idx"][rows]
+
+    def _new_tracks(self, dets, rows):
+        n = len(rows)
+        if self.size + n > self.capacity:
+            self._allocate(max(self.capacity * 2, self.size + n))
+        ids = slice(self.size, self.size + n)
+        xyah = dets["xyah"][rows]
+        self.mean[ids] = 0
+        self.mean[ids, :4] = xyah
+        std = xyah[:, 3:4].astype(np.float64) * _INITIAL_W + _PROCESS_C
+        self.cov[ids] = np.square(std)[:, :, None] * _EYE8
+        self.state[ids] = TRACKED
+        self.activated[ids] = self.frame_id == 1
+        self.last_frame[ids] = self.frame_id
+        self.start_frame[ids] = self.frame_id
+        self.score[ids] = dets["conf"][rows]
+        self.cls[ids] = dets["cls"][rows]
+        self.idx[ids] = dets["idx"][rows]
+        self.size += n
+        return list(range(ids.start, ids.stop))
+
+    def _dists(self, xyxy, dets, rows):
+        d = iou_distance(xyxy, dets["xyxy"][rows])
+        if self.fuse:
+            d = 1 - (1 - d) * dets["conf"][rows][None]
+        return d
+
+    def _split(self, dets, idx):
+        """依門檻分成高分 / 低分偵測 (各自保持原本順序)。"""
+        args, conf = self.args, dets["conf"]
+        high = dets["valid"] & (conf >= args.track_high_thresh)
+        low = dets["valid"] & (conf > args.track_low_thresh) & (conf < args.track_high_thresh)
+        pick = lambda m: {k: dets[k][m] for k in ("xyah", "xyxy", "conf", "cls")} | {"idx": idx[m]}
+        return pick(high), pick(low)
+
+    def update(self, results, img=None):
+        """一幀的偵測 -> (N, 8) [x1, y1, x2, y2, track_id, score, cls, idx]，與 BYTETracker.update() 相同。"""
+        dets = detection_arrays(results.xywh, results.conf, results.cls)
+        self._step(*self._split(dets, np.arange(len(dets["conf"]), dtype=np.float64)))
+        return self._output()
+
+    def track(self, frame, xywh, conf, cls, n_frames=None):
+        """
+        離線追蹤整段影片：frame 為遞增排序的幀編號 (由 1 起算)，沒有偵測的幀也會更新。
+        回傳每幀 update() 結果串接的陣列，前面多一欄幀編號；idx 為輸入資料列的索引。
+        """
+        frame = np.asarray(frame)
+        n_frames = int(n_frames if n_frames is not None else (frame.max() if len(frame) else 0))
+        high, low = self._split(detection_arrays(xywh, conf, cls), np.arange(len(frame), dtype=np.float64))
+        frame_high = frame[high["idx"].astype(np.int64)]
+        frame_low = frame[low["idx"].astype(np.int64)]
+        bounds_high = np.searchsorted(frame_high, np.arange(1, n_frames + 2)).tolist()
+        bounds_low = np.searchsorted(frame_low, np.arange(1, n_frames + 2)).tolist()
+        parts = []
+        for f in range(1, n_frames + 1):
+            h0, h1, l0, l1 = bounds_high[f - 1], bounds_high[f], bounds_low[f - 1], bounds_low[f]
+            if h0 == h1 and not self.tracked and not self.lost:
+                self.frame_id += 1   # 沒有 track 也沒有高分偵測：這一幀不會有任何變化
+                continue
+            self._step({k: v[h0:h1] for k, v in high.items()}, {k: v[l0:l1] for k, v in low.items()})
+            out = self._output()
+            if len(out):
+                parts.append(np.column_stack([np.full(len(out), f, dtype=np.float32), out]))
+        return np.concatenate(parts) if parts else np.zeros((0, 9), dtype=np.float32)
+
+    def _output(self):
+        out = [t for t in self.tracked if self.activated[t]]
+        rows = np.empty((len(out), 8))
+        if out:
+            rows[:, :4] = self._xyxy(out)
+            rows[:, 4] = np.add(out, 1)
+            rows[:, 5] = self.score[out]
+            rows[:, 6] = self.cls[out]
+            rows[:, 7] = self.idx[out]
+        return rows.astype(np.float32)
+
+    def _step(self, high, low):
+        self.frame_id += 1
+        args = self.args
+        activated, refind, lost, removed = [], [], [], []
+
+        unconfirmed = [t for t in self.tracked if not self.activated[t]]
+        confirmed = [t for t in self.tracked if self.activated[t]]
+        seen = set(confirmed)
+        pool = np.array(confirmed + [t for t in self.lost if t not in seen], dtype=np.int64)
+        if len(pool):
+            self._predict(pool)
+        pool_xyxy = self._xyxy(pool)
+
+        # 第一次關聯：tracked + lost 對高分偵測
+        u_det = np.arange(len(high["conf"]))
+        u_track = np.arange(len(pool))
+        if len(pool) and len(u_det):
+            matches, u_track, u_det = linear_assignment(self._dists(pool_xyxy, high, u_det), args.match_thresh)
+            if len(matches):
+                m_ids = pool[matches[:, 0]]
+                was_tracked = self.state[m_ids] == TRACKED
+                activated.extend(m_ids[was_tracked].tolist())
+                refind.extend(m_ids[~was_tracked].tolist())
+                self._apply(m_ids, high, matches[:, 1])
+
+        # 第二次關聯：剩下的 tracked 對低分偵測 (只用 IoU)
+        u_track = u_track[self.state[pool[u_track]] == TRACKED]
+        r_tracked = pool[u_track]
+        u_second = np.arange(len(r_tracked))
+        if len(r_tracked) and len(low["conf"]):
+            matches, u_second, _ = linear_assignment(iou_distance(pool_xyxy[u_track], low["xyxy"]), 0.5)
+            if len(matches):
+                m_ids = r_tracked[matches[:, 0]]
+                activated.extend(m_ids.tolist())
+                self._apply(m_ids, low, matches[:, 1])
+        gone = r_tracked[u_second]
+        self.state[gone] = LOST
+        lost.extend(gone.tolist())
+
+        # 未確認的 track 對剩下的高分偵測
+        if unconfirmed:
+            unconfirmed = np.array(unconfirmed, dtype=np.int64)
+            matches, u_unconfirmed, u_rest = linear_assignment(self._dists(self._xyxy(unconfirmed), high, u_det), 0.7)
+            if len(matches):
+                m_ids = unconfirmed[matches[:, 0]]
+                self._apply(m_ids, high, u_det[matches[:, 1]])
+                activated.extend(m_ids.tolist())
+            dropped = unconfirmed[u_unconfirmed]
+            self.state[dropped] = REMOVED
+            removed.extend(dropped.tolist())
+            u_det = u_det[u_rest]
+
+        # 新 track
+        new_rows = u_det[high["conf"][u_det] >= args.new_track_thresh]
+        if len(new_rows):
+            activated.extend(self._new_tracks(high, new_rows))
+
+        # 遺失太久的 track
+        for t in self.lost:
+            if self.frame_id - self.last_frame[t] > self.max_frames_lost:
+                self.state[t] = REMOVED
+                removed.append(t)
+
+        self._merge(activated, refind, lost, removed)
+
+    def _merge(self, activated, refind, lost, removed):
+        """
+        與 ultralytics 的 merge_track_pools 相同的每幀收尾。注意它先以「之前幀」移除的 track 過濾 lost，
+        所以這一幀才移除的 lost track 會多留在 lost 一幀。
+        """
+        tracked = [t for t in self.tracked if self.state[t] == TRACKED]
+        seen = set(tracked)
+        for t in activated + refind:
+            if t not in seen:
+                seen.add(t)
+                tracked.append(t)
+        pool = [t for t in self.lost if t not in seen] + lost
+        pool = [t for t in pool if t not in self.removed_count]
+        if tracked and pool:
+            xyxy = self._xyxy(tracked + pool)
+            p, q = np.nonzero(iou_distance(xyxy[:len(tracked)], xyxy[len(tracked):]) < DUPLICATE_IOU_DIST)
+            if len(p):
+                t_arr, l_arr = np.array(tracked)[p], np.array(pool)[q]
+                older = self.last_frame[t_arr] - self.start_frame[t_arr] > self.last_frame[l_arr] - self.start_frame[l_arr]
+                drop_p, drop_q = set(p[~older].tolist()), set(q[older].tolist())
+                tracked = [t for i, t in enumerate(tracked) if i not in drop_p]
+                pool = [t for i, t in enumerate(pool) if i not in drop_q]
+        self.tracked, self.lost = tracked, pool
+        for t in removed:
+            self.removed.append(t)
+            self.removed_count[t] = self.removed_count.get(t, 0) + 1
+        while len(self.removed) > REMOVED_BUFFER:
+            t = self.removed.popleft()
+            self.removed_count[t] -= 1
+            if not self.removed_count[t]:
+                del self.removed_count[t]
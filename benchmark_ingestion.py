@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+標籤讀取 (ingestion) 效能測試。
+
+產生一個合成的追蹤 session (預設 100k 幀、每幀 0~8 個物件，格式與
+`yolo track save_txt=True save_conf=True` 相同)，比較：
+1. legacy：analyze_and_serve_template.py 原本的逐檔 read_text + 逐行 split + 每列一個 dict
+2. label_loader：os.scandir + thread pool + 批次向量化解析 (不使用快取)
+3. label_loader (cached)：讀取 .labels_cache.npz
+4. detections.npz：轉換一次後，只讀取 frame / cls / conf / track_id 欄位
+
+使用方式：
+    python benchmark_ingestion.py                       # 在暫存目錄產生 100k 幀後測試
+    python benchmark_ingestion.py --dir runs/bench_labels --keep
+    python benchmark_ingestion.py --dir runs/predict/xxx/labels   # 測試既有的 labels 目錄
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from label_loader import load_label_dir
+from detection_store import DetectionStore, convert_labels
+
+
+def generate_session(labels_dir, frames=100000, max_objects=8, features=0, seed=0):
+    """寫出合成的逐幀標籤檔；物件以數個 track 在畫面中移動。"""
+    labels_dir = Path(labels_dir)
+    labels_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(0, max_objects + 1, frames)
+    for f, n in enumerate(counts, start=1):
+        lines = []
+        for k in range(n):
+            tid = k + 1 + (f // 900) * max_objects  # 每 900 幀換一批 track
+            xc, yc = (0.1 + 0.8 * ((f * 0.001 + 0.13 * k) % 1.0)), 0.1 + 0.08 * k
+            vals = [k % 3, xc, yc, 0.05, 0.08, rng.uniform(0.3, 1.0), tid]
+            if features:
+                vals += list(rng.standard_normal(features).round(4))
+            lines.append(" ".join(f"{v:g}" for v in vals))
+        (labels_dir / f"video_{f}.txt").write_text("\n".join(lines) + ("\n" if lines else ""), encoding="utf-8")
+    return int(counts.sum())
+
+
+def legacy_ingest(labels_dir):
+    """analyze_and_serve_template.py 原本的讀取方式。"""
+    rows = []
+    for txt in sorted(Path(labels_dir).glob("*.txt"), key=lambda p: p.name):
+        stem = txt.stem
+        try:
+            frame_index = int(float(stem))
+        except ValueError:
+            frame_index = stem
+        for ln in txt.read_text(encoding="utf-8").splitlines():
+            p = ln.strip().split()
+            if len(p) >= 7:
+                cid, xc, yc, w, h, conf, tid = p[:7]
+                try:
+                    cid_i = int(float(cid)); tid_i = int(float(tid)); conf_f = float(conf)
+                except ValueError:
+                    continue
+                rows.append({"frame": frame_index, "cls": cid_i, "conf": conf_f, "track_id": tid_i})
+    return pd.DataFrame(rows)
+
+
+def vectorized_ingest(labels_dir, use_cache=False):
+    data = load_label_dir(labels_dir, with_features=False, use_cache=use_cache)
+    return pd.DataFrame({k: data[k] for k in ("frame", "cls", "conf", "track_id")})
+
+
+def _time(fn, *a, **kw):
+    t0 = time.perf_counter()
+    out = fn(*a, **kw)
+    return time.perf_counter() - t0, out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark tracking-label ingestion on a synthetic session.")
+    parser.add_argument("--dir", default=None, help="Labels directory (generated if missing or empty).")
+    parser.add_argument("--frames", type=int, default=100000)
+    parser.add_argument("--max_objects", type=int, default=8)
+    parser.add_argument("--features", type=int, default=0, help="Feature columns per row in the synthetic labels.")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated directory.")
+    parser.add_argument("--skip_legacy", action="store_true", help="Do not run the slow per-line baseline.")
+    args = parser.parse_args()
+
+    tmp_root = None
+    labels_dir = Path(args.dir) if args.dir else None
+    if labels_dir is None:
+        tmp_root = Path(tempfile.mkdtemp(prefix="bench_labels_"))
+        labels_dir = tmp_root / "labels"
+    if not labels_dir.exists() or not any(labels_dir.glob("*.txt")):
+        print(f"Generating {args.frames} frames in {labels_dir} ...")
+        t, n = _time(generate_session, labels_dir, args.frames, args.max_objects, args.features)
+        print(f"  {n} detections written in {t:.1f}s")
+
+    results = []
+    if not args.skip_legacy:
+        t, df = _time(legacy_ingest, labels_dir)
+        results.append(("legacy read_text + split + dicts", t, len(df)))
+    t, df = _time(vectorized_ingest, labels_dir)
+    results.append(("label_loader (scandir + threads + numpy)", t, len(df)))
+    vectorized_ingest(labels_dir, use_cache=True)  # 建立快取
+    t, df = _time(vectorized_ingest, labels_dir, use_cache=True)
+    results.append(("label_loader (cached .labels_cache.npz)", t, len(df)))
+    store_path = labels_dir.parent / "bench_detections.npz"
+    t_conv, _ = _time(convert_labels, labels_dir, store_path)
+    with DetectionStore(store_path) as store:
+        t, df = _time(store.dataframe, ["frame", "cls", "conf", "track_id"])
+    results.append(("detections.npz (4 columns)", t, len(df)))
+
+    base = results[0][1]
+    print(f"\n{'method':<45}{'seconds':>10}{'rows':>12}{'speedup':>10}")
+    for name, t, n in results:
+        print(f"{name:<45}{t:>10.3f}{n:>12}{base / t:>9.1f}x")
+    print(f"(one-off conversion to detections.npz: {t_conv:.2f}s)")
+
+    os.remove(store_path)
+    for cache in labels_dir.glob(".labels_cache.npz"):
+        os.remove(cache)
+    if tmp_root is not None and not args.keep:
+        shutil.rmtree(tmp_root, ignore_errors=True)
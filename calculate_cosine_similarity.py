@@ -7,11 +7,13 @@ import numpy as np
 from scipy.spatial.distance import cosine
 from itertools import combinations
 import matplotlib.pyplot as plt
-import seaborn as sns
+from density_plot import kdeplot
 from ultralytics import YOLO
 import cv2
+from crop_sampling import CropSampler, add_sampling_args, sampler_from_args
+from sharded_tracking import DEFAULT_OVERLAP, add_sharding_args, run_sharded_tracking
 
-def analyze_cosine_similarity(model_path, video_path, yaml_path, output_dir):
+def analyze_cosine_similarity(model_path, video_path, yaml_path, output_dir, sampler=None, workers=1, shard_overlap=DEFAULT_OVERLAP):
     """
     Performs a two-stage process:
     1. Track objects to get bounding boxes and track IDs.
@@ -20,6 +22,7 @@ def analyze_cosine_similarity(model_path, video_path, yaml_path, output_dir):
     """
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
+    sampler = sampler or CropSampler()
 
     # --- 1. Load Model ---
     print(f"Loading model: {model_path}")
@@ -33,6 +36,16 @@ def analyze_cosine_similarity(model_path, video_path, yaml_path, output_dir):
         sys.exit(1)
 
     tracked_objects = []
+    if workers > 1:
+        # Track shards of the video in parallel worker processes; each worker also
+        # embeds its crops, so the objects below already carry a feature.
+        # Releasing the capture makes the serial loop below a no-op.
+        cap.release()
+        records = run_sharded_tracking(video_path, model_path, "bytetrack.yaml", workers, shard_overlap,
+                                       embed_model=model_path, embed_mode="embed", sampler=sampler)
+        tracked_objects = [{"track_id": r["track_id"], "cls_id": r["cls_id"], "frame": r["frame"], "feature": r["feature"]}
+                           for r in records if r["feature"] is not None]
+
     frame_idx = 0
     while cap.isOpened():
         ret, frame = cap.read()
@@ -45,24 +58,24 @@ def analyze_cosine_similarity(model_path, video_path, yaml_path, output_dir):
             track_ids = results[0].boxes.id.int().cpu().tolist()
             class_ids = results[0].boxes.cls.int().cpu().tolist()
             boxes = results[0].boxes.xyxy.cpu().numpy()
+            confs = results[0].boxes.conf.cpu().tolist()
 
-            for track_id, class_id, box in zip(track_ids, class_ids, boxes):
+            for track_id, class_id, box, conf in zip(track_ids, class_ids, boxes, confs):
                 # Crop the object from the frame
                 x1, y1, x2, y2 = map(int, box)
                 cropped_img = frame[y1:y2, x1:x2]
                 
                 if cropped_img.size > 0:
-                    tracked_objects.append({
-                        "track_id": track_id,
-                        "cls_id": class_id,
-                        "image": cropped_img
-                    })
+                    # The sampling policy decides which crops are worth embedding
+                    tracked_objects.extend(sampler.offer(track_id, frame_idx, cropped_img, conf, cls_id=class_id))
         frame_idx += 1
         if frame_idx % 50 == 0:
             print(f"  Processed {frame_idx} frames for tracking...")
     
     cap.release()
+    tracked_objects.extend(sampler.flush())
     print(f"Tracking complete. Found {len(tracked_objects)} object instances.")
+    print(sampler.summary())
 
     if not tracked_objects:
         print("Error: No objects were tracked in the video.")
@@ -74,13 +87,17 @@ def analyze_cosine_similarity(model_path, video_path, yaml_path, output_dir):
     # Use a model specifically for embedding if possible, here we use the same model
     # The `embed` method is the correct one for this task.
     for i, obj in enumerate(tracked_objects):
-        # The embed method expects a list of images
-        results = model.embed(source=[obj['image']], verbose=False)
-        if results and results[0] is not None:
+        feature = obj.get('feature')
+        if feature is None:
+            # The embed method expects a list of images
+            results = model.embed(source=[obj['image']], verbose=False)
+            if results and results[0] is not None:
+                feature = results[0].flatten().cpu().numpy() # Convert to CPU numpy array
+        if feature is not None:
             all_features.append({
                 "track_id": obj['track_id'],
                 "cls_id": obj['cls_id'],
-                "feature": results[0].flatten().cpu().numpy() # Convert to CPU numpy array
+                "feature": feature
             })
         if (i+1) % 50 == 0:
             print(f"  Extracted features for {i+1}/{len(tracked_objects)} objects...")
@@ -140,9 +157,9 @@ def analyze_cosine_similarity(model_path, video_path, yaml_path, output_dir):
     plt.style.use('seaborn-v0_8-whitegrid')
     fig, ax = plt.subplots(figsize=(12, 7))
     if intra_class_dist:
-        sns.kdeplot(data=pd.DataFrame(intra_class_dist), x='distance', ax=ax, color='blue', label='Intra-class Distance', fill=True)
+        kdeplot(ax, [d['distance'] for d in intra_class_dist], color='blue', label='Intra-class Distance', fill=True)
     if inter_class_dist:
-        sns.kdeplot(data=pd.DataFrame(inter_class_dist), x='distance', ax=ax, color='red', label='Inter-class Distance', fill=True)
+        kdeplot(ax, [d['distance'] for d in inter_class_dist], color='red', label='Inter-class Distance', fill=True)
     ax.set_title('Distribution of Cosine Distances', fontsize=16)
     ax.set_xlabel('Cosine Distance', fontsize=12)
     ax.set_ylabel('Density', fontsize=12)
@@ -157,7 +174,10 @@ if __name__ == "__main__":
     parser.add_argument("--video", type=str, default="wildlife.mp4", help="Path to the video file.")
     parser.add_argument("--yaml", type=str, default="datasets/wildlife/wildlife.yaml", help="Path to the dataset YAML file.")
     parser.add_argument("--output_dir", type=str, default="runs/analyze/cosine_analysis", help="Directory to save results.")
+    add_sampling_args(parser)
+    add_sharding_args(parser)
     args = parser.parse_args()
 
-    analyze_cosine_similarity(args.model, args.video, args.yaml, args.output_dir)
+    analyze_cosine_similarity(args.model, args.video, args.yaml, args.output_dir, sampler_from_args(args),
+                              args.workers, args.shard_overlap)
     print("\nAnalysis complete.")
@@ -4,14 +4,17 @@ import torch
 import numpy as np
 import pandas as pd
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict, deque
+import cv2
 from ultralytics import YOLO
-from collections import defaultdict
 import matplotlib.pyplot as plt
-import seaborn as sns
+from density_plot import histplot
 from sklearn.metrics.pairwise import cosine_similarity
 
 # --- Configuration ---
 DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+CACHE_NAME = '.embedding_cache.npz'  # 存放在 crops/ 目錄下
 
 def load_reid_model(model_path):
     """載入 Re-ID 模型"""
@@ -20,10 +23,92 @@ def load_reid_model(model_path):
     model.to(DEVICE)
     return model
 
-def extract_features(model, image_path):
-    """從單張圖片中提取 Re-ID 特徵"""
-    results = model(image_path, verbose=False)
-    return results[0].obb.cls.cpu().numpy() if results[0].obb is not None else None
+def extract_features(model, images):
+    """
+    從一批圖片 (BGR ndarray) 中提取 Re-ID 特徵，回傳 (len(images), d) 的陣列。
+    以 model.embed 一次推論整批，而不是逐張呼叫 model(image_path)。
+    """
+    results = model.embed(source=images, verbose=False)
+    return np.concatenate([np.atleast_2d(r.cpu().numpy()) for r in results]).astype(np.float32)
+
+def model_fingerprint(model_path):
+    """模型的識別字串 (檔名 + 大小 + mtime)，模型改變時快取自動失效。"""
+    try:
+        st = os.stat(model_path)
+        return f"{os.path.basename(model_path)}:{st.st_size}:{st.st_mtime_ns}"
+    except OSError:
+        return os.path.basename(model_path)
+
+class EmbeddingCache:
+    """
+    以 (相對路徑, 檔案大小, mtime) 為鍵的裁切圖特徵快取，存成單一 .npz。
+    重新分析時只有新增或變動過的裁切圖需要重新解碼與推論。
+    """
+
+    def __init__(self, path, fingerprint, root):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.root = root
+        self.entries = {}
+        self.hits = 0
+        if os.path.exists(path):
+            try:
+                with np.load(path, allow_pickle=False) as data:
+                    if str(data['fingerprint']) == fingerprint:
+                        for key, size, mtime, feature in zip(data['paths'], data['sizes'], data['mtimes'], data['features']):
+                            self.entries[str(key)] = (int(size), int(mtime), feature)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Warning: ignoring unreadable embedding cache {path}: {e}")
+
+    def _key(self, image_path):
+        return os.path.relpath(image_path, self.root).replace(os.sep, '/')
+
+    def get(self, image_path, st):
+        entry = self.entries.get(self._key(image_path))
+        if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            self.hits += 1
+            return entry[2]
+        return None
+
+    def put(self, image_path, st, feature):
+        self.entries[self._key(image_path)] = (st.st_size, st.st_mtime_ns, np.asarray(feature, dtype=np.float32))
+
+    def save(self, keep_paths=None):
+        """寫入快取 (先寫暫存檔再取代)；keep_paths 指定時只保留仍存在的裁切圖。"""
+        keys = sorted(self.entries) if keep_paths is None else sorted({self._key(p) for p in keep_paths} & set(self.entries))
+        dims = {self.entries[k][2].shape for k in keys}
+        if not keys or len(dims) != 1:
+            return
+        tmp = self.path + '.tmp.npz'
+        np.savez(tmp, fingerprint=np.array(self.fingerprint),
+                 paths=np.array(keys),
+                 sizes=np.array([self.entries[k][0] for k in keys], dtype=np.int64),
+                 mtimes=np.array([self.entries[k][1] for k in keys], dtype=np.int64),
+                 features=np.stack([self.entries[k][2] for k in keys]))
+        os.replace(tmp, self.path)
+
+def iter_decoded_batches(image_paths, batch_size=32, workers=8, prefetch=4):
+    """
+    在 thread pool 中預先讀取並解碼裁切圖 (cv2.imread 會釋放 GIL)，
+    依序產生 (paths, images) 批次；同時最多有 prefetch 個批次在解碼中。
+    """
+    batches = [image_paths[i:i + batch_size] for i in range(0, len(image_paths), batch_size)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append((batch, [pool.submit(cv2.imread, p) for p in batch]))
+            if len(pending) > prefetch:
+                yield _collect(*pending.popleft())
+        while pending:
+            yield _collect(*pending.popleft())
+
+def _collect(batch, futures):
+    pairs = [(p, f.result()) for p, f in zip(batch, futures)]
+    ok = [(p, img) for p, img in pairs if img is not None and img.size > 0]
+    for p, img in pairs:
+        if img is None or img.size == 0:
+            print(f"Could not decode image: {p}. Skipping.")
+    return [p for p, _ in ok], [img for _, img in ok]
 
 def parse_tracking_results(track_dir):
     """
@@ -79,19 +164,53 @@ def parse_tracking_results(track_dir):
 
     return id_data
 
-def analyze_cosine_similarity(reid_model, id_data):
+def analyze_cosine_similarity(reid_model, id_data, cache=None, batch_size=32, workers=8):
     """分析餘弦相似度"""
     print("Analyzing cosine similarity...")
     id_features = defaultdict(list)
 
-    # 1. 為每個 ID 的每張圖片提取特徵
+    # 1. 為每個 ID 的每張圖片提取特徵 (已快取的直接使用，其餘平行解碼後批次推論)
     print("Step 1: Extracting Re-ID features for each tracked object...")
-    for track_id, data_list in id_data.items():
-        for data in data_list:
-            for img_path in data['images']:
-                feature = extract_features(reid_model, img_path)
-                if feature is not None:
-                    id_features[track_id].append(feature.flatten())
+    image_tracks = [(track_id, img_path) for track_id, data_list in id_data.items()
+                    for data in data_list for img_path in data['images']]
+    features_by_path = {}
+    stats = {}
+    for _, img_path in image_tracks:
+        try:
+            stats[img_path] = os.stat(img_path)
+        except OSError:
+            continue
+        if cache is not None:
+            feature = cache.get(img_path, stats[img_path])
+            if feature is not None:
+                features_by_path[img_path] = feature
+
+    todo = [p for p in stats if p not in features_by_path]
+    if cache is not None:
+        print(f"  {len(features_by_path)} crops served from cache, {len(todo)} to embed.")
+    done = 0
+    for paths, images in iter_decoded_batches(todo, batch_size=batch_size, workers=workers):
+        if not images:
+            continue
+        features = extract_features(reid_model, images)
+        if len(features) != len(paths):
+            print(f"Warning: model returned {len(features)} embeddings for {len(paths)} crops. Skipping batch.")
+            continue
+        for img_path, feature in zip(paths, features):
+            features_by_path[img_path] = feature
+            if cache is not None:
+                cache.put(img_path, stats[img_path], feature)
+        done += len(paths)
+        if done % (batch_size * 20) < batch_size:
+            print(f"  embedded {done}/{len(todo)} crops")
+
+    for track_id, img_path in image_tracks:
+        feature = features_by_path.get(img_path)
+        if feature is not None:
+            id_features[track_id].append(feature.flatten())
+
+    if cache is not None:
+        cache.save(keep_paths=list(stats))
 
     # 2. 計算 ID 內部（intra-ID）的餘弦相似度
     print("Step 2: Calculating intra-ID (self) cosine similarity...")
@@ -150,8 +269,9 @@ def save_results(output_dir, intra_class_distances):
 
     # 繪製分佈圖
     if not df.empty:
-        plt.figure(figsize=(12, 7))
-        sns.histplot(data=df, x='cosine_distance', hue='class', kde=True, multiple="stack")
+        fig, ax = plt.subplots(figsize=(12, 7))
+        histplot(ax, {name: g['cosine_distance'].to_numpy() for name, g in df.groupby('class')}, kde=True, stack=True)
+        ax.legend(title='class')
         plt.title('Distribution of Intra-Class Cosine Distances (Different IDs, Same Class)')
         plt.xlabel('Cosine Distance (1 - Similarity)')
         plt.ylabel('Count')
@@ -169,6 +289,9 @@ def main():
     parser.add_argument('--track_dir', type=str, required=True, help='Path to the tracking results directory.')
     parser.add_argument('--model', type=str, required=True, help='Path to the Re-ID model.')
     parser.add_argument('--output_dir', type=str, required=True, help='Path to save the analysis results.')
+    parser.add_argument('--batch_size', type=int, default=32, help='Crops per Re-ID inference batch.')
+    parser.add_argument('--workers', type=int, default=8, help='Threads used to read and decode crops.')
+    parser.add_argument('--no_cache', action='store_true', help='Do not read or write crops/%s.' % CACHE_NAME)
     args = parser.parse_args()
 
     if not os.path.exists(args.track_dir):
@@ -179,7 +302,10 @@ def main():
     id_data = parse_tracking_results(args.track_dir)
     
     if id_data:
-        intra_id_sim, intra_class_dist = analyze_cosine_similarity(reid_model, id_data)
+        crops_dir = os.path.join(args.track_dir, 'crops')
+        cache = None if args.no_cache else EmbeddingCache(os.path.join(crops_dir, CACHE_NAME), model_fingerprint(args.model), crops_dir)
+        intra_id_sim, intra_class_dist = analyze_cosine_similarity(reid_model, id_data, cache=cache,
+                                                                   batch_size=args.batch_size, workers=args.workers)
         save_results(args.output_dir, intra_class_dist)
         print("Analysis complete.")
     else:
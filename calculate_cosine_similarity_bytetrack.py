@@ -1,40 +1,112 @@
 import argparse
+import json
 import sys
 from pathlib import Path
 import yaml
 import pandas as pd
-import numpy as np
 from scipy.spatial.distance import cosine
 from itertools import combinations
 import matplotlib.pyplot as plt
-import seaborn as sns
+from density_plot import kdeplot
 from ultralytics import YOLO
 import cv2
-import sklearn.metrics.pairwise # Import the module explicitly
+from crop_sampling import CropSampler, add_sampling_args, sampler_from_args
+from sharded_tracking import DEFAULT_OVERLAP, add_sharding_args, run_sharded_tracking
+from track_embedding_stats import TrackEmbeddingAccumulator
+from reid_gallery import add_session_tracks, feature_kind
+from embedding_projection import add_projection_args, dequantize, stream_from_args
+from analysis_checkpoint import Checkpointer, add_checkpoint_args
 
-def analyze_cosine_similarity(model_path, video_path, yaml_path, output_dir):
+def analyze_cosine_similarity(model_path, video_path, yaml_path, output_dir, sampler=None, gallery_dir=None, workers=1, shard_overlap=DEFAULT_OVERLAP, projection=None,
+                              resume=False, checkpoint_every=500):
     """
     Performs a two-stage process:
     1. Track objects to get bounding boxes and track IDs.
     2. Extract feature embeddings for each tracked object.
     3. Perform cosine similarity analysis.
+    projection (embedding_projection.ProjectionStream) optionally reduces the
+    embeddings before they are accumulated, compared and stored in the gallery;
+    int8 projections are dequantized to float unit vectors before accumulation.
+    In serial mode a checkpoint is written every `checkpoint_every` frames and
+    resume=True continues from the last one.
     """
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
+    sampler = sampler or CropSampler()
 
-    # --- 1. Load Model ---
+    # --- 1. Load Models ---
     print(f"Loading model: {model_path}")
     model = YOLO(model_path)
+    # A second instance computes the embeddings while tracking runs, so the
+    # embed() calls never touch the tracker state held by `model.predictor`.
+    embedder = YOLO(model_path)
 
-    # --- 2. First Pass: Tracking ---
+    # --- 2. Load Class Names ---
+    names = {}
+    yaml_path = Path(yaml_path)
+    if yaml_path.exists():
+        with open(yaml_path, "r", encoding="utf-8") as f:
+            d = yaml.safe_load(f)
+        raw = d.get("names", {})
+        if isinstance(raw, dict):
+            names = {int(k): str(v) for k, v in raw.items()}
+        elif isinstance(raw, list):
+            names = {i: str(v) for i, v in enumerate(raw)}
+
+    # --- 3. Feature Extraction ---
+    # Sampled crops are embedded as soon as the sampler releases them and folded
+    # into per-track running sums, so neither crops nor per-detection features
+    # are kept: memory stays O(d) per track no matter how long the video is.
+    accumulator = TrackEmbeddingAccumulator()
+    n_objects = 0
+
+    def add_object(obj):
+        nonlocal n_objects
+        n_objects += 1
+        feature = obj.get('feature')
+        if feature is None:
+            # The embed method expects a list of images
+            results = embedder.embed(source=[obj['image']], verbose=False)
+            if results and results[0] is not None:
+                feature = results[0].flatten().cpu().numpy()
+        if feature is not None:
+            cls_name = names.get(obj['cls_id'], f"cls{obj['cls_id']}")
+            # Buffer only the ids, not the crop, while the projection is being fitted
+            item = (obj['track_id'], cls_name, obj['frame'])
+            for (track_id, cls_name, frame), f in (projection.push(item, feature) if projection else [(item, feature)]):
+                accumulator.update(track_id, dequantize(f), cls_name, frame)
+
+    # --- 4. Tracking ---
     print(f"Processing video for tracking: {video_path}")
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         print(f"Error: Could not open video file {video_path}")
         sys.exit(1)
+    fps = cap.get(cv2.CAP_PROP_FPS) or None
 
-    tracked_objects = []
     frame_idx = 0
+    ckpt = None
+    if workers > 1:
+        # Track shards of the video in parallel worker processes; each worker also
+        # embeds its crops, so the objects below already carry a feature.
+        # Releasing the capture makes the serial loop below a no-op.
+        if resume:
+            print("Warning: --resume is only supported in serial mode (--workers 1); starting from the beginning.")
+        cap.release()
+        records = run_sharded_tracking(video_path, model_path, "bytetrack.yaml", workers, shard_overlap,
+                                       embed_model=model_path, embed_mode="embed", sampler=sampler)
+        for r in records:
+            if r["feature"] is not None:
+                add_object({"track_id": r["track_id"], "cls_id": r["cls_id"], "frame": r["frame"], "feature": r["feature"]})
+    else:
+        ckpt = Checkpointer(output_dir, video_path, checkpoint_every, resume)
+        if ckpt.state:
+            accumulator = ckpt.state["accumulator"]
+            sampler = ckpt.state["sampler"]
+            projection = ckpt.state["projection"]
+            n_objects = ckpt.state["n_objects"]
+            frame_idx = ckpt.resume(cap, model, "bytetrack.yaml")
+
     while cap.isOpened():
         ret, frame = cap.read()
         if not ret:
@@ -43,100 +115,64 @@ def analyze_cosine_similarity(model_path, video_path, yaml_path, output_dir):
         results = model.track(source=frame, persist=True, tracker="bytetrack.yaml", verbose=False)
         
         if results[0].boxes is not None and results[0].boxes.id is not None:
-            track_ids = results[0].boxes.id.int().cpu().tolist()
+            track_ids = [ckpt.track_id(t) for t in results[0].boxes.id.int().cpu().tolist()]
             class_ids = results[0].boxes.cls.int().cpu().tolist()
             boxes = results[0].boxes.xyxy.cpu().numpy()
+            confs = results[0].boxes.conf.cpu().tolist()
 
-            for track_id, class_id, box in zip(track_ids, class_ids, boxes):
+            for track_id, class_id, box, conf in zip(track_ids, class_ids, boxes, confs):
                 # Crop the object from the frame
                 x1, y1, x2, y2 = map(int, box)
                 cropped_img = frame[y1:y2, x1:x2]
                 
                 if cropped_img.size > 0:
-                    tracked_objects.append({
-                        "track_id": track_id,
-                        "cls_id": class_id,
-                        "image": cropped_img
-                    })
+                    # The sampling policy decides which crops are worth embedding
+                    for item in sampler.offer(track_id, frame_idx, cropped_img, conf, cls_id=class_id):
+                        add_object(item)
         frame_idx += 1
         if frame_idx % 50 == 0:
             print(f"  Processed {frame_idx} frames for tracking...")
+        if ckpt.due(frame_idx):
+            ckpt.save(frame_idx, model, {"accumulator": accumulator, "sampler": sampler,
+                                         "projection": projection, "n_objects": n_objects})
     
     cap.release()
-    print(f"Tracking complete. Found {len(tracked_objects)} object instances.")
+    for item in sampler.flush():
+        add_object(item)
+    print(f"Tracking complete. Embedded {n_objects} object instances.")
+    print(sampler.summary())
 
-    if not tracked_objects:
+    if not n_objects:
         print("Error: No objects were tracked in the video.")
         sys.exit(1)
 
-    # --- 3. Second Pass: Feature Extraction ---
-    print("Extracting features for tracked objects...")
-    all_features = []
-    # Use a model specifically for embedding if possible, here we use the same model
-    # The `embed` method is the correct one for this task.
-    for i, obj in enumerate(tracked_objects):
-        # The embed method expects a list of images
-        results = model.embed(source=[obj['image']], verbose=False)
-        if results and results[0] is not None:
-            all_features.append({
-                "track_id": obj['track_id'],
-                "cls_id": obj['cls_id'],
-                "feature": results[0].flatten().cpu().numpy() # Convert to CPU numpy array
-            })
-        if (i+1) % 50 == 0:
-            print(f"  Extracted features for {i+1}/{len(tracked_objects)} objects...")
-
-    if not all_features:
+    if projection:
+        for (track_id, cls_name, frame), f in projection.finish():
+            accumulator.update(track_id, dequantize(f), cls_name, frame)
+        report = projection.report()
+        if report:
+            with open(output_dir / "projection_report.json", "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"Projection {report['input_dim']} -> {report['dim']} dims: KS={report['ks_statistic']:.4f}, "
+                  f"mean |error|={report['mean_abs_error']:.4f} (see projection_report.json)")
+
+    if not len(accumulator):
         print("Error: Could not extract any features from the tracked objects.")
         sys.exit(1)
 
-    df = pd.DataFrame(all_features)
-    print(f"Successfully extracted {len(df)} feature vectors.")
+    print(f"Successfully extracted {accumulator.total_count} feature vectors.")
+    print(f"Accumulated features for {len(accumulator)} unique tracks.")
 
-    # --- 4. Load Class Names ---
-    names = {}
-    yaml_path = Path(yaml_path)
-    if yaml_path.exists():
-        with open(yaml_path, "r", encoding="utf-8") as f:
-            d = yaml.safe_load(f)
-        names = d.get("names", {})
-    df['cls_name'] = df['cls_id'].map(names).fillna(df['cls_id'].apply(lambda x: f"cls{x}"))
-
-    # --- 5. Group features by track_id and cls_name ---
-    # We need individual features for intra-ID similarity, not just the mean.
-    # Store all features for each track_id.
-    track_features_grouped = df.groupby('track_id').apply(
-        lambda x: {'cls_name': x['cls_name'].iloc[0], 'features': x['feature'].tolist()}
-    ).reset_index(name='data')
-    print(f"Grouped features for {len(track_features_grouped)} unique tracks.")
-
-    # --- 6. Cosine Similarity Calculation ---
-    intra_id_similarities = []
+    # --- 5. Intra-ID Similarity (closed form from the per-track sums) ---
+    print("Calculating Intra-ID similarities...")
+    intra_id_similarities = accumulator.intra_id_rows()
     intra_class_dist = []
     inter_class_dist = []
-    
-    # Calculate Intra-ID Similarity
-    print("Calculating Intra-ID similarities...")
-    for index, row in track_features_grouped.iterrows():
-        track_id = row['track_id']
-        cls_name = row['data']['cls_name']
-        features = row['data']['features']
-        
-        if len(features) > 1:
-            # Calculate pairwise cosine similarity for features of the same track
-            sim_matrix = sklearn.metrics.pairwise.cosine_similarity(features) # Use fully qualified name
-            # Get upper triangle of the similarity matrix (excluding diagonal)
-            upper_triangle_indices = np.triu_indices_from(sim_matrix, k=1)
-            if len(upper_triangle_indices[0]) > 0:
-                avg_sim = np.mean(sim_matrix[upper_triangle_indices])
-                # Store as distance (1 - similarity)
-                intra_id_similarities.append({'track_id': track_id, 'class': cls_name, 'avg_similarity': avg_sim, 'avg_distance': 1 - avg_sim})
 
+    # --- 6. Cosine Distance Calculation ---
     # Calculate Intra-Class and Inter-Class Distances
     # For this, we use the representative feature (mean) for each track_id
-    representative_features_df = df.groupby(['track_id', 'cls_name'])['feature'].apply(
-        lambda x: np.mean(np.vstack(x), axis=0)
-    ).reset_index()
+    representative_features_df = pd.DataFrame(accumulator.representative_rows())
     print(f"Calculated representative features for {len(representative_features_df)} unique tracks for inter/intra-class analysis.")
 
     all_classes = representative_features_df['cls_name'].unique()
@@ -185,13 +221,13 @@ def analyze_cosine_similarity(model_path, video_path, yaml_path, output_dir):
     ax1 = axes[0]
     if intra_id_similarities:
         intra_id_df = pd.DataFrame(intra_id_similarities)
-        sns.kdeplot(data=intra_id_df, x='avg_distance', ax=ax1, color='green', label='Intra-ID Distance (Self-Consistency)', fill=True)
+        kdeplot(ax1, intra_id_df['avg_distance'].to_numpy(), color='green', label='Intra-ID Distance (Self-Consistency)', fill=True)
     if intra_class_dist:
         intra_class_df = pd.DataFrame(intra_class_dist)
-        sns.kdeplot(data=intra_class_df, x='distance', ax=ax1, color='blue', label='Intra-class Distance (Different IDs, Same Class)', fill=True)
+        kdeplot(ax1, intra_class_df['distance'].to_numpy(), color='blue', label='Intra-class Distance (Different IDs, Same Class)', fill=True)
     if inter_class_dist:
         inter_class_df = pd.DataFrame(inter_class_dist)
-        sns.kdeplot(data=inter_class_df, x='distance', ax=ax1, color='red', label='Inter-class Distance (Different Classes)', fill=True)
+        kdeplot(ax1, inter_class_df['distance'].to_numpy(), color='red', label='Inter-class Distance (Different Classes)', fill=True)
 
     ax1.set_title('Distribution of Cosine Distances', fontsize=16)
     ax1.set_xlabel('Cosine Distance', fontsize=12)
@@ -212,13 +248,28 @@ def analyze_cosine_similarity(model_path, video_path, yaml_path, output_dir):
     print(f"Saved visualization to: {output_dir / 'cosine_distance_distribution_bytetrack.png'}")
     plt.close()
 
+    # Published last, so a gallery that rejects these features never costs the outputs above.
+    if gallery_dir:
+        add_session_tracks(gallery_dir, video_path, output_dir.name, accumulator.gallery_rows(), fps,
+                           feature_kind(model_path, "embed", projection))
+
+    if ckpt:
+        ckpt.done()
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="YOLOv12 Cosine Similarity Analysis")
     parser.add_argument("--model", type=str, default="best.pt", help="Path to the YOLO model.")
     parser.add_argument("--video", type=str, default="wildlife.mp4", help="Path to the video file.")
     parser.add_argument("--yaml", type=str, default="datasets/wildlife/wildlife.yaml", help="Path to the dataset YAML file.")
     parser.add_argument("--output_dir", type=str, default="runs/analyze/cosine_analysis", help="Directory to save results.")
+    parser.add_argument("--gallery", type=str, default=None, help="Re-ID gallery directory to add this session's tracks to.")
+    add_sampling_args(parser)
+    add_sharding_args(parser)
+    add_projection_args(parser)
+    add_checkpoint_args(parser)
     args = parser.parse_args()
 
-    analyze_cosine_similarity(args.model, args.video, args.yaml, args.output_dir)
+    analyze_cosine_similarity(args.model, args.video, args.yaml, args.output_dir, sampler_from_args(args), args.gallery,
+                              args.workers, args.shard_overlap, stream_from_args(args, args.model),
+                              args.resume, args.checkpoint_every)
     print("\nAnalysis complete.")
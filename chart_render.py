@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+分析報表 PNG 的延遲 (on-demand) 繪製與磁碟快取。
+
+分析模板原本在啟動伺服器前依序以 150 dpi 畫出四張 matplotlib 圖，但多數時候沒有人打開這些 PNG。
+這裡改為由 session 目錄中的 CSV 繪製：
+- ensure_chart()：第一次被請求時才繪製；PNG 已存在且比來源 CSV 新時直接使用 (磁碟快取)
+- render_all()：需要一次產生全部圖表時，以 process pool 平行繪製
+
+只使用 matplotlib 的 Figure / FigureCanvasAgg (不經過 pyplot 的全域狀態)，可在 Flask 的多執行緒中使用。
+
+    python chart_render.py --session_dir runs/analyze/track_xxx --workers 4   # 預先繪製全部圖表
+"""
+import os
+import time
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from timeseries_downsample import downsample
+
+DPI = 150
+PNG_POINTS = 3000  # Objects per Frame 以 min/max 分桶降到約為圖片寬度兩倍的點數
+
+
+def _objects_per_frame(df, ax):
+    x, y = downsample(df["frame"].to_numpy(), df["objects"].to_numpy(), PNG_POINTS, "minmax")
+    ax.plot(x, y)
+    ax.set_title("Objects per Frame")
+
+
+def _track_lifespan(df, ax):
+    ax.hist(df["seconds"], bins=20)
+    ax.set_title("Track Lifespan (seconds)")
+
+
+def _class_distribution(df, ax):
+    ax.bar(df["class"].astype(str), df["count"])
+    ax.tick_params(axis="x", labelrotation=45)
+    for label in ax.get_xticklabels():
+        label.set_ha("right")
+    ax.set_title("Class Distribution")
+
+
+def _avg_dwell(df, ax):
+    ax.bar(df["cls_name"].astype(str), df["avg_seconds"])
+    ax.tick_params(axis="x", labelrotation=45)
+    for label in ax.get_xticklabels():
+        label.set_ha("right")
+    ax.set_title("Average Dwell by Class")
+
+
+# PNG 名稱 -> (來源 CSV, 圖片大小, 繪圖函式)
+CHARTS = {
+    "objects_per_frame.png": ("objects_per_frame.csv", (10, 4), _objects_per_frame),
+    "track_lifespan_seconds.png": ("track_lifespans.csv", (6, 4), _track_lifespan),
+    "class_distribution.png": ("class_totals.csv", (7, 4), _class_distribution),
+    "avg_dwell_by_class.png": ("avg_dwell_by_class.csv", (7, 4), _avg_dwell),
+}
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def is_stale(session_dir, name):
+    """PNG 不存在或比來源 CSV 舊時回傳 True。"""
+    source, _, _ = CHARTS[name]
+    png = Path(session_dir) / name
+    try:
+        return png.stat().st_mtime_ns < (Path(session_dir) / source).stat().st_mtime_ns
+    except FileNotFoundError:
+        return True
+
+
+def render_chart(session_dir, name):
+    """由來源 CSV 繪製一張 PNG (先寫暫存檔再取代)，回傳路徑。"""
+    session_dir = Path(session_dir)
+    source, figsize, draw = CHARTS[name]
+    df = pd.read_csv(session_dir / source)
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    draw(df, fig.add_subplot(1, 1, 1))
+    fig.tight_layout()
+    out = session_dir / name
+    tmp = session_dir / (name + ".tmp.png")
+    fig.savefig(tmp, dpi=DPI)
+    os.replace(tmp, out)
+    return out
+
+
+def ensure_chart(session_dir, name):
+    """需要時才繪製；同一張圖同時被請求時只畫一次。來源 CSV 不存在時回傳 None。"""
+    session_dir = Path(session_dir)
+    if not (session_dir / CHARTS[name][0]).exists():
+        return None
+    with _locks_guard:
+        lock = _locks.setdefault((str(session_dir.resolve()), name), threading.Lock())
+    with lock:
+        if is_stale(session_dir, name):
+            render_chart(session_dir, name)
+    return session_dir / name
+
+
+def render_all(session_dir, workers=None, force=False):
+    """以 process pool 平行繪製所有過期的圖表，回傳繪製的檔名。"""
+    session_dir = Path(session_dir)
+    names = [n for n, (source, _, _) in CHARTS.items()
+             if (session_dir / source).exists() and (force or is_stale(session_dir, n))]
+    if not names:
+        return []
+    workers = min(len(names), workers or os.cpu_count() or 1)
+    if workers <= 1:
+        for n in names:
+            render_chart(session_dir, n)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(render_chart, [session_dir] * len(names), names))
+    return names
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the PNG charts of an analysis session from its CSVs.")
+    parser.add_argument("--session_dir", required=True)
+    parser.add_argument("--workers", type=int, default=None, help="Processes used for rendering (default: CPU count).")
+    parser.add_argument("--force", action="store_true", help="Re-render charts that are already up to date.")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    done = render_all(args.session_dir, args.workers, args.force)
+    print(f"Rendered {len(done)} chart(s) in {time.perf_counter() - t0:.2f}s: {', '.join(done) or 'all up to date'}")
@@ -1,100 +1,357 @@
+"""
+YOLO 資料集檢查：標籤格式、類別、座標範圍、影像與標籤是否成對、影像檔頭。
+
+原本每次執行都逐行重新掃描 train / train_pseudo / val 的所有檔案。現在：
+- 每個檔案的檢查結果依 (size, mtime) 快取在資料夾中的 .check_labels_cache.json，沒變動的檔案直接沿用
+  (加入 pseudo label 後重新檢查只需處理新檔案)
+- 每個標籤檔以 numpy 一次轉成 N x 5 陣列檢查類別與座標範圍，有問題時才逐行找出行號
+- labels/<split> 對應 images/<split>：標籤沒有影像是錯誤；影像沒有標籤視為背景圖，只計數
+- 影像只讀取檔頭 (與 JPEG 結尾) 判斷格式與是否截斷；--decode 時才以 OpenCV 完整解碼
+- 需要檢查的檔案分批交給 thread pool；結果可另存為 JSON 報告
+
+    python check_labels.py
+    python check_labels.py --dirs datasets/wildlife/labels/train datasets/wildlife/labels/val --classes 0 --report check.json
+"""
 import os
+import json
+import time
+import argparse
 from pathlib import Path
-import re # Import the re module for regular expressions
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from relabel_labels import atomic_write
 
 # --- 設定你的標籤資料夾路徑 ---
 # 根據你的 wildlife.yaml, 訓練集包含 'train' 和 'train_pseudo'
-label_dirs = [
+DEFAULT_LABEL_DIRS = [
     Path(r"C:\Users\wangs\monkeyv7\datasets\wildlife\labels\train"),
     Path(r"C:\Users\wangs\monkeyv7\datasets\wildlife\labels\train_pseudo"),
-    Path(r"C:\Users\wangs\monkeyv7\datasets\wildlife\labels\val") # Added val directory here for completeness
+    Path(r"C:\Users\wangs\monkeyv7\datasets\wildlife\labels\val"),
 ]
+DEFAULT_CLASSES = [0]  # 你的 wildlife.yaml 只有 '0: monkey'
 # -----------------------------
 
-bad_files = []
-valid_class_id = 0  # 你的 wildlife.yaml 只有 '0: monkey'
-
-for label_dir in label_dirs:
-    if not label_dir.exists():
-        print(f"⚠️ 警告：找不到資料夾 {label_dir}，跳過掃描。")
-        continue
-
-    print(f"--- 正在掃描 {label_dir} ---")
-    
-    # 找出所有 .txt 檔案
-    txt_files = list(label_dir.glob("*.txt"))
-    if not txt_files:
-        print(f"   (在 {label_dir.name} 中未找到任何 .txt 檔案)")
-        continue
-        
-    for txt_file in txt_files:
-        if txt_file.stat().st_size == 0:
-            continue  # 跳過空檔案 (背景圖)
-        
+CACHE_NAME = ".check_labels_cache.json"
+CACHE_VERSION = 1
+BATCH_SIZE = 256
+BOM = b"\xef\xbb\xbf"
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+MAGIC = ((b"\xff\xd8\xff", "jpeg"), (b"\x89PNG\r\n\x1a\n", "png"), (b"BM", "bmp"), (b"RIFF", "webp"))
+EXT_FORMAT = {".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png", ".bmp": "bmp", ".webp": "webp"}
+
+# 問題種類 -> 說明 (print 時使用)
+KINDS = {
+    "format": "格式錯誤",
+    "class_id": "類別 ID 錯誤",
+    "coord_count": "座標數量錯誤",
+    "coord_range": "座標超出範圍",
+    "bom": "含 UTF-8 BOM",
+    "read": "無法讀取",
+    "missing_image": "找不到對應影像",
+    "image_empty": "影像檔為空",
+    "image_format": "無法辨識的影像格式",
+    "image_ext": "副檔名與影像格式不符",
+    "image_truncated": "影像可能被截斷",
+    "image_decode": "影像無法解碼",
+}
+WARNING_KINDS = {"bom", "image_ext"}
+
+
+def _issue(line, kind, detail=""):
+    return [line, kind, detail]
+
+
+def _check_line(tokens, valid_classes):
+    """單行的詳細檢查 (只在整個檔案的快速檢查發現問題時使用)，回傳 issue 或 None。"""
+    text = tokens[0].decode("utf-8", "replace")
+    try:
+        class_id = float(text)
+    except ValueError:
+        return _issue(0, "format", f"類別欄位不是數字: {text!r}")
+    if not class_id.is_integer() or class_id < 0 or (valid_classes is not None and int(class_id) not in valid_classes):
+        return _issue(0, "class_id", f"ID: {text}")
+    if len(tokens) != 5:
+        return _issue(0, "coord_count", f"{len(tokens) - 1} 個座標")
+    try:
+        coords = [float(t) for t in tokens[1:]]
+    except ValueError as e:
+        return _issue(0, "format", str(e))
+    for coord in coords:
+        if not (0.0 <= coord <= 1.0):
+            return _issue(0, "coord_range", f"值: {coord}")
+    return None
+
+
+def check_label_bytes(raw, valid_classes=None):
+    """
+    檢查一個標籤檔的內容，回傳 (issues, boxes)；issues 為 [行號, 種類, 說明]。
+    正常的檔案只做一次 numpy 轉換與向量化比較。
+    """
+    issues = []
+    if raw.startswith(BOM):
+        issues.append(_issue(1, "bom", "UTF-8 BOM"))
+        raw = raw[3:]
+    lines = raw.splitlines()
+    widths = [len(line.split()) for line in lines]
+    if not any(widths):
+        return issues, 0
+    rows = None
+    if all(w in (0, 5) for w in widths):  # 每行恰好 5 個欄位 (總數相符不代表各行都對)
+        try:
+            rows = np.array(raw.split(), dtype=np.float64).reshape(-1, 5)
+        except ValueError:
+            rows = None
+    if rows is not None:
+        cls = rows[:, 0]
+        bad = (cls != np.floor(cls)) | (cls < 0)
+        if valid_classes is not None:
+            bad |= ~np.isin(cls, list(valid_classes))
+        bad |= ((rows[:, 1:] < 0) | (rows[:, 1:] > 1) | np.isnan(rows[:, 1:])).any(axis=1)
+        if not bad.any():
+            return issues, len(rows)
+    # 有問題：逐行找出行號與原因
+    boxes = 0
+    for i, line in enumerate(lines, start=1):
+        parts = line.split()
+        if not parts:
+            continue
+        problem = _check_line(parts, valid_classes)
+        if problem is None:
+            boxes += 1
+        else:
+            problem[0] = i
+            issues.append(problem)
+    return issues, boxes
+
+
+def check_image_header(path, decode=False):
+    """只讀取檔頭 (JPEG 另讀最後 2 bytes) 檢查格式；decode=True 時以 OpenCV 完整解碼。"""
+    issues = []
+    with open(path, "rb") as f:
+        head = f.read(32)
+        fmt = next((name for magic, name in MAGIC if head.startswith(magic)), None)
+        if fmt == "webp" and head[8:12] != b"WEBP":
+            fmt = None
+        tail = b""
+        if fmt == "jpeg":
+            f.seek(-2, os.SEEK_END)
+            tail = f.read(2)
+    if not head:
+        return [_issue(0, "image_empty")]
+    if fmt is None:
+        return [_issue(0, "image_format", head[:8].hex())]
+    expected = EXT_FORMAT.get(os.path.splitext(path)[1].lower())
+    if expected and expected != fmt:
+        issues.append(_issue(0, "image_ext", f"內容是 {fmt}"))
+    if fmt == "jpeg" and tail != b"\xff\xd9":
+        issues.append(_issue(0, "image_truncated", "JPEG 沒有結尾標記 FFD9"))
+    elif fmt == "png" and (head[12:16] != b"IHDR" or not int.from_bytes(head[16:20], "big")
+                           or not int.from_bytes(head[20:24], "big")):
+        issues.append(_issue(0, "image_format", "PNG IHDR 無效"))
+    if decode:
+        import cv2
+        data = np.fromfile(path, dtype=np.uint8)
+        if cv2.imdecode(data, cv2.IMREAD_UNCHANGED) is None:
+            issues.append(_issue(0, "image_decode"))
+    return issues
+
+
+def _scan(directory, exts):
+    """名稱 -> (path, size, mtime_ns)。"""
+    found = {}
+    if not directory.is_dir():
+        return found
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.lower().endswith(exts):
+                st = entry.stat()
+                found[entry.name] = (entry.path, st.st_size, st.st_mtime_ns)
+    return found
+
+
+def image_dir_for(label_dir):
+    """.../labels/<split> -> .../images/<split> (YOLO 慣例)；找不到 labels 時回傳 None。"""
+    parts = list(Path(label_dir).parts)
+    for i in range(len(parts) - 1, -1, -1):
+        if parts[i] == "labels":
+            parts[i] = "images"
+            return Path(*parts)
+    return None
+
+
+def _load_cache(path, config):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {"labels": {}, "images": {}}
+    if cache.get("version") != CACHE_VERSION:
+        return {"labels": {}, "images": {}}
+    return {
+        "labels": cache.get("labels", {}) if cache.get("classes") == config["classes"] else {},
+        "images": cache.get("images", {}) if cache.get("decode") == config["decode"] else {},
+    }
+
+
+def _check_labels_batch(batch, valid_classes):
+    out = []
+    for name, (path, size, mtime) in batch:
         try:
-            # Read in binary mode to explicitly handle BOM
-            with open(txt_file, 'rb') as f_bytes:
-                content_bytes = f_bytes.read()
-            
-            # Remove UTF-8 BOM if present (b'\xef\xbb\xbf')
-            if content_bytes.startswith(b'\xef\xbb\xbf'):
-                content_bytes = content_bytes[3:]
-            
-            # Decode to string (now guaranteed to be without BOM bytes)
-            content_str = content_bytes.decode('utf-8', errors='ignore') # Ignore decoding errors
-            lines = content_str.splitlines(keepends=True)
-            for i, line in enumerate(lines):
-                # Ensure Unicode BOM is stripped if it persists in the string
-                line = line.lstrip('\ufeff')
-                
-                parts = line.strip().split()
-                if not parts:
-                    continue # Skip empty lines
-
-                # 1. 檢查 Class ID
-                # Isolate digits from parts[0] to handle persistent BOM ('ï»¿0')
-                class_id_str = ''.join(filter(str.isdigit, parts[0]))
-                if not class_id_str:
-                    error_msg = f"❌ 格式錯誤! 檔案: {txt_file.name} (在 {label_dir.name} 中), 行: {i+1}, 錯誤: '在第一個元素中找不到數字'"
-                    print(error_msg)
-                    if error_msg not in bad_files:
-                        bad_files.append(error_msg)
-                    continue
-
-                class_id = int(class_id_str)
-                
-                if class_id != valid_class_id:
-                    error_msg = f"❌ 類別 ID 錯誤! 檔案: {txt_file.name} (在 {label_dir.name} 中), 行: {i+1}, ID: {class_id}"
-                    print(error_msg)
-                    if error_msg not in bad_files:
-                        bad_files.append(error_msg)
-                    continue 
-
-                # 2. 檢查座標數量
-                coords = [float(p) for p in parts[1:]] # Use parts[1:] as parts[0] is clean class_id
-                if not len(coords) == 4:
-                    error_msg = f"❌ 座標數量錯誤! 檔案: {txt_file.name} (在 {label_dir.name} 中), 行: {i+1}"
-                    print(error_msg)
-                    if error_msg not in bad_files:
-                        bad_files.append(error_msg)
-                    continue
-
-                # 3. 檢查座標範圍
-                for coord in coords:
-                    if not (0.0 <= coord <= 1.0):
-                        error_msg = f"❌ 座標超出範圍! 檔案: {txt_file.name} (在 {label_dir.name} 中), 行: {i+1}, 值: {coord}"
-                        print(error_msg)
-                        if error_msg not in bad_files:
-                            bad_files.append(error_msg)
-                        break # 這行有問題，跳到下一行
-                        
-        except Exception as e:
-            error_msg = f"❌ 格式錯誤! 檔案: {txt_file.name} (在 {label_dir.name} 中), 行: {i+1}, 錯誤: {e}"
-            print(error_msg)
-            if error_msg not in bad_files:
-                bad_files.append(error_msg)
-
-if not bad_files:
-    print("\n✅ 掃描完成，所有檢查的資料夾中未發現明顯錯誤。")
-else:
-    print(f"\n掃描完成，總共發現 {len(bad_files)} 個問題。請修正它們。")
+            with open(path, "rb") as f:
+                issues, boxes = check_label_bytes(f.read(), valid_classes)
+        except OSError as e:
+            issues, boxes = [_issue(0, "read", str(e))], 0
+        out.append((name, [size, mtime, issues, boxes]))
+    return out
+
+
+def _check_images_batch(batch, decode):
+    out = []
+    for name, (path, size, mtime) in batch:
+        try:
+            issues = check_image_header(path, decode)
+        except OSError as e:
+            issues = [_issue(0, "read", str(e))]
+        out.append((name, [size, mtime, issues]))
+    return out
+
+
+def _run_batches(fn, items, arg, pool):
+    batches = [items[i:i + BATCH_SIZE] for i in range(0, len(items), BATCH_SIZE)]
+    if pool is None or len(batches) <= 1:
+        return [r for b in batches for r in fn(b, arg)]
+    return [r for part in pool.map(lambda b: fn(b, arg), batches) for r in part]
+
+
+def check_dir(label_dir, valid_classes=None, check_images=True, decode=False, use_cache=True, pool=None):
+    """檢查一個 labels 資料夾 (與對應的 images 資料夾)，回傳 (issues, stats)。"""
+    label_dir = Path(label_dir)
+    config = {"classes": sorted(valid_classes) if valid_classes is not None else None, "decode": bool(decode)}
+    cache_path = label_dir / CACHE_NAME
+    cache = _load_cache(cache_path, config) if use_cache else {"labels": {}, "images": {}}
+
+    labels = _scan(label_dir, (".txt",))
+    image_dir = image_dir_for(label_dir) if check_images else None
+    images = _scan(image_dir, IMAGE_EXTS) if image_dir is not None else {}
+
+    def stale(section, items):
+        old = cache[section]
+        return [(n, v) for n, v in items.items() if n not in old or old[n][:2] != [v[1], v[2]]]
+
+    todo_labels = stale("labels", labels)
+    todo_images = stale("images", images)
+    results_labels = dict(_run_batches(_check_labels_batch, todo_labels, valid_classes, pool))
+    results_images = dict(_run_batches(_check_images_batch, todo_images, decode, pool))
+    label_results = {n: results_labels.get(n) or cache["labels"][n] for n in labels}
+    image_results = {n: results_images.get(n) or cache["images"][n] for n in images}
+
+    if use_cache and (todo_labels or todo_images or len(label_results) != len(cache["labels"])
+                      or len(image_results) != len(cache["images"])):
+        data = {"version": CACHE_VERSION, **config, "labels": label_results, "images": image_results}
+        try:
+            atomic_write(str(cache_path), json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        except OSError as e:
+            print(f"⚠️ 警告：無法寫入快取 {cache_path}: {e}")
+
+    issues = []
+    for name, (_, _, file_issues, _) in label_results.items():
+        issues.extend({"file": str(label_dir / name), "line": line, "kind": kind, "detail": detail}
+                      for line, kind, detail in file_issues)
+    image_stems = {os.path.splitext(n)[0]: n for n in images}
+    label_stems = {n[:-4] for n in labels}
+    paired_images = set()
+    if check_images:
+        for name in labels:
+            stem = name[:-4]
+            if stem in image_stems:
+                paired_images.add(image_stems[stem])
+            else:
+                issues.append({"file": str(label_dir / name), "line": 0, "kind": "missing_image",
+                               "detail": str(image_dir) if image_dir is not None else ""})
+    for name, (_, _, file_issues) in image_results.items():
+        issues.extend({"file": str(image_dir / name), "line": line, "kind": kind, "detail": detail}
+                      for line, kind, detail in file_issues)
+    stats = {
+        "label_files": len(labels),
+        "labels_checked": len(todo_labels),
+        "empty_labels": sum(1 for r in label_results.values() if r[3] == 0 and not r[2]),
+        "boxes": sum(r[3] for r in label_results.values()),
+        "images": len(images),
+        "images_checked": len(todo_images),
+        "images_without_labels": sum(1 for s in image_stems if s not in label_stems),
+    }
+    return issues, stats
+
+
+def validate(label_dirs, valid_classes=None, check_images=True, decode=False, use_cache=True, workers=None):
+    """檢查多個資料夾，回傳結構化報告 (dict)。"""
+    t0 = time.perf_counter()
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    report = {"dirs": {}, "issues": [], "summary": {}}
+    pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for label_dir in label_dirs:
+            if not Path(label_dir).exists():
+                print(f"⚠️ 警告：找不到資料夾 {label_dir}，跳過掃描。")
+                continue
+            issues, stats = check_dir(label_dir, valid_classes, check_images, decode, use_cache, pool)
+            stats["issues"] = len(issues)
+            report["dirs"][str(label_dir)] = stats
+            report["issues"].extend(issues)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    by_kind = {}
+    for issue in report["issues"]:
+        by_kind[issue["kind"]] = by_kind.get(issue["kind"], 0) + 1
+    totals = {}
+    for stats in report["dirs"].values():
+        for key, value in stats.items():
+            totals[key] = totals.get(key, 0) + value
+    errors = sum(n for k, n in by_kind.items() if k not in WARNING_KINDS)
+    report["summary"] = dict(totals, errors=errors, warnings=len(report["issues"]) - errors, by_kind=by_kind,
+                             seconds=round(time.perf_counter() - t0, 3))
+    return report
+
+
+def print_report(report, show=50):
+    for label_dir, stats in report["dirs"].items():
+        print(f"--- {label_dir} ---")
+        print(f"   {stats['label_files']} 個標籤檔 (重新檢查 {stats['labels_checked']})，{stats['boxes']} 個框，"
+              f"{stats['empty_labels']} 個空檔；{stats['images']} 張影像 (重新檢查 {stats['images_checked']})，"
+              f"{stats['images_without_labels']} 張沒有標籤 (背景)")
+    for issue in report["issues"][:show]:
+        mark = "⚠️" if issue["kind"] in WARNING_KINDS else "❌"
+        line = f", 行: {issue['line']}" if issue["line"] else ""
+        detail = f", {issue['detail']}" if issue["detail"] else ""
+        print(f"{mark} {KINDS.get(issue['kind'], issue['kind'])}! 檔案: {issue['file']}{line}{detail}")
+    if len(report["issues"]) > show:
+        print(f"   ... 另有 {len(report['issues']) - show} 個問題 (完整清單請用 --report)")
+    summary = report["summary"]
+    if not report["issues"]:
+        print(f"\n✅ 掃描完成，所有檢查的資料夾中未發現明顯錯誤。({summary['seconds']:.2f}s)")
+    else:
+        kinds = ", ".join(f"{KINDS.get(k, k)} {n}" for k, n in sorted(summary["by_kind"].items()))
+        print(f"\n掃描完成，總共發現 {summary['errors']} 個錯誤、{summary['warnings']} 個警告 ({kinds})。"
+              f"請修正它們。({summary['seconds']:.2f}s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate YOLO label files and their images (cached, parallel).")
+    parser.add_argument("--dirs", nargs="+", default=None, help="Label directories (default: the wildlife dataset).")
+    parser.add_argument("--classes", type=int, nargs="*", default=DEFAULT_CLASSES,
+                        help="Valid class ids (pass --classes with no values to accept any).")
+    parser.add_argument("--no_images", action="store_true", help="Skip image pairing and header checks.")
+    parser.add_argument("--decode", action="store_true", help="Fully decode every image with OpenCV (slow).")
+    parser.add_argument("--no_cache", action="store_true", help=f"Ignore and do not update {CACHE_NAME}.")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--report", default=None, help="Write the structured report as JSON.")
+    parser.add_argument("--show", type=int, default=50, help="Print at most N issues.")
+    args = parser.parse_args()
+
+    report = validate(args.dirs or DEFAULT_LABEL_DIRS, set(args.classes) if args.classes else None,
+                      not args.no_images, args.decode, not args.no_cache, args.workers)
+    print_report(report, args.show)
+    if args.report:
+        Path(args.report).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    raise SystemExit(1 if report["summary"]["errors"] else 0)
@@ -7,9 +7,9 @@ import numpy as np
 from scipy.spatial.distance import cosine
 from itertools import combinations
 import matplotlib.pyplot as plt
-import seaborn as sns
 
 # --- Placeholders ---
+sys.path.insert(0, r"__BASE__")  # 專案根目錄，用來匯入 label_loader
 labels_dir = Path(r"__LABEL_DIR__")
 out_dir = Path(r"__SESSION_DIR__")
 yaml_path = Path(r"__YAML__") if r"__YAML__" else None
@@ -30,38 +30,35 @@ if yaml_path and yaml_path.exists():
 else:
     print("Warning: YAML file not found. Using generic class names.")
 
-# Parse tracking files with features
-rows = []
+# Parse tracking files with features (parallel, vectorized, cached as labels/.labels_cache.npz)
+from label_loader import load_label_dir
+from density_plot import kdeplot
+
 print(f"Parsing files from: {labels_dir}")
-for txt_file in sorted(labels_dir.glob("*.txt")):
-    for line in txt_file.read_text(encoding="utf-8").splitlines():
-        parts = line.strip().split()
-        if len(parts) < 8:  # class, bbox, conf, track_id + at least one feature
-            continue
-        try:
-            class_id = int(float(parts[0]))
-            track_id = int(float(parts[6]))
-            feature_vector = np.array([float(x) for x in parts[7:]])
-            rows.append({
-                "cls_id": class_id,
-                "cls_name": names.get(class_id, f"cls{class_id}"),
-                "track_id": track_id,
-                "feature": feature_vector
-            })
-        except (ValueError, IndexError):
-            continue
-
-if not rows:
+data = load_label_dir(labels_dir, with_features=True)  # class, bbox, conf, track_id + at least one feature
+
+if not len(data["track_id"]):
     print("Error: No valid tracking data with features found.")
     sys.exit(1)
 
-df = pd.DataFrame(rows)
-print(f"Successfully parsed {len(df)} detections.")
+print(f"Successfully parsed {len(data['track_id'])} detections.")
+
+# Re-ID separability (CMC / mAP) over a sample of detections, stored in summary.json
+from reid_eval import evaluate, format_metrics, update_session_summary
+
+reid_metrics = evaluate(data["features"], data["track_id"], data["frame"], max_queries=2000)
+print(format_metrics(reid_metrics))
+update_session_summary(out_dir, reid_metrics)
 
 # Calculate a single representative feature vector for each track (by averaging)
-features_df = df.groupby(['track_id', 'cls_name'])['feature'].apply(
-    lambda x: np.mean(np.vstack(x), axis=0)
-).reset_index()
+mean_features = pd.DataFrame(data["features"]).groupby([data["track_id"], data["cls"]]).mean()
+track_ids = mean_features.index.get_level_values(0)
+class_ids = mean_features.index.get_level_values(1)
+features_df = pd.DataFrame({
+    "track_id": track_ids,
+    "cls_name": [names.get(int(c), f"cls{int(c)}") for c in class_ids],
+    "feature": list(mean_features.to_numpy(dtype=np.float64)),
+})
 print(f"Calculated representative features for {len(features_df)} unique tracks.")
 
 # --- Cosine Distance Calculation ---
@@ -111,10 +108,10 @@ plt.style.use('seaborn-v0_8-whitegrid')
 fig, ax = plt.subplots(figsize=(12, 7))
 
 if intra_class_dist:
-    sns.kdeplot(data=intra_df, x='distance', ax=ax, color='blue', label='Intra-class Distance', fill=True)
+    kdeplot(ax, intra_df['distance'].to_numpy(), color='blue', label='Intra-class Distance', fill=True)
 
 if inter_class_dist:
-    sns.kdeplot(data=inter_df, x='distance', ax=ax, color='red', label='Inter-class Distance', fill=True)
+    kdeplot(ax, inter_df['distance'].to_numpy(), color='red', label='Inter-class Distance', fill=True)
 
 ax.set_title('Distribution of Cosine Distances', fontsize=16)
 ax.set_xlabel('Cosine Distance', fontsize=12)
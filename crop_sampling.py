@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Embedding 前的裁切圖取樣策略 (crop sampling policy)。
+
+追蹤器每一幀都會為每個物件輸出一張裁切圖，但相鄰幀的裁切圖幾乎相同，
+過小或模糊的裁切圖對特徵品質也沒有幫助。CropSampler 放在 embedder 前面，
+只把值得計算特徵的裁切圖交給後續流程：
+
+- min_size / min_conf：最小邊長 (像素) 與最小信心度門檻。
+- stride：同一個 track 兩次取樣之間至少間隔的幀數。
+- top_k：每個 track 只保留分數最高的 K 張 (以小型 heap 維護)，
+  分數可選 'sharpness' (Laplacian 變異數) 或 'area' (面積)。
+
+使用方式：
+    for item in sampler.offer(track_id, frame_idx, crop, conf, cls_id=cls_id): 立即處理
+    for item in sampler.flush(): 處理 top_k 保留下來的裁切圖
+
+比較取樣前後的距離分佈：
+    python crop_sampling.py --baseline runs/analyze/full --sampled runs/analyze/sampled
+"""
+import os
+import json
+import heapq
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import cv2
+
+
+class CropSampler:
+    """依品質門檻、時間間隔與 top-K 決定哪些裁切圖需要計算特徵。"""
+
+    def __init__(self, stride=1, top_k=0, min_size=0, min_conf=0.0, rank_by="sharpness"):
+        if rank_by not in ("sharpness", "area"):
+            raise ValueError(f"Unknown rank_by: {rank_by}")
+        self.stride = max(1, int(stride))
+        self.top_k = max(0, int(top_k))
+        self.min_size = int(min_size)
+        self.min_conf = float(min_conf)
+        self.rank_by = rank_by
+        self.last_frame = {}
+        self.heaps = {}
+        self._seq = 0
+        self.offered = 0
+        self.accepted = 0
+
+    def config(self):
+        """建構參數，可傳給其他 process 重建相同的取樣策略。"""
+        return {"stride": self.stride, "top_k": self.top_k, "min_size": self.min_size,
+                "min_conf": self.min_conf, "rank_by": self.rank_by}
+
+    def score(self, crop):
+        if self.rank_by == "area":
+            return float(crop.shape[0] * crop.shape[1])
+        gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+        return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+    def offer(self, track_id, frame_idx, crop, conf=None, **meta):
+        """
+        提交一張裁切圖。回傳現在就該計算特徵的 item 列表，
+        每個 item 為 {"track_id", "frame", "image", **meta}：
+        未啟用 top_k 時為 [item] 或 []；啟用 top_k 時一律為 []，改由 flush() 取回。
+        """
+        self.offered += 1
+        if crop is None or crop.size == 0 or min(crop.shape[:2]) < self.min_size:
+            return []
+        if conf is not None and conf < self.min_conf:
+            return []
+        last = self.last_frame.get(track_id)
+        if last is not None and frame_idx - last < self.stride:
+            return []
+        self.last_frame[track_id] = frame_idx
+
+        if not self.top_k:
+            self.accepted += 1
+            return [dict(meta, track_id=track_id, frame=frame_idx, image=crop)]
+
+        heap = self.heaps.setdefault(track_id, [])
+        score = self.score(crop)
+        if len(heap) >= self.top_k and score <= heap[0][0]:
+            return []
+        # 裁切圖是整張 frame 的 view，暫存時複製一份，避免整張 frame 無法被釋放
+        self._seq += 1
+        entry = (score, self._seq, dict(meta, track_id=track_id, frame=frame_idx, image=crop.copy()))
+        if len(heap) < self.top_k:
+            heapq.heappush(heap, entry)
+        else:
+            heapq.heapreplace(heap, entry)
+        return []
+
+    def flush(self):
+        """取回 top_k heap 中保留的 item (依幀序排列) 並清空 heap。"""
+        kept = [entry for heap in self.heaps.values() for entry in heap]
+        kept.sort(key=lambda e: (e[2]["frame"], e[1]))
+        self.heaps = {}
+        self.accepted += len(kept)
+        return [entry[2] for entry in kept]
+
+    def summary(self):
+        if not self.offered:
+            return "Crop sampling: no crops offered."
+        ratio = self.offered / self.accepted if self.accepted else float("inf")
+        return (f"Crop sampling: embedded {self.accepted}/{self.offered} crops "
+                f"({ratio:.1f}x reduction; stride={self.stride}, top_k={self.top_k}, "
+                f"min_size={self.min_size}, min_conf={self.min_conf}, rank_by={self.rank_by})")
+
+
+def add_sampling_args(parser):
+    """把取樣相關參數加到分析腳本的 argparse parser。"""
+    group = parser.add_argument_group("crop sampling")
+    group.add_argument("--sample_stride", type=int, default=1, help="Embed at most one crop every N frames per track.")
+    group.add_argument("--sample_top_k", type=int, default=0, help="Keep only the best K crops per track (0 = keep all).")
+    group.add_argument("--sample_rank_by", choices=["sharpness", "area"], default="sharpness", help="Score used for top-K selection.")
+    group.add_argument("--min_crop_size", type=int, default=0, help="Skip crops whose shorter side is below this many pixels.")
+    group.add_argument("--min_conf", type=float, default=0.0, help="Skip detections below this confidence.")
+    return parser
+
+
+def sampler_from_args(args):
+    return CropSampler(stride=args.sample_stride, top_k=args.sample_top_k, min_size=args.min_crop_size,
+                       min_conf=args.min_conf, rank_by=args.sample_rank_by)
+
+
+# --- 取樣前後的距離分佈比較 ---
+DISTANCE_COLUMNS = ("distance", "cosine_distance", "avg_distance")
+
+
+def _load_distances(path):
+    """讀取 CSV 中的距離欄位；沒有距離欄位時回傳 None。"""
+    header = pd.read_csv(path, nrows=0).columns
+    col = next((c for c in DISTANCE_COLUMNS if c in header), None)
+    if col is None:
+        return None
+    return pd.read_csv(path, usecols=[col])[col].dropna().to_numpy(dtype=np.float64)
+
+
+def describe_values(values):
+    if values.size == 0:
+        return {"n": 0}
+    q = np.quantile(values, [0.05, 0.25, 0.5, 0.75, 0.95])
+    return {"n": int(values.size), "mean": float(values.mean()), "std": float(values.std()),
+            "p05": float(q[0]), "p25": float(q[1]), "median": float(q[2]), "p75": float(q[3]), "p95": float(q[4])}
+
+
+def ks_statistic(a, b):
+    """兩樣本 Kolmogorov-Smirnov 統計量 (最大 CDF 差距)。"""
+    if a.size == 0 or b.size == 0:
+        return None
+    a, b = np.sort(a), np.sort(b)
+    grid = np.concatenate([a, b])
+    cdf_a = np.searchsorted(a, grid, side="right") / a.size
+    cdf_b = np.searchsorted(b, grid, side="right") / b.size
+    return float(np.abs(cdf_a - cdf_b).max())
+
+
+def compare_distance_reports(baseline_dir, sampled_dir, output_path=None):
+    """比較兩個分析輸出目錄中同名距離 CSV 的分佈，並輸出 JSON 報告。"""
+    baseline_dir, sampled_dir = Path(baseline_dir), Path(sampled_dir)
+    report = {"baseline": str(baseline_dir), "sampled": str(sampled_dir), "files": {}}
+    for base_csv in sorted(baseline_dir.glob("*.csv")):
+        sampled_csv = sampled_dir / base_csv.name
+        if not sampled_csv.exists():
+            continue
+        a, b = _load_distances(base_csv), _load_distances(sampled_csv)
+        if a is None or b is None:
+            continue
+        stats_a, stats_b = describe_values(a), describe_values(b)
+        entry = {"baseline": stats_a, "sampled": stats_b, "ks_statistic": ks_statistic(a, b)}
+        if a.size and b.size:
+            entry["mean_shift"] = stats_b["mean"] - stats_a["mean"]
+            entry["median_shift"] = stats_b["median"] - stats_a["median"]
+        report["files"][base_csv.name] = entry
+
+    output_path = Path(output_path) if output_path else sampled_dir / "sampling_comparison.json"
+    output_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    return report, output_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare cosine distance distributions of a full run against a sampled run.")
+    parser.add_argument("--baseline", required=True, help="Output directory of the run without sampling.")
+    parser.add_argument("--sampled", required=True, help="Output directory of the run with crop sampling enabled.")
+    parser.add_argument("--output", default=None, help="Report path (default: <sampled>/sampling_comparison.json).")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.baseline) or not os.path.isdir(args.sampled):
+        print("Error: both --baseline and --sampled must be existing directories.")
+        raise SystemExit(1)
+
+    report, path = compare_distance_reports(args.baseline, args.sampled, args.output)
+    for name, entry in report["files"].items():
+        ks = entry["ks_statistic"]
+        shift = entry.get("mean_shift")
+        print(f"{name}: n {entry['baseline']['n']} -> {entry['sampled']['n']}, "
+              f"KS={ks if ks is None else round(ks, 4)}, mean shift={shift if shift is None else round(shift, 4)}")
+    print(f"Report saved to {path}")
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+分段串流 (chunked) 的 session 資料下載。
+
+儀表板的「下載資料」原本以 send_from_directory 傳整個 CSV；track_lifespans.csv 或偵測資料可能很大，
+用戶端通常只需要其中一段。這裡先依條件篩選再序列化，並以產生器一段一段輸出：
+- 來源：session 目錄的 CSV (pandas chunksize 逐段讀取) 或 detections.npz (依幀索引只讀取範圍內的資料列)
+- 篩選：frame_start / frame_end、cls (類別名稱或編號，逗號分隔)、track_id (逗號分隔)
+- 格式：csv 或 ndjson (每行一筆 JSON)
+- 用戶端接受 gzip 時以 zlib 串流壓縮，不必先產生整份檔案
+- ETag 由來源檔案的 (mtime, size)、查詢參數與 content-coding 組成 (gzip 版本另有 -gz 結尾)，資料沒變時回 304
+- 沒有任何資料列符合條件時，CSV 仍輸出表頭
+
+靜態檔 (PNG、CSV、影片) 仍由 Flask 的 send_file 提供：conditional 模式已支援 Range 與 ETag。
+"""
+import zlib
+import hashlib
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from detection_store import READ_COLUMNS, STORE_NAME, DetectionStore
+from session_cache import file_signature
+
+CHUNK_ROWS = 50000
+GZIP_LEVEL = 1  # 邊讀邊壓縮時 CPU 是瓶頸：level 1 比預設的 6 快約 6 倍，檔案只大一些
+FORMATS = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson; charset=utf-8"}
+
+# 資料表名稱 -> session 目錄中的來源檔
+TABLES = {
+    "detections": STORE_NAME,
+    "objects_per_frame": "objects_per_frame.csv",
+    "track_lifespans": "track_lifespans.csv",
+    "class_totals": "class_totals.csv",
+    "avg_dwell_by_class": "avg_dwell_by_class.csv",
+    "occupancy_grid": "occupancy_grid.csv",
+    "trajectory_stats": "trajectory_stats.csv",
+    "track_links": "track_links.csv",
+}
+BBOX_COLUMNS = ("xc", "yc", "w", "h")
+
+
+def _int_list(text):
+    return np.array([int(v) for v in text.split(",") if v.strip()], dtype=np.int64) if text else None
+
+
+def parse_filters(params):
+    """
+    由查詢參數 (request.args) 取出篩選條件；格式錯誤時丟出 ValueError。
+    cls 可混用名稱與編號：?cls=monkey,2
+    """
+    def int_arg(name):
+        value = params.get(name)
+        return int(value) if value not in (None, "") else None
+    cls = [v.strip() for v in (params.get("cls") or "").split(",") if v.strip()]
+    columns = [c.strip() for c in (params.get("columns") or "").split(",") if c.strip()]
+    return {
+        "frame_start": int_arg("frame_start"),
+        "frame_end": int_arg("frame_end"),
+        "cls_names": {c for c in cls if not c.lstrip("-").isdigit()},
+        "cls_ids": {int(c) for c in cls if c.lstrip("-").isdigit()},
+        "track_ids": _int_list(params.get("track_id")),
+        "columns": columns or None,
+    }
+
+
+def filter_mask(df, filters):
+    """依 DataFrame 中存在的欄位套用篩選，回傳布林遮罩 (不存在的欄位不篩選)。"""
+    mask = np.ones(len(df), dtype=bool)
+    if "frame" in df:
+        if filters["frame_start"] is not None:
+            mask &= df["frame"].to_numpy() >= filters["frame_start"]
+        if filters["frame_end"] is not None:
+            mask &= df["frame"].to_numpy() <= filters["frame_end"]
+    if filters["cls_names"] or filters["cls_ids"]:
+        cls_mask = np.zeros(len(df), dtype=bool)
+        for col in ("cls_name", "class"):
+            if col in df and filters["cls_names"]:
+                cls_mask |= df[col].astype(str).isin(filters["cls_names"]).to_numpy()
+        if "cls" in df and filters["cls_ids"]:
+            cls_mask |= np.isin(df["cls"].to_numpy(), list(filters["cls_ids"]))
+        mask &= cls_mask
+    if filters["track_ids"] is not None and "track_id" in df:
+        mask &= np.isin(df["track_id"].to_numpy(), filters["track_ids"])
+    return mask
+
+
+def _select(df, columns):
+    if not columns:
+        return df
+    unknown = [c for c in columns if c not in df.columns]
+    if unknown:
+        raise KeyError(f"Unknown column(s): {', '.join(unknown)}")
+    return df[columns]
+
+
+def csv_chunks(path, filters, chunk_rows=CHUNK_ROWS):
+    """逐段讀取 CSV 並篩選，產生 DataFrame；沒有資料列符合時產生一個只有欄位的空 DataFrame。"""
+    emitted = False
+    for chunk in pd.read_csv(path, chunksize=chunk_rows):
+        part = chunk[filter_mask(chunk, filters)]
+        if len(part):
+            emitted = True
+            yield _select(part, filters["columns"])
+    if not emitted:
+        yield _select(pd.read_csv(path, nrows=0), filters["columns"])
+
+
+def detection_chunks(path, filters, chunk_rows=CHUNK_ROWS):
+    """
+    由 detections.npz 產生 DataFrame 片段：幀範圍以幀索引換算成資料列範圍，
+    只解壓縮輸出與篩選需要的欄位。bbox 展開為 xc, yc, w, h。
+    類別只能以編號篩選 (npz 中沒有類別名稱)。沒有資料列符合時產生一個只有欄位的空 DataFrame。
+    """
+    if filters["cls_names"]:
+        raise ValueError("detections can only be filtered by class id (e.g. cls=0,2).")
+    wanted = filters["columns"] or ["frame", "cls", "conf", "track_id", *BBOX_COLUMNS]
+    unknown = [c for c in wanted if c not in READ_COLUMNS + BBOX_COLUMNS]
+    if unknown:
+        raise KeyError(f"Unknown column(s): {', '.join(unknown)}")
+    need = {c for c in wanted if c in READ_COLUMNS}
+    if any(c in BBOX_COLUMNS for c in wanted):
+        need.add("bbox")
+    if filters["cls_ids"]:
+        need.add("cls")
+    if filters["track_ids"] is not None:
+        need.add("track_id")
+    with DetectionStore(path) as store:
+        arrays = store.read(sorted(need), filters["frame_start"], filters["frame_end"])
+    n = len(next(iter(arrays.values()))) if arrays else 0
+    emitted = False
+    for lo in range(0, n, chunk_rows):
+        hi = min(lo + chunk_rows, n)
+        mask = np.ones(hi - lo, dtype=bool)
+        if filters["cls_ids"]:
+            mask &= np.isin(arrays["cls"][lo:hi], list(filters["cls_ids"]))
+        if filters["track_ids"] is not None:
+            mask &= np.isin(arrays["track_id"][lo:hi], filters["track_ids"])
+        if not mask.any():
+            continue
+        data = {}
+        for c in wanted:
+            if c in BBOX_COLUMNS:
+                data[c] = arrays["bbox"][lo:hi, BBOX_COLUMNS.index(c)][mask]
+            else:
+                data[c] = arrays[c][lo:hi][mask]
+        emitted = True
+        yield pd.DataFrame(data)
+    if not emitted:
+        yield pd.DataFrame({c: [] for c in wanted})
+
+
+def table_chunks(session_dir, table, filters, chunk_rows=CHUNK_ROWS):
+    path = Path(session_dir) / TABLES[table]
+    if table == "detections":
+        return detection_chunks(path, filters, chunk_rows)
+    return csv_chunks(path, filters, chunk_rows)
+
+
+def serialize(chunks, fmt="csv"):
+    """DataFrame 片段 -> UTF-8 位元組片段；CSV 只在第一段輸出表頭 (空的片段也會輸出)。"""
+    header = True
+    for df in chunks:
+        if fmt == "ndjson":
+            if df.empty:
+                continue
+            text = df.to_json(orient="records", lines=True, force_ascii=False)
+            yield (text if text.endswith("\n") else text + "\n").encode("utf-8")
+        else:
+            yield df.to_csv(index=False, header=header, lineterminator="\n").encode("utf-8")
+        header = False
+
+
+def gzip_stream(pieces, level=GZIP_LEVEL):
+    """串流 gzip 壓縮 (wbits=31 為 gzip 格式)。"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for piece in pieces:
+        out = compressor.compress(piece)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def data_etag(session_dir, table, query, coding=None):
+    """
+    來源檔 (mtime, size) + 排序後的查詢參數；用於 If-None-Match。
+    不同 content-coding 是不同的表示 (RFC 9110)，gzip 版本加上 -gz 結尾。
+    """
+    sig = file_signature([Path(session_dir) / TABLES[table]])
+    text = repr((table, sig, sorted(query)))
+    etag = hashlib.sha1(text.encode("utf-8")).hexdigest()[:20]
+    return f"{etag}-gz" if coding == "gzip" else etag
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+單一檔案、欄式 (columnar) 的 session 偵測資料。
+
+`yolo track ... save_txt=True` 每一幀輸出一個 .txt，分析時要列出、排序並讀取數萬個小檔案。
+這裡把一個 session 的所有偵測存成一個壓縮的 .npz (session 目錄下的 detections.npz)：
+
+    frame (int32), cls (int16), conf (float32), track_id (int32), bbox (float32, N x 4, xc yc w h)
+    raw_track_id (int32，可選)：縫合 (track_stitching.py) 前追蹤器輸出的 ID；縫合後 track_id 為縫合後的 ID，
+        與 track_lifespans.csv 等統計一致。沒有這個欄位時讀取 raw_track_id 會得到 track_id
+    frame_ids / frame_offsets：幀索引，第 frame_ids[i] 幀的偵測為 rows[frame_offsets[i]:frame_offsets[i+1]]
+    meta：JSON 字串 (來源 labels 目錄的檔案數 / 大小 / 最新 mtime 等)
+
+資料列依幀排序。np.load 對 npz 是延遲讀取，只有被存取的欄位才會解壓縮，
+因此分析模板與儀表板只需讀取它們用到的欄位。(Parquet/Arrow 需要額外安裝 pyarrow，
+npz 只依賴 numpy。)
+
+轉換既有的 labels 目錄：
+    python detection_store.py --labels_dir runs/predict/xxx/labels --output runs/analyze/xxx/detections.npz
+"""
+import os
+import json
+import time
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+STORE_NAME = "detections.npz"
+COLUMNS = ("frame", "cls", "conf", "track_id", "bbox")
+READ_COLUMNS = COLUMNS + ("raw_track_id",)
+_DTYPES = {"frame": np.int32, "cls": np.int16, "conf": np.float32, "track_id": np.int32, "bbox": np.float32,
+           "raw_track_id": np.int32}
+
+
+def write_store(path, frame, cls, conf, track_id, bbox, meta=None, raw_track_id=None):
+    """依幀排序後寫入壓縮 npz (先寫暫存檔再取代)。raw_track_id 為縫合前的 ID (可省略)。"""
+    frame = np.asarray(frame)
+    order = np.argsort(frame, kind="stable")
+    cols = {"frame": frame, "cls": cls, "conf": conf, "track_id": track_id, "bbox": bbox}
+    if raw_track_id is not None:
+        cols["raw_track_id"] = raw_track_id
+    cols = {k: np.asarray(v)[order].astype(_DTYPES[k]) for k, v in cols.items()}
+    if cols["bbox"].size == 0:
+        cols["bbox"] = cols["bbox"].reshape(0, 4)
+    frame_ids, offsets = np.unique(cols["frame"], return_index=True)
+    offsets = np.append(offsets, len(order)).astype(np.int64)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp.npz")
+    np.savez_compressed(tmp, frame_ids=frame_ids.astype(np.int32), frame_offsets=offsets,
+                        meta=np.array(json.dumps(meta or {}, ensure_ascii=False)), **cols)
+    os.replace(tmp, path)
+    return path
+
+
+class DetectionStoreWriter:
+    """逐幀寫入 (例如在追蹤迴圈中)，close() 時一次寫成 detections.npz。"""
+
+    def __init__(self, path, meta=None):
+        self.path = path
+        self.meta = dict(meta or {})
+        self.parts = {k: [] for k in COLUMNS}
+
+    def add_frame(self, frame, cls, conf, track_id, bbox):
+        n = len(track_id)
+        if not n:
+            return
+        self.parts["frame"].append(np.full(n, frame, dtype=np.int32))
+        self.parts["cls"].append(np.asarray(cls, dtype=np.int16))
+        self.parts["conf"].append(np.asarray(conf, dtype=np.float32))
+        self.parts["track_id"].append(np.asarray(track_id, dtype=np.int32))
+        self.parts["bbox"].append(np.asarray(bbox, dtype=np.float32).reshape(n, 4))
+
+    def close(self):
+        cols = {k: (np.concatenate(v) if v else np.zeros((0, 4) if k == "bbox" else 0, dtype=_DTYPES[k]))
+                for k, v in self.parts.items()}
+        return write_store(self.path, meta=self.meta, **cols)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DetectionStore:
+    """讀取 detections.npz；欄位在第一次存取時才解壓縮。"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._npz = np.load(self.path, allow_pickle=False)
+        self._cache = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._npz.close()
+
+    @property
+    def meta(self):
+        return json.loads(str(self._get("meta")))
+
+    def _get(self, name):
+        if name not in self._cache:
+            if name == "raw_track_id" and name not in self._npz.files:
+                return self._get("track_id")  # 未縫合過：原始 ID 就是 track_id
+            self._cache[name] = self._npz[name]
+        return self._cache[name]
+
+    def __len__(self):
+        return int(self._get("frame_offsets")[-1])
+
+    def frames(self):
+        """有偵測的幀編號 (已排序)。"""
+        return self._get("frame_ids")
+
+    def row_range(self, frame_start=None, frame_end=None):
+        """幀範圍 [frame_start, frame_end] 對應的資料列範圍 (由幀索引計算，不讀取 frame 欄位)。"""
+        ids, offsets = self._get("frame_ids"), self._get("frame_offsets")
+        lo = 0 if frame_start is None else np.searchsorted(ids, frame_start, side="left")
+        hi = len(ids) if frame_end is None else np.searchsorted(ids, frame_end, side="right")
+        return int(offsets[lo]), int(offsets[hi])
+
+    def read(self, columns=COLUMNS, frame_start=None, frame_end=None):
+        """回傳 {欄位: 陣列}；只讀取指定的欄位。"""
+        unknown = set(columns) - set(READ_COLUMNS)
+        if unknown:
+            raise KeyError(f"Unknown column(s): {', '.join(sorted(unknown))}")
+        start, end = self.row_range(frame_start, frame_end)
+        return {c: self._get(c)[start:end] for c in columns}
+
+    def dataframe(self, columns=("frame", "cls", "conf", "track_id"), frame_start=None, frame_end=None):
+        data = self.read(columns, frame_start, frame_end)
+        if "bbox" in data:
+            bbox = data.pop("bbox")
+            for i, name in enumerate(("xc", "yc", "w", "h")):
+                data[name] = bbox[:, i]
+        return pd.DataFrame(data)
+
+
+def update_track_ids(path, track_id):
+    """
+    把 track_id 改為 (縫合後的) track_id 並保留原始 ID 於 raw_track_id；track_id 依 store 的資料列順序。
+    ID 沒有變動時不重寫檔案，回傳是否有寫入。
+    """
+    with DetectionStore(path) as store:
+        data = store.read(READ_COLUMNS)
+        meta = store.meta
+    track_id = np.asarray(track_id).astype(_DTYPES["track_id"])
+    if len(track_id) != len(data["frame"]):
+        raise ValueError(f"{path} has {len(data['frame'])} rows, got {len(track_id)} track ids")
+    if np.array_equal(track_id, data["track_id"]):
+        return False
+    data["track_id"] = track_id
+    write_store(path, meta=meta, **data)
+    return True
+
+
+def labels_signature(files):
+    """labels 目錄的簽章：檔案數、總大小、最新 mtime。"""
+    return {"files": len(files), "bytes": int(sum(f[2] for f in files)), "mtime_ns": int(max((f[3] for f in files), default=0))}
+
+
+def convert_labels(labels_dir, output, files=None):
+    """把 labels/*.txt 轉成 detections.npz，回傳輸出路徑。"""
+    from label_loader import load_label_dir, scan_label_files
+    files = scan_label_files(labels_dir) if files is None else files
+    data = load_label_dir(labels_dir, with_features=False, use_cache=False, files=files)
+    meta = dict(labels_signature(files), labels_dir=str(Path(labels_dir).resolve()))
+    return write_store(output, data["frame"], data["cls"], data["conf"], data["track_id"], data["bbox"], meta)
+
+
+def ensure_store(labels_dir, output):
+    """detections.npz 不存在或與 labels 目錄不一致時重新轉換，回傳開啟的 DetectionStore。"""
+    from label_loader import scan_label_files
+    output = Path(output)
+    files = scan_label_files(labels_dir) if Path(labels_dir).is_dir() else []
+    if output.exists():
+        store = DetectionStore(output)
+        meta = store.meta
+        if not files or all(meta.get(k) == v for k, v in labels_signature(files).items()):
+            return store
+        store.close()
+    convert_labels(labels_dir, output, files)
+    return DetectionStore(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a tracking labels directory into a single columnar detections.npz.")
+    parser.add_argument("--labels_dir", required=True)
+    parser.add_argument("--output", default=None, help=f"Output file (default: <labels_dir>/../{STORE_NAME}).")
+    args = parser.parse_args()
+
+    output = args.output or str(Path(args.labels_dir).parent / STORE_NAME)
+    t0 = time.perf_counter()
+    convert_labels(args.labels_dir, output)
+    t1 = time.perf_counter()
+    with DetectionStore(output) as store:
+        store.read(("frame", "track_id"))
+        t2 = time.perf_counter()
+        print(f"Wrote {len(store)} detections in {len(store.frames())} frames to {output} "
+              f"({os.path.getsize(output) / 1e6:.2f} MB, convert {t1 - t0:.2f}s, load frame+track_id {1000 * (t2 - t1):.1f} ms)")
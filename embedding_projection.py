@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Embedding 降維 (PCA / 隨機投影) 與 int8 量化。
+
+model.embed 的特徵維度很高，每筆偵測都存一份 (標籤檔、記憶體中的累加器、Re-ID gallery)
+時，儲存空間與每一次距離計算的成本都跟著維度成長。這裡提供一個可選的投影階段：
+
+- method='pca'：以樣本的 SVD 取前 dim 個主成分。不減去平均值 (uncentered)，
+  因為我們要保留的是內積 / 餘弦，而不是變異數。
+- method='random'：高斯隨機矩陣 (QR 正交化)，不需要樣本，只需要種子。
+- int8=True：投影後先把每個向量正規化為單位長度，再乘上固定的 QUANT_SCALE (127) 存成 int8。
+  所有向量共用同一個縮放係數，逐 track 累加平均時不會混到不同尺度的向量；dequantize() 還原為 float32。
+
+投影矩陣只擬合一次，並以模型檔案的雜湊命名後存檔：
+    <dir>/<model_stem>.<hash>.<method><dim>[.int8].proj.npz
+換了模型就會重新擬合。distortion_report() 比較投影前後的餘弦距離分佈。
+
+對已存在的 labels 目錄擬合並產生報告：
+    python embedding_projection.py --labels_dir runs/predict/xxx/labels --model best.pt --dim 64
+"""
+import os
+import json
+import hashlib
+import argparse
+from pathlib import Path
+import numpy as np
+from crop_sampling import describe_values, ks_statistic
+
+METHODS = ("pca", "random")
+QUANT_SCALE = 127.0  # int8 向量 = 單位向量 * QUANT_SCALE
+
+
+def model_hash(model_path, length=16):
+    """模型檔案內容的 SHA-256 (前 length 碼)；檔案不存在時改用路徑字串。"""
+    h = hashlib.sha256()
+    try:
+        with open(model_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    except OSError:
+        h.update(str(model_path).encode("utf-8"))
+    return h.hexdigest()[:length]
+
+
+def projection_path(model_path, method, dim, int8=False, directory=None):
+    directory = Path(directory) if directory else Path(model_path).resolve().parent
+    suffix = ".int8" if int8 else ""
+    return directory / f"{Path(model_path).stem}.{model_hash(model_path)}.{method}{dim}{suffix}.proj.npz"
+
+
+def dequantize(x):
+    """int8 投影 -> float32 單位向量；float 輸入原樣回傳。"""
+    x = np.asarray(x)
+    return x.astype(np.float32) / QUANT_SCALE if x.dtype == np.int8 else x
+
+
+class EmbeddingProjector:
+    """把 (n, d) 的特徵投影到 (n, dim)，可選 int8 量化 (單位向量 * QUANT_SCALE)。"""
+
+    def __init__(self, method="pca", dim=64, int8=False):
+        if method not in METHODS:
+            raise ValueError(f"Unknown projection method: {method}")
+        self.method = method
+        self.dim = int(dim)
+        self.int8 = bool(int8)
+        self.components = None  # (d, dim)
+        self.explained = None  # PCA 保留的能量比例
+        self.model_hash = None
+
+    @property
+    def fitted(self):
+        return self.components is not None
+
+    def fit(self, sample, seed=0):
+        x = np.asarray(sample, dtype=np.float64)
+        if x.ndim != 2 or not len(x):
+            raise ValueError("Projection needs a non-empty (n, d) sample.")
+        d = x.shape[1]
+        if self.dim >= d:
+            raise ValueError(f"Target dimension {self.dim} must be smaller than the embedding dimension {d}.")
+        if self.method == "pca":
+            if len(x) < self.dim:
+                raise ValueError(f"PCA to {self.dim} dimensions needs at least {self.dim} samples, got {len(x)}.")
+            _, s, vt = np.linalg.svd(x, full_matrices=False)
+            self.components = vt[:self.dim].T.astype(np.float32)
+            energy = s ** 2
+            self.explained = float(energy[:self.dim].sum() / max(energy.sum(), 1e-12))
+        else:
+            rng = np.random.default_rng(seed)
+            q, _ = np.linalg.qr(rng.standard_normal((d, self.dim)))
+            self.components = q.astype(np.float32)
+        return self
+
+    def fingerprint(self, length=12):
+        """投影矩陣內容的 SHA-256 (前 length 碼)，用來辨識特徵是由哪一個投影產生。"""
+        return hashlib.sha256(np.ascontiguousarray(self.components, dtype=np.float32).tobytes()).hexdigest()[:length]
+
+    def transform(self, x):
+        """單一向量或 (n, d) 矩陣 -> 投影後的 float32 或 int8。"""
+        x = np.asarray(x, dtype=np.float32)
+        y = x @ self.components
+        if not self.int8:
+            return y
+        norms = np.linalg.norm(y, axis=-1, keepdims=True)
+        return np.round(y * (QUANT_SCALE / np.maximum(norms, 1e-12))).astype(np.int8)
+
+    def save(self, path):
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp.npz")
+        np.savez(tmp, method=np.array(self.method), dim=self.dim, int8=self.int8, components=self.components,
+                 explained=np.nan if self.explained is None else self.explained,
+                 model_hash=np.array(self.model_hash or ""))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            proj = cls(str(data["method"]), int(data["dim"]), bool(data["int8"]) if "int8" in data.files else False)
+            proj.components = data["components"]
+            explained = float(data["explained"])
+            proj.explained = None if np.isnan(explained) else explained
+            proj.model_hash = str(data["model_hash"]) or None
+        return proj
+
+
+def load_or_fit(model_path, sample, method="pca", dim=64, int8=False, directory=None, seed=0):
+    """讀取已存檔的投影；沒有 (或模型已改變) 時以 sample 擬合並存檔。"""
+    path = projection_path(model_path, method, dim, int8, directory)
+    if path.exists():
+        print(f"Loaded embedding projection: {path}")
+        return EmbeddingProjector.load(path)
+    proj = EmbeddingProjector(method, dim, int8).fit(sample, seed)
+    proj.model_hash = model_hash(model_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    proj.save(path)
+    print(f"Fitted {method} projection to {dim} dims on {len(sample)} samples; saved to {path}")
+    return proj
+
+
+def _cosine_distances(x, i, j):
+    x = np.asarray(x, dtype=np.float64)
+    norms = np.linalg.norm(x, axis=1)
+    norms[norms == 0] = 1.0
+    return 1.0 - np.einsum("nd,nd->n", x[i], x[j]) / (norms[i] * norms[j])
+
+
+def distortion_report(features, projector, n_pairs=20000, seed=0):
+    """隨機抽樣特徵對，比較投影前後的餘弦距離分佈。"""
+    features = np.asarray(features, dtype=np.float32)
+    n = len(features)
+    if n < 2:
+        return {"n_pairs": 0}
+    rng = np.random.default_rng(seed)
+    i = rng.integers(0, n, n_pairs)
+    j = rng.integers(0, n - 1, n_pairs)
+    j[j >= i] += 1  # 排除 i == j
+    before = _cosine_distances(features, i, j)
+    after = _cosine_distances(projector.transform(features), i, j)
+    err = after - before
+    return {
+        "method": projector.method, "dim": projector.dim, "int8": projector.int8,
+        "input_dim": int(features.shape[1]), "explained_energy": projector.explained,
+        "n_pairs": int(n_pairs), "original": describe_values(before), "projected": describe_values(after),
+        "ks_statistic": ks_statistic(before, after),
+        "mean_abs_error": float(np.abs(err).mean()), "max_abs_error": float(np.abs(err).max()),
+        "pearson": float(np.corrcoef(before, after)[0, 1]) if before.std() > 0 and after.std() > 0 else None,
+        "bytes_per_vector": {"original": int(features.shape[1] * 4), "projected": int(projector.dim * (1 if projector.int8 else 4))},
+    }
+
+
+class ProjectionStream:
+    """
+    串流分析用：先緩衝前 fit_samples 筆特徵，擬合 (或讀取) 投影後，
+    把緩衝的與之後的特徵都以投影後的形式交出。
+        for item, feature in stream.push(item, feature): ...
+        for item, feature in stream.finish(): ...
+    """
+
+    def __init__(self, model_path, method="pca", dim=64, int8=False, fit_samples=2000, directory=None):
+        self.model_path = model_path
+        self.method, self.dim, self.int8 = method, dim, int8
+        self.fit_samples = max(int(fit_samples), dim)
+        self.directory = directory
+        self.projector = None
+        self.buffer = []
+        self.sample = None
+        path = projection_path(model_path, method, dim, int8, directory)
+        if path.exists():
+            self.projector = load_or_fit(model_path, None, method, dim, int8, directory)
+
+    def push(self, item, feature):
+        if self.projector is not None:
+            return [(item, self.projector.transform(feature))]
+        self.buffer.append((item, np.asarray(feature, dtype=np.float32).ravel()))
+        return self._fit() if len(self.buffer) >= self.fit_samples else []
+
+    def finish(self):
+        return self._fit() if self.buffer else []
+
+    def _fit(self):
+        sample = np.stack([f for _, f in self.buffer])
+        try:
+            self.projector = load_or_fit(self.model_path, sample, self.method, self.dim, self.int8, self.directory)
+        except ValueError as e:
+            # 樣本不足或維度設定不合理：原樣交出，之後的特徵也會同樣未投影，維度保持一致
+            print(f"Warning: embedding projection skipped: {e}")
+            out, self.buffer = self.buffer, []
+            return out
+        self.sample = sample
+        out = [(item, f) for (item, _), f in zip(self.buffer, self.projector.transform(sample))]
+        self.buffer = []
+        return out
+
+    def report(self):
+        """以擬合時的樣本產生失真報告；投影是從檔案讀取時回傳 None。"""
+        return distortion_report(self.sample, self.projector) if self.sample is not None else None
+
+
+def add_projection_args(parser):
+    group = parser.add_argument_group("embedding projection")
+    group.add_argument("--reduce_dim", type=int, default=0, help="Project embeddings to this many dimensions (0 = off).")
+    group.add_argument("--reduce_method", choices=METHODS, default="pca", help="Projection fitted on the first embeddings.")
+    group.add_argument("--reduce_int8", action="store_true",
+                       help="Store projected embeddings as int8 (unit vectors scaled by 127).")
+    group.add_argument("--reduce_fit_samples", type=int, default=2000, help="Embeddings used to fit the projection.")
+    group.add_argument("--projection_dir", type=str, default=None, help="Where projections are saved (default: next to the model).")
+    return parser
+
+
+def stream_from_args(args, model_path):
+    if not args.reduce_dim:
+        return None
+    return ProjectionStream(model_path, args.reduce_method, args.reduce_dim, args.reduce_int8,
+                            args.reduce_fit_samples, args.projection_dir)
+
+
+if __name__ == "__main__":
+    from label_loader import load_label_dir
+
+    parser = argparse.ArgumentParser(description="Fit an embedding projection on a labels directory and report distance distortion.")
+    parser.add_argument("--labels_dir", required=True, help="Tracking labels with features (cls ... track_id f0 f1 ...).")
+    parser.add_argument("--model", required=True, help="Model that produced the embeddings (its hash names the projection).")
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--method", choices=METHODS, default="pca")
+    parser.add_argument("--int8", action="store_true")
+    parser.add_argument("--fit_samples", type=int, default=2000)
+    parser.add_argument("--projection_dir", default=None)
+    parser.add_argument("--output", default=None, help="Report path (default: <labels_dir>/../projection_report.json).")
+    args = parser.parse_args()
+
+    data = load_label_dir(args.labels_dir, with_features=True)
+    features = data["features"]
+    if features is None or not len(features):
+        print("Error: No features found in the labels directory.")
+        raise SystemExit(1)
+    rng = np.random.default_rng(0)
+    sample = features[rng.choice(len(features), min(args.fit_samples, len(features)), replace=False)]
+    projector = load_or_fit(args.model, sample, args.method, args.dim, args.int8, args.projection_dir)
+    report = distortion_report(features, projector)
+    output = Path(args.output) if args.output else Path(args.labels_dir).parent / "projection_report.json"
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"{features.shape[1]} -> {projector.dim} dims{' (int8)' if projector.int8 else ''}: "
+          f"KS={report['ks_statistic']:.4f}, mean |error|={report['mean_abs_error']:.4f}")
+    print(f"Report saved to {output}")
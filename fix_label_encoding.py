@@ -1,49 +1,146 @@
+"""
+Normalize label .txt files to UTF-8 without BOM, touching only the files that need it.
+
+The previous version read and rewrote every .txt under the tree. Now each file is sniffed by
+reading only its first 4 bytes. Files that start with a UTF-8 / UTF-16 / UTF-32 BOM (e.g. written
+by Notepad or Windows PowerShell's Out-File) are decoded and rewritten as UTF-8 without BOM through
+a temp file + os.replace, so an interrupted run never leaves a half-written label. Sniffing and
+rewriting run on a thread pool. Use --dry_run to only list the offenders.
+
+    python fix_label_encoding.py --dirs datasets/wildlife/labels --dry_run
+    python fix_label_encoding.py --dirs datasets/wildlife/labels/train_pseudo datasets/wildlife/labels/val
+"""
 import os
+import json
+import time
+import argparse
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from relabel_labels import atomic_write
+
+# Longest BOM first: the UTF-32 LE BOM starts with the UTF-16 LE one.
+BOMS = (
+    (b"\xff\xfe\x00\x00", "utf-32"),
+    (b"\x00\x00\xfe\xff", "utf-32"),
+    (b"\xef\xbb\xbf", "utf-8-sig"),
+    (b"\xff\xfe", "utf-16"),
+    (b"\xfe\xff", "utf-16"),
+)
+SNIFF_BYTES = 4
+BATCH_SIZE = 512
+_O_FLAGS = os.O_RDONLY | getattr(os, "O_BINARY", 0)
+
+
+def sniff_encoding(path):
+    """Return the codec of a file's BOM ('utf-8-sig', 'utf-16', 'utf-32') or None; reads 4 bytes."""
+    fd = os.open(path, _O_FLAGS)
+    try:
+        head = os.read(fd, SNIFF_BYTES)
+    finally:
+        os.close(fd)
+    return next((codec for bom, codec in BOMS if head.startswith(bom)), None)
+
+
+def normalize_file(path, codec):
+    """Decode with the sniffed codec (which strips the BOM) and atomically rewrite as UTF-8."""
+    with open(path, "rb") as f:
+        text = f.read().decode(codec)
+    atomic_write(path, text.encode("utf-8"))
+
+
+def _sniff_batch(paths):
+    found, errors = [], []
+    for path in paths:
+        try:
+            codec = sniff_encoding(path)
+        except OSError as e:
+            errors.append((path, str(e)))
+            continue
+        if codec:
+            found.append((path, codec))
+    return found, errors
 
-def fix_encoding(directory_path):
-    print(f"--- Fixing encoding in {directory_path} ---")
-    
-    # Define a list to store files that couldn't be fixed (should be none with latin-1 read)
-    failed_files = [] 
-
-    for root, _, files in os.walk(directory_path):
-        for file_name in files:
-            if file_name.endswith(".txt"):
-                file_path = Path(root) / file_name
-                try:
-                    # Read in binary mode to check for BOM bytes explicitly
-                    with open(file_path, 'rb') as f:
-                        content_bytes = f.read()
-                    
-                    # Check for and remove UTF-8 BOM (EF BB BF)
-                    if content_bytes.startswith(b'\xef\xbb\xbf'):
-                        content_bytes = content_bytes[3:] # Strip the first 3 bytes (BOM)
-                    
-                    # Decode to string and then write back as UTF-8 without BOM
-                    content_str = content_bytes.decode('utf-8')
-                    
-                    with open(file_path, 'w', encoding='utf-8') as f:
-                        f.write(content_str)
-                    print(f"✅ Fixed encoding for: {file_name}")
-                except Exception as e:
-                    print(f"❌ Error fixing encoding for {file_name}: {e}")
-                    failed_files.append(str(file_path))
-    
-    if not failed_files:
-        print(f"--- All files in {directory_path} processed successfully. ---")
+
+def _fix_one(item):
+    path, codec = item
+    try:
+        normalize_file(path, codec)
+        return None
+    except (OSError, UnicodeDecodeError) as e:
+        return path, str(e)
+
+
+def scan_txt_files(directory_path):
+    files = []
+    for root, _, names in os.walk(directory_path):
+        files.extend(os.path.join(root, n) for n in names if n.endswith(".txt"))
+    return files
+
+
+def fix_encoding(directory_path, dry_run=False, workers=None):
+    """Normalize every offending .txt under directory_path; returns a report dict."""
+    print(f"--- {'Checking' if dry_run else 'Fixing'} encoding in {directory_path} ---")
+    t0 = time.perf_counter()
+    files = scan_txt_files(directory_path)
+    batches = [files[i:i + BATCH_SIZE] for i in range(0, len(files), BATCH_SIZE)]
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    offenders, failed_files, failed_fixes = [], [], []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for found, errors in pool.map(_sniff_batch, batches):
+            offenders.extend(found)
+            failed_files.extend(errors)
+        if not dry_run:
+            failed_fixes = [r for r in pool.map(_fix_one, offenders) if r is not None]
+
+    by_codec = {}
+    for _, codec in offenders:
+        by_codec[codec] = by_codec.get(codec, 0) + 1
+    report = {
+        "directory": str(directory_path),
+        "files": len(files),
+        "offenders": len(offenders),
+        "by_encoding": by_codec,
+        "fixed": 0 if dry_run else len(offenders) - len(failed_fixes),
+        "offender_files": [p for p, _ in offenders],
+        "failed_files": failed_files + failed_fixes,
+        "dry_run": bool(dry_run),
+        "seconds": round(time.perf_counter() - t0, 3),
+    }
+    return report
+
+
+def print_report(report, show=20):
+    action = "need fixing" if report["dry_run"] else "fixed"
+    encodings = ", ".join(f"{codec}: {n}" for codec, n in sorted(report["by_encoding"].items())) or "none"
+    count = report["offenders"] if report["dry_run"] else report["fixed"]
+    print(f"{report['files']} .txt files scanned, {count} {action} ({encodings}) in {report['seconds']:.2f}s")
+    for path in report["offender_files"][:show]:
+        print(f"{'  ' if report['dry_run'] else '✅ Fixed encoding for: '}{path}")
+    if len(report["offender_files"]) > show:
+        print(f"  ... and {len(report['offender_files']) - show} more")
+    if not report["failed_files"]:
+        print(f"--- All files in {report['directory']} processed successfully. ---")
     else:
-        print(f"--- Failed to process the following files in {directory_path}: ---")
-        for f_path in failed_files:
-            print(f_path)
+        print(f"--- Failed to process the following files in {report['directory']}: ---")
+        for path, message in report["failed_files"]:
+            print(f"❌ {path}: {message}")
+
 
 if __name__ == "__main__":
-    label_dirs_to_fix = [
-        Path(r"datasets\wildlife_laser\trains\labels")
-    ]
+    parser = argparse.ArgumentParser(description="Strip BOMs / convert UTF-16 and UTF-32 label files to plain UTF-8.")
+    parser.add_argument("--dirs", nargs="+", default=[str(Path(r"datasets\wildlife_laser\trains\labels"))],
+                        help="Directories to scan recursively for .txt files.")
+    parser.add_argument("--dry_run", action="store_true", help="Only report which files would be rewritten.")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--report", default=None, help="Also write the reports as JSON.")
+    args = parser.parse_args()
 
-    for d in label_dirs_to_fix:
+    reports = []
+    for d in map(Path, args.dirs):
         if d.exists():
-            fix_encoding(d)
+            reports.append(fix_encoding(d, args.dry_run, args.workers))
+            print_report(reports[-1])
         else:
             print(f"⚠️ Warning: Directory not found: {d}. Skipping.")
+    if args.report:
+        Path(args.report).write_text(json.dumps(reports, ensure_ascii=False, indent=2), encoding="utf-8")
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+追蹤標籤檔 (labels/*.txt) 的快速平行載入器。
+
+`yolo track ... save_txt=True save_conf=True` 每一幀輸出一個 .txt，每行為
+    cls xc yc w h conf track_id [feature_0 ... feature_{d-1}]
+
+逐行 split + float() 在數萬個檔案、512 維特徵時非常慢。這裡：
+- 以 os.scandir 列出檔案 (同時取得 size/mtime)，每批數百個檔案交給 thread pool 讀取；
+- 每批檔案串成一個 buffer，以 numpy 一次轉成數值並在 byte 層級算出每行欄數，不逐行處理；
+- 依總筆數預先配置 cls / bbox / conf / track_id / frame / features 陣列後填入；
+- 結果存成二進位 sidecar (labels 目錄下的 .labels_cache.npz)，檔案未變動時直接讀取。
+
+使用方式：
+    from label_loader import load_label_dir
+    data = load_label_dir(labels_dir, with_features=True)
+    data["track_id"], data["features"]  # numpy arrays
+"""
+import os
+import re
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+
+BASE_COLS = 7  # cls, xc, yc, w, h, conf, track_id
+CACHE_NAME = ".labels_cache.npz"
+CACHE_VERSION = 2
+_FRAME_RE = re.compile(r"(\d+)$")
+
+
+def frame_index_from_stem(stem):
+    """'video_123' 或 '123' -> 123；無法解析時回傳 -1。"""
+    m = _FRAME_RE.search(stem)
+    return int(m.group(1)) if m else -1
+
+
+def scan_label_files(labels_dir):
+    """回傳 [(path, frame, size, mtime_ns)]，依幀序排列。"""
+    entries = []
+    with os.scandir(labels_dir) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith(".txt"):
+                st = entry.stat()
+                stem = entry.name[:-4]
+                entries.append((entry.path, frame_index_from_stem(stem), st.st_size, st.st_mtime_ns, stem))
+    entries.sort(key=lambda e: (e[1], e[4]))
+    return [e[:4] for e in entries]
+
+
+_WHITESPACE = np.zeros(256, dtype=bool)
+_WHITESPACE[[9, 10, 11, 12, 13, 32]] = True  # 與 bytes.split() 相同的空白字元
+
+
+def _parse_batch(batch, min_cols, truncate=False):
+    """
+    讀取一批檔案並一次解析：把內容串成一個 buffer，以 numpy 在 byte 層級找出每個 token 所屬的行，
+    得到每行的欄數後保留欄數一致 (且 >= min_cols) 的行；truncate=True 時改為保留所有 >= min_cols 的行，
+    並只取前 min_cols 欄 (不需要特徵時，與原本的 p[:7] 相同)。回傳 (frames, matrix) 或 None。
+    """
+    raws = []
+    for path, _, _, _ in batch:
+        with open(path, "rb") as f:
+            raw = f.read()
+        if raw.startswith(b"\xef\xbb\xbf"):  # 略過 UTF-8 BOM
+            raw = raw[3:]
+        if raw and not raw.endswith(b"\n"):
+            raw += b"\n"
+        raws.append(raw)
+    buf = b"".join(raws)
+    if not buf:
+        return None
+    try:
+        values = np.array(buf.split(), dtype=np.float64)
+    except ValueError:
+        return _parse_batch_slow(batch, raws, min_cols, truncate)
+
+    arr = np.frombuffer(buf, dtype=np.uint8)
+    space = _WHITESPACE[arr]
+    newline = arr == 10
+    tok_start = ~space & np.concatenate(([True], space[:-1]))
+    line_of_byte = np.cumsum(newline) - newline
+    tok_line = line_of_byte[tok_start]
+    widths = np.bincount(tok_line, minlength=int(newline.sum()))
+    candidates = widths[widths >= min_cols]
+    if not candidates.size:
+        return None
+    line_file = np.repeat(np.arange(len(raws)), [r.count(b"\n") for r in raws])
+    file_frames = np.array([f[1] for f in batch], dtype=np.int64)
+    if truncate:
+        keep_line = widths >= min_cols
+        col = np.arange(len(tok_line)) - (np.cumsum(widths) - widths)[tok_line]
+        keep_tok = keep_line[tok_line] & (col < min_cols)
+        return file_frames[line_file[keep_line]], values[keep_tok].reshape(-1, min_cols)
+    width = int(np.bincount(candidates).argmax())
+    keep_line = widths == width
+    return file_frames[line_file[keep_line]], values[keep_line[tok_line]].reshape(-1, width)
+
+
+def _parse_batch_slow(batch, raws, min_cols, truncate=False):
+    """有無法轉成數字的欄位時，逐行處理並略過壞掉的行。"""
+    frames, rows = [], []
+    for (_, frame, _, _), raw in zip(batch, raws):
+        for ln in raw.split(b"\n"):
+            parts = ln.split()
+            if len(parts) < min_cols:
+                continue
+            if truncate:
+                parts = parts[:min_cols]
+            try:
+                rows.append([float(x) for x in parts])
+                frames.append(frame)
+            except ValueError:
+                continue
+    if not rows:
+        return None
+    widths = [len(r) for r in rows]
+    width = max(set(widths), key=widths.count)
+    keep = [i for i, w in enumerate(widths) if w == width]
+    return np.array([frames[i] for i in keep], dtype=np.int64), np.array([rows[i] for i in keep], dtype=np.float64)
+
+
+def _cache_key(files, with_features):
+    total = sum(f[2] for f in files)
+    latest = max((f[3] for f in files), default=0)
+    return np.array([CACHE_VERSION, len(files), total, latest, int(with_features)], dtype=np.int64)
+
+
+def load_label_dir(labels_dir, with_features=True, workers=None, use_cache=True, files=None, batch_size=256):
+    """
+    讀取整個 labels 目錄。回傳 dict：
+        frame (int64), cls (int32), bbox (float32, N x 4, xc yc w h), conf (float32),
+        track_id (int64), features (float32, N x d；with_features=False 或沒有特徵時為 None)
+    with_features=True 時只保留帶有特徵的列 (至少 8 欄)。
+    檔案以 batch_size 個為一批交給 thread pool 讀取與解析。
+    """
+    labels_dir = Path(labels_dir)
+    files = scan_label_files(labels_dir) if files is None else files
+    key = _cache_key(files, with_features)
+    cache_path = labels_dir / CACHE_NAME
+    if use_cache and cache_path.exists():
+        try:
+            with np.load(cache_path) as cached:
+                if np.array_equal(cached["key"], key):
+                    data = {k: cached[k] for k in ("frame", "cls", "bbox", "conf", "track_id")}
+                    data["features"] = cached["features"] if with_features and cached["features"].size else None
+                    return data
+        except (OSError, ValueError, KeyError):
+            pass
+
+    min_cols = BASE_COLS + 1 if with_features else BASE_COLS
+    workers = workers or min(32, (os.cpu_count() or 1) * 4)
+    batches = [files[i:i + batch_size] for i in range(0, len(files), batch_size)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        parsed = [p for p in pool.map(lambda b: _parse_batch(b, min_cols, not with_features), batches) if p is not None]
+
+    # 特徵維度以資料列最多的欄數為準，維度不同的批次略過
+    rows_by_width = {}
+    for _, m in parsed:
+        rows_by_width[m.shape[1]] = rows_by_width.get(m.shape[1], 0) + m.shape[0]
+    width = max(rows_by_width, key=rows_by_width.get) if rows_by_width else min_cols
+    n = rows_by_width.get(width, 0)
+    d = width - BASE_COLS if with_features else 0
+
+    data = {
+        "frame": np.empty(n, dtype=np.int64),
+        "cls": np.empty(n, dtype=np.int32),
+        "bbox": np.empty((n, 4), dtype=np.float32),
+        "conf": np.empty(n, dtype=np.float32),
+        "track_id": np.empty(n, dtype=np.int64),
+        "features": np.empty((n, d), dtype=np.float32) if with_features else None,
+    }
+    pos = 0
+    for frames, m in parsed:
+        if m.shape[1] != width:
+            continue
+        end = pos + m.shape[0]
+        data["frame"][pos:end] = frames
+        data["cls"][pos:end] = m[:, 0]
+        data["bbox"][pos:end] = m[:, 1:5]
+        data["conf"][pos:end] = m[:, 5]
+        data["track_id"][pos:end] = m[:, 6]
+        if with_features:
+            data["features"][pos:end] = m[:, BASE_COLS:]
+        pos = end
+
+    if use_cache:
+        tmp = labels_dir / (CACHE_NAME + ".tmp.npz")
+        try:
+            np.savez(tmp, key=key, frame=data["frame"], cls=data["cls"], bbox=data["bbox"], conf=data["conf"],
+                     track_id=data["track_id"],
+                     features=data["features"] if with_features else np.empty((0, 0), dtype=np.float32))
+            os.replace(tmp, cache_path)
+        except OSError as e:
+            print(f"Warning: could not write label cache {cache_path}: {e}")
+    return data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load a tracking labels directory and report timing.")
+    parser.add_argument("labels_dir")
+    parser.add_argument("--no_features", action="store_true", help="Only load cls/bbox/conf/track_id.")
+    parser.add_argument("--no_cache", action="store_true", help="Ignore and do not write the binary sidecar.")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    data = load_label_dir(args.labels_dir, with_features=not args.no_features,
+                          workers=args.workers, use_cache=not args.no_cache)
+    elapsed = time.perf_counter() - t0
+    dim = data["features"].shape[1] if data["features"] is not None else 0
+    print(f"Loaded {len(data['track_id'])} rows ({dim}-dim features) from {args.labels_dir} in {elapsed:.2f}s")
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+追蹤進行中的即時 (增量) 統計。
+
+run_realtime_track_analyze_dashboard*.ps1 原本要等 `yolo track` 結束 (RTSP 需按 Ctrl+C) 才產生統計。
+這裡在追蹤的同時跟隨持續增加的 labels 目錄，只解析新出現的檔案，
+以累加的方式更新與 analyze_and_serve_template.py 相同的統計：
+    objects per frame、各 track 的 lifespan (筆數 / 秒數 / 主要類別)、class totals、average dwell by class
+每次更新的成本只與新資料列數有關 (目錄以 os.listdir 比對檔名，只對新檔案 stat 與解析)。
+
+追蹤迴圈也可以直接餵資料 (不經過 labels 目錄)：
+    agg = LiveAggregates(fps=30, names=model.names)
+    agg.add_rows(frame_idx, boxes.cls, boxes.id)
+
+獨立執行時啟動一個自動更新的儀表板，並定期把 CSV / summary.json 寫入 session 目錄
+(app_dashboard.py 會在檔案變更時自動重新載入)：
+    python live_analyzer.py --labels_dir runs/predict/track_xxx/labels --session_dir runs/analyze/track_xxx --port 5051
+"""
+import os
+import json
+import time
+import argparse
+import threading
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from label_loader import frame_index_from_stem, load_label_dir
+from timeseries_downsample import window
+
+CSV_FILES = ("objects_per_frame.csv", "track_lifespans.csv", "class_totals.csv", "avg_dwell_by_class.csv")
+
+
+def _grow(arr, size, fill=0):
+    """把陣列第一維擴充到至少 size (容量倍增)。"""
+    if size <= arr.shape[0]:
+        return arr
+    new = np.full((max(size, 2 * arr.shape[0]),) + arr.shape[1:], fill, dtype=arr.dtype)
+    new[:arr.shape[0]] = arr
+    return new
+
+
+class LiveAggregates:
+    """可累加的追蹤統計；add_rows() 的成本與新資料列數成正比。"""
+
+    def __init__(self, fps=30.0, names=None):
+        self.fps = float(fps) if fps else 30.0
+        self.names = dict(names or {})
+        self.lock = threading.Lock()
+        self.frame = np.zeros(1024, dtype=np.int64)        # 有偵測的幀 (依加入順序)
+        self.objects = np.zeros(1024, dtype=np.int64)      # 該幀不重複的 track 數
+        self.n_frames = 0
+        self.track_rows = np.zeros(1024, dtype=np.int64)   # 以 track_id 為索引
+        self.track_last = np.full(1024, -1, dtype=np.int64)
+        self.track_cls = np.zeros((1024, 4), dtype=np.int64)  # track_id x cls 的筆數
+        self.cls_rows = np.zeros(4, dtype=np.int64)
+        self.rows_total = 0
+        self.max_frame = -1
+
+    def add_rows(self, frame, cls, track_id):
+        """
+        加入一批偵測 (frame 可為單一幀編號或逐筆陣列)。同一幀的資料需一次加入，
+        objects per frame 才會正確。
+        """
+        cls = np.asarray(cls, dtype=np.int64).ravel()
+        track_id = np.asarray(track_id, dtype=np.int64).ravel()
+        if not len(track_id):
+            return
+        frame = np.broadcast_to(np.asarray(frame, dtype=np.int64), track_id.shape)
+        ok = (track_id >= 0) & (cls >= 0)
+        frame, cls, track_id = frame[ok], cls[ok], track_id[ok]
+        if not len(track_id):
+            return
+        # 每幀不重複的 track 數
+        pairs = np.unique(np.stack([frame, track_id], axis=1), axis=0)
+        frames, counts = np.unique(pairs[:, 0], return_counts=True)
+
+        with self.lock:
+            end = self.n_frames + len(frames)
+            self.frame = _grow(self.frame, end)
+            self.objects = _grow(self.objects, end)
+            self.frame[self.n_frames:end] = frames
+            self.objects[self.n_frames:end] = counts
+            self.n_frames = end
+
+            top = int(track_id.max()) + 1
+            self.track_rows = _grow(self.track_rows, top)
+            self.track_last = _grow(self.track_last, top, -1)
+            self.track_cls = _grow(self.track_cls, top)
+            n_cls = int(cls.max()) + 1
+            if n_cls > self.track_cls.shape[1]:
+                self.track_cls = np.pad(self.track_cls, ((0, 0), (0, n_cls - self.track_cls.shape[1])))
+                self.cls_rows = np.pad(self.cls_rows, (0, n_cls - len(self.cls_rows)))
+            np.add.at(self.track_rows, track_id, 1)
+            np.maximum.at(self.track_last, track_id, frame)
+            np.add.at(self.track_cls, (track_id, cls), 1)
+            self.cls_rows += np.bincount(cls, minlength=len(self.cls_rows))
+            self.rows_total += len(track_id)
+            self.max_frame = max(self.max_frame, int(frame.max()))
+
+    def add_frame(self, frame, cls, track_id):
+        self.add_rows(frame, cls, track_id)
+
+    def cls_name(self, c):
+        return self.names.get(int(c), f"cls{int(c)}")
+
+    def objects_series(self):
+        """(frame, objects)，依幀排序 (檔案不一定依序加入)。"""
+        with self.lock:
+            frame = self.frame[:self.n_frames].copy()
+            objects = self.objects[:self.n_frames].copy()
+        order = np.argsort(frame, kind="stable")
+        return frame[order], objects[order]
+
+    def tables(self):
+        """回傳與分析模板相同欄位的 (frame_counts, life, class_totals, avg_dwell)；成本與 track 數成正比。"""
+        frame, objects = self.objects_series()
+        frame_counts = pd.DataFrame({"frame": frame, "objects": objects})
+        with self.lock:
+            tids = np.flatnonzero(self.track_rows)
+            rows = self.track_rows[tids]
+            mode = self.track_cls[tids].argmax(axis=1)
+            cls_ids = np.flatnonzero(self.cls_rows)
+            cls_counts = self.cls_rows[cls_ids]
+        life = pd.DataFrame({"track_id": tids, "frames": rows, "seconds": rows / self.fps,
+                             "cls_name": [self.cls_name(c) for c in mode]})
+        class_totals = (pd.DataFrame({"class": [self.cls_name(c) for c in cls_ids], "count": cls_counts})
+                        .groupby("class", as_index=False)["count"].sum()
+                        .sort_values("count", ascending=False, kind="stable").reset_index(drop=True))
+        avg_dwell = life.groupby("cls_name")["seconds"].mean().rename("avg_seconds").reset_index()
+        return frame_counts, life, class_totals, avg_dwell
+
+    def summary(self, video=""):
+        with self.lock:
+            alive = self.track_rows > 0
+            n_tracks = int(alive.sum())
+            avg_life = float(self.track_rows[alive].mean() / self.fps) if n_tracks else 0.0
+            active = int((self.track_last[alive] >= self.max_frame - self.fps).sum()) if n_tracks else 0
+            return {
+                "video": video,
+                "fps": self.fps,
+                "frames": int(self.max_frame) + 1 if self.max_frame >= 0 else 0,
+                "tracks_total": n_tracks,
+                "avg_lifespan_sec": avg_life,
+                "objects_total": int(self.rows_total),
+                "active_tracks": active,  # 最近一秒內出現過的 track
+                "live": True,
+                "updated": time.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+
+    def write_outputs(self, out_dir, video=""):
+        """把目前的統計寫成 CSV 與 summary.json (每個檔案先寫暫存檔再取代)。"""
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        for name, df in zip(CSV_FILES, self.tables()):
+            tmp = out_dir / (name + ".tmp")
+            df.to_csv(tmp, index=False)
+            os.replace(tmp, out_dir / name)
+        tmp = out_dir / "summary.json.tmp"
+        tmp.write_text(json.dumps(self.summary(video), ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, out_dir / "summary.json")
+
+
+class LabelDirFollower:
+    """
+    跟隨持續增加的 labels 目錄：每次 poll() 只處理新出現的 .txt。
+    最新一幀的檔案可能還在寫入，mtime 未超過 settle 秒且沒有更新的幀出現前先保留。
+    """
+
+    def __init__(self, labels_dir, aggregates, settle=1.0):
+        self.labels_dir = Path(labels_dir)
+        self.aggregates = aggregates
+        self.settle_ns = int(settle * 1e9)
+        self.seen = set()
+        self.files_total = 0
+
+    def poll(self, final=False):
+        """解析新檔案並加入統計，回傳新加入的資料列數。"""
+        try:
+            names = set(os.listdir(self.labels_dir))
+        except FileNotFoundError:
+            return 0
+        new = [n for n in names - self.seen if n.endswith(".txt")]
+        if not new:
+            return 0
+        entries = []
+        for name in new:
+            path = os.path.join(self.labels_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, frame_index_from_stem(name[:-4]), st.st_size, st.st_mtime_ns, name))
+        if not final and entries:
+            now = time.time_ns()
+            newest = max(e[1] for e in entries)
+            entries = [e for e in entries if e[1] < newest or now - e[3] >= self.settle_ns]
+        if not entries:
+            return 0
+        entries.sort(key=lambda e: (e[1], e[4]))
+        self.seen.update(e[4] for e in entries)
+        self.files_total += len(entries)
+        data = load_label_dir(self.labels_dir, with_features=False, use_cache=False, files=[e[:4] for e in entries])
+        self.aggregates.add_rows(data["frame"], data["cls"], data["track_id"])
+        return len(data["track_id"])
+
+
+def load_names(yaml_path):
+    """讀取資料集 yaml 的 names (dict 或 list)。"""
+    if not yaml_path or not Path(yaml_path).exists():
+        return {}
+    import yaml
+    with open(yaml_path, "r", encoding="utf-8") as f:
+        raw = (yaml.safe_load(f) or {}).get("names", {})
+    if isinstance(raw, dict):
+        return {int(k): str(v) for k, v in raw.items()}
+    return {i: str(v) for i, v in enumerate(raw)}
+
+
+LIVE_HTML = """
+<!doctype html><html><head><meta charset="utf-8"><title>YOLOv12 即時追蹤統計</title>
+<script src="https://cdn.plot.ly/plotly-2.35.2.min.js"></script>
+<style>body{font-family:Segoe UI,Arial;margin:24px}.card{border:1px solid #ddd;border-radius:8px;padding:16px;margin:12px 0}.grid{display:grid;grid-template-columns:1fr 1fr;gap:16px}.mono{font-family:Consolas,monospace}</style>
+</head><body>
+<h1>YOLOv12 即時追蹤統計 (Live)</h1>
+<div class="card mono" id="summary">Waiting for data...</div>
+<div class="card"><h2>Objects over Time</h2><div id="objects"></div></div>
+<div class="grid">
+  <div class="card"><h2>Class Distribution</h2><div id="classes"></div></div>
+  <div class="card"><h2>Average Dwell by Class</h2><div id="dwell"></div></div>
+</div>
+<script>
+var REFRESH = {{ refresh_ms }};
+function fmt(el, s) {
+  // 以 textContent 組出摘要：video 是 --video 的原始字串 (可能是 URL)，不可當成 HTML
+  var fields = [["Video", s.video], ["FPS", s.fps], ["Frames", s.frames], ["Total tracks", s.tracks_total],
+                ["Active tracks", s.active_tracks], ["Avg lifespan (s)", s.avg_lifespan_sec.toFixed(2)],
+                ["Updated", s.updated]];
+  var nodes = [];
+  fields.forEach(function (f, i) {
+    var label = document.createElement("b");
+    label.textContent = f[0] + ":";
+    nodes.push(document.createTextNode(i ? " | " : ""), label, document.createTextNode(" " + f[1]));
+  });
+  el.replaceChildren.apply(el, nodes);
+}
+function refresh() {
+  // 使用者縮放時只要求目前範圍的資料 (uirevision 讓 Plotly 保留縮放狀態)
+  var gd = document.getElementById("objects"), q = "";
+  if (gd.layout && gd.layout.xaxis && !gd.layout.xaxis.autorange) {
+    q = "?start=" + Math.floor(gd.layout.xaxis.range[0]) + "&end=" + Math.ceil(gd.layout.xaxis.range[1]);
+  }
+  fetch("/api/live" + q).then(function (r) { return r.json(); }).then(function (d) {
+    fmt(document.getElementById("summary"), d.summary);
+    Plotly.react("objects", [{x: d.objects.x, y: d.objects.y, mode: "lines"}],
+                 {uirevision: "keep", xaxis: {title: "Frame"}, yaxis: {title: "Objects"}});
+    Plotly.react("classes", [{type: "bar", x: d.classes.x, y: d.classes.y}],
+                 {uirevision: "keep", xaxis: {title: "Class"}, yaxis: {title: "Count"}});
+    Plotly.react("dwell", [{type: "bar", x: d.dwell.x, y: d.dwell.y}],
+                 {uirevision: "keep", xaxis: {title: "Class"}, yaxis: {title: "Seconds"}});
+  }).finally(function () { setTimeout(refresh, REFRESH); });
+}
+refresh();
+</script>
+</body></html>
+"""
+
+
+def create_app(aggregates, video="", refresh=2.0, max_points=2000):
+    from flask import Flask, jsonify, render_template_string, request
+    app = Flask(__name__)
+
+    @app.route("/")
+    def index():
+        return render_template_string(LIVE_HTML, refresh_ms=int(refresh * 1000))
+
+    @app.route("/api/live")
+    def live():
+        """目前的統計：/api/live?start=&end= 時 objects 只回傳該幀範圍 (LTTB 降取樣)。"""
+        frame, objects = aggregates.objects_series()
+        _, _, class_totals, avg_dwell = aggregates.tables()
+        series = window(frame, objects, request.args.get("start", type=float), request.args.get("end", type=float),
+                        max_points, "lttb")
+        return jsonify({
+            "summary": aggregates.summary(video),
+            "objects": {"x": series["x"], "y": series["y"]},
+            "classes": {"x": class_totals["class"].tolist(), "y": class_totals["count"].tolist()},
+            "dwell": {"x": avg_dwell["cls_name"].tolist(), "y": avg_dwell["avg_seconds"].tolist()},
+        })
+
+    return app
+
+
+def follow(follower, session_dir=None, video="", poll=1.0, write_every=30.0, stop=None):
+    """輪詢 labels 目錄直到 stop 被設定 (或 Ctrl+C)；結束前處理剩下的檔案並寫出最後的統計。"""
+    stop = stop or threading.Event()
+    last_write = time.monotonic()
+    try:
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            added = follower.poll()
+            if added:
+                print(f"[live] +{added} rows ({follower.files_total} files, {follower.aggregates.rows_total} rows total, "
+                      f"{1000 * (time.perf_counter() - t0):.0f} ms)")
+            if session_dir and write_every and time.monotonic() - last_write >= write_every:
+                follower.aggregates.write_outputs(session_dir, video)
+                last_write = time.monotonic()
+            stop.wait(poll)
+    except KeyboardInterrupt:
+        pass
+    follower.poll(final=True)
+    if session_dir:
+        follower.aggregates.write_outputs(session_dir, video)
+        print(f"[live] Statistics written to {session_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Follow a growing tracking labels directory and serve live statistics.")
+    parser.add_argument("--labels_dir", required=True, help="labels directory written by `yolo track save_txt=True` (may not exist yet).")
+    parser.add_argument("--session_dir", default=None, help="Periodically write the CSVs and summary.json here.")
+    parser.add_argument("--yaml", default=None, help="Dataset yaml with class names.")
+    parser.add_argument("--video", default="", help="Video/stream name shown in the summary.")
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--poll", type=float, default=1.0, help="Seconds between directory scans.")
+    parser.add_argument("--settle", type=float, default=1.0, help="Hold the newest frame file until it is this many seconds old.")
+    parser.add_argument("--write_every", type=float, default=30.0, help="Seconds between writes to --session_dir (0 = only at exit).")
+    parser.add_argument("--port", type=int, default=5051)
+    parser.add_argument("--refresh", type=float, default=2.0, help="Dashboard refresh interval in seconds.")
+    parser.add_argument("--no_server", action="store_true", help="Do not start the dashboard.")
+    args = parser.parse_args()
+
+    aggregates = LiveAggregates(args.fps, load_names(args.yaml))
+    follower = LabelDirFollower(args.labels_dir, aggregates, args.settle)
+    video = Path(args.video).name if args.video and Path(args.video).suffix and "://" not in args.video else args.video
+    if not args.no_server:
+        app = create_app(aggregates, video, args.refresh)
+        threading.Thread(target=lambda: app.run(host="0.0.0.0", port=args.port, debug=False, use_reloader=False),
+                         daemon=True).start()
+        print(f"Live dashboard on http://127.0.0.1:{args.port}/ (Ctrl+C to stop)")
+    follow(follower, args.session_dir, video, args.poll, args.write_every)
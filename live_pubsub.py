@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+即時串流伺服器 -> 儀表板的即時計數推播。
+
+live_stream_server*.py (port 5000) 與 app_dashboard.py (port 5050) 原本沒有共享任何狀態。
+這裡用本機 UDP (預設 127.0.0.1:5599) 當作發佈 / 訂閱通道：
+- 串流伺服器的追蹤迴圈每一幀呼叫 LiveCounterPublisher.update(result)，
+  每 interval 秒送出一個 JSON datagram：畫面中物件數、各類別數量、最近 active_window 秒內出現的 track 數、
+  累計 track 數、處理 FPS。UDP 不需要連線，沒有儀表板在聽時也不會阻塞追蹤迴圈。
+- 儀表板的 LiveCounterHub 在背景執行緒接收，保存每個來源的最新狀態，
+  只把有變動的欄位 (delta) 放進每個瀏覽器連線的佇列，由 SSE (/api/live/events) 推送。
+  新連線先收到完整快照；慢的連線佇列滿時丟棄舊的 delta 並在下一次送出完整快照。
+
+    publisher = LiveCounterPublisher("cam1", port=5599)
+    for r in model.track(source, stream=True):
+        publisher.update(r)
+"""
+import json
+import time
+import queue
+import socket
+import threading
+import numpy as np
+
+DEFAULT_PORT = 5599
+MAX_DATAGRAM = 65000
+
+
+def _to_numpy(x):
+    if x is None:
+        return None
+    return x.cpu().numpy() if hasattr(x, "cpu") else np.asarray(x)
+
+
+class LiveCounterPublisher:
+    """在追蹤迴圈中累計計數，定期以 UDP 發佈。"""
+
+    def __init__(self, source, host="127.0.0.1", port=DEFAULT_PORT, interval=0.5, active_window=2.0):
+        self.source = str(source)
+        self.address = (host, int(port))
+        self.interval = float(interval)
+        self.active_window = float(active_window)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.last_seen = {}        # track_id -> 最後出現的時間
+        self.tracks_total = set()
+        self.frames = 0
+        self.frames_since = 0
+        self.objects_sum = 0
+        self.last_publish = time.monotonic()
+        self.seq = 0
+
+    def update(self, result):
+        """每一幀呼叫一次 (ultralytics Results)；到了發佈時間才組訊息。"""
+        now = time.monotonic()
+        self.frames += 1
+        self.frames_since += 1
+        boxes = getattr(result, "boxes", None)
+        cls = _to_numpy(boxes.cls).astype(np.int64) if boxes is not None and boxes.cls is not None else np.zeros(0, np.int64)
+        ids = _to_numpy(boxes.id) if boxes is not None and boxes.id is not None else None
+        self.objects_sum += len(cls)
+        if ids is not None:
+            for tid in ids.astype(np.int64).tolist():
+                self.last_seen[tid] = now
+                self.tracks_total.add(tid)
+        if now - self.last_publish >= self.interval:
+            names = getattr(result, "names", None) or {}
+            self.publish(now, cls, names)
+
+    def publish(self, now, cls, names):
+        elapsed = max(now - self.last_publish, 1e-6)
+        cutoff = now - self.active_window
+        self.last_seen = {t: s for t, s in self.last_seen.items() if s >= cutoff}
+        counts = np.bincount(cls) if len(cls) else np.zeros(0, np.int64)
+        classes = {str(names.get(int(c), f"cls{int(c)}")): int(n) for c, n in enumerate(counts) if n}
+        message = {
+            "source": self.source,
+            "seq": self.seq,
+            "time": time.time(),
+            "frame": self.frames,
+            "fps": round(self.frames_since / elapsed, 1),
+            "objects": int(len(cls)),
+            "objects_avg": round(self.objects_sum / max(self.frames_since, 1), 2),
+            "classes": classes,
+            "active_tracks": len(self.last_seen),
+            "tracks_total": len(self.tracks_total),
+        }
+        self.seq += 1
+        self.frames_since = 0
+        self.objects_sum = 0
+        self.last_publish = now
+        try:
+            self.sock.sendto(json.dumps(message, ensure_ascii=False).encode("utf-8")[:MAX_DATAGRAM], self.address)
+        except OSError:
+            pass  # 沒有訂閱者或緩衝區已滿時略過，不影響追蹤
+        return message
+
+    def close(self):
+        self.sock.close()
+
+
+def diff_state(old, new):
+    """回傳 new 相對 old 有變動的欄位 (classes 整個比較)。"""
+    return {k: v for k, v in new.items() if old.get(k) != v}
+
+
+class LiveCounterHub:
+    """接收 UDP 計數並分送給 SSE 連線。"""
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, offline_after=5.0, queue_size=64):
+        self.address = (host, int(port))
+        self.offline_after = float(offline_after)
+        self.queue_size = int(queue_size)
+        self.state = {}        # source -> 最新的完整狀態
+        self.received = {}     # source -> 最後收到的時間 (monotonic)
+        self.clients = set()
+        self.lock = threading.Lock()
+        self.sock = None
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(self.address)
+        self.sock.settimeout(1.0)
+        threading.Thread(target=self._receive_loop, daemon=True).start()
+        return self
+
+    def _receive_loop(self):
+        while True:
+            try:
+                data, _ = self.sock.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                data = None
+            except OSError:
+                continue
+            try:
+                now = time.monotonic()
+                if data is not None:
+                    self._handle(data, now)
+                self._mark_offline(now)
+            except Exception as e:  # 任何封包都不能讓接收執行緒結束，否則即時計數會無聲停止
+                print(f"Warning: ignored live counter packet: {e!r}")
+
+    def _handle(self, data, now):
+        try:
+            message = json.loads(data.decode("utf-8"))
+        except ValueError:
+            return
+        if not isinstance(message, dict) or "source" not in message:
+            return
+        source = str(message.pop("source"))
+        message["online"] = True
+        with self.lock:
+            delta = diff_state(self.state.get(source, {}), message)
+            self.state[source] = message
+            self.received[source] = now
+        # seq / time 每次都會變，只有它們變動時不必推送
+        if set(delta) - {"seq", "time"}:
+            self._broadcast({"type": "delta", "source": source, "data": delta})
+
+    def _mark_offline(self, now):
+        with self.lock:
+            gone = [s for s, t in self.received.items()
+                    if now - t > self.offline_after and self.state[s].get("online")]
+            for s in gone:
+                self.state[s]["online"] = False
+        for s in gone:
+            self._broadcast({"type": "delta", "source": s, "data": {"online": False}})
+
+    def _broadcast(self, event):
+        with self.lock:
+            clients = list(self.clients)
+        for q in clients:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # 慢的連線：清空佇列，改送一次完整快照
+                try:
+                    while True:
+                        q.get_nowait()
+                except queue.Empty:
+                    pass
+                q.put_nowait({"type": "snapshot", "data": self.snapshot()})
+
+    def snapshot(self):
+        with self.lock:
+            return {s: dict(v) for s, v in self.state.items()}
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.queue_size)
+        with self.lock:
+            self.clients.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.clients.discard(q)
+
+    def events(self, heartbeat=15.0):
+        """SSE 產生器：先送完整快照，之後只送 delta；閒置時送註解行維持連線。"""
+        q = self.subscribe()
+        try:
+            yield "retry: 3000\n\n"
+            yield f"data: {json.dumps({'type': 'snapshot', 'data': self.snapshot()}, ensure_ascii=False)}\n\n"
+            while True:
+                try:
+                    event = q.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            self.unsubscribe(q)
+
+
+def add_publish_args(parser):
+    parser.add_argument("--publish_port", type=int, default=DEFAULT_PORT,
+                        help="Publish live counters to the dashboard over local UDP (0 = off).")
+    parser.add_argument("--publish_name", type=str, default=None, help="Source name shown on the dashboard.")
+    return parser
+
+
+def publisher_from_args(args, default_name):
+    if not args.publish_port:
+        return None
+    return LiveCounterPublisher(args.publish_name or default_name, port=args.publish_port)
@@ -8,6 +8,7 @@ import sys  # <-- 為了打包 EXE 新增
 import os   # <-- 為了打包 EXE 新增
 from flask import Flask, Response, render_template_string, request, redirect, url_for
 from ultralytics import YOLO
+from live_pubsub import add_publish_args, publisher_from_args
 
 # ========== MODIFIED: EXE Path Helper & Relative Path Definitions ==========
 def resource_path(relative_path):
@@ -25,6 +26,7 @@ DEFAULT_MODEL_PATH = resource_path("best.pt")
 DEFAULT_VIDEO_SOURCE = "20251022.mp4"
 GLOBAL_MODEL_PATH = DEFAULT_MODEL_PATH
 GLOBAL_VIDEO_SOURCE = DEFAULT_VIDEO_SOURCE
+GLOBAL_PUBLISHER = None  # live counters for the dashboard (--publish_port)
 # ===========================================================================
 
 
@@ -152,6 +154,8 @@ def generate_frames():
         for r in results:
             if r is None:
                 continue
+            if GLOBAL_PUBLISHER is not None:
+                GLOBAL_PUBLISHER.update(r)
                 
             frame = r.plot() 
             ret, buffer = cv2.imencode('.jpg', frame)
@@ -206,10 +210,12 @@ if __name__ == '__main__':
     parser.add_argument("--video", type=str, default=DEFAULT_VIDEO_SOURCE, help="影片來源 (檔案路徑, RTSP, URL, 0 for webcam)")
     parser.add_argument("--model", type=str, default=DEFAULT_MODEL_PATH, help="模型路徑")
     parser.add_argument("--port", type=int, default=5000, help="服務器端口")
+    add_publish_args(parser)
     args = parser.parse_args()
     
     GLOBAL_VIDEO_SOURCE = args.video
     GLOBAL_MODEL_PATH = args.model
+    GLOBAL_PUBLISHER = publisher_from_args(args, f"live:{args.port}")
     
     print(f"🚀 Live Stream Dashboard on http://127.0.0.1:{args.port}/")
     app.run(host='0.0.0.0', port=args.port, debug=False)
\ No newline at end of file
@@ -7,6 +7,7 @@ import numpy as np
 # ========== MODIFIED: 增加 request, redirect, url_for ==========
 from flask import Flask, Response, render_template_string, request, redirect, url_for
 from ultralytics import YOLO
+from live_pubsub import add_publish_args, publisher_from_args
 
 # ========== NEW: Direct yt-dlp Import and Helper Function ==========
 try:
@@ -57,6 +58,7 @@ DEFAULT_MODEL_PATH = r"C:\Users\wangs\monkeyv7\best.pt"
 DEFAULT_VIDEO_SOURCE = "20251022.mp4" 
 GLOBAL_MODEL_PATH = DEFAULT_MODEL_PATH
 GLOBAL_VIDEO_SOURCE = DEFAULT_VIDEO_SOURCE
+GLOBAL_PUBLISHER = None  # live counters for the dashboard (--publish_port)
 
 # --- Flask App 設定 ---
 app = Flask(__name__)
@@ -142,6 +144,8 @@ def generate_frames():
         for r in results:
             if r is None:
                 continue
+            if GLOBAL_PUBLISHER is not None:
+                GLOBAL_PUBLISHER.update(r)
                 
             frame = r.plot() 
             ret, buffer = cv2.imencode('.jpg', frame)
@@ -206,11 +210,13 @@ if __name__ == '__main__':
     parser.add_argument("--video", type=str, default=DEFAULT_VIDEO_SOURCE, help="影片來源 (檔案路徑, RTSP, URL, 0 for webcam)")
     parser.add_argument("--model", type=str, default=DEFAULT_MODEL_PATH, help="模型路徑")
     parser.add_argument("--port", type=int, default=5000, help="服務器端口")
+    add_publish_args(parser)
     args = parser.parse_args()
     
     # 啟動時設置一次
     GLOBAL_VIDEO_SOURCE = args.video
     GLOBAL_MODEL_PATH = args.model
+    GLOBAL_PUBLISHER = publisher_from_args(args, f"live:{args.port}")
     
     print(f"🚀 Live Stream Dashboard on http://127.0.0.1:{args.port}/")
     app.run(host='0.0.0.0', port=args.port, debug=False)
\ No newline at end of file
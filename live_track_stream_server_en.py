@@ -6,6 +6,7 @@ import argparse
 import numpy as np
 from flask import Flask, Response, render_template_string
 from ultralytics import YOLO
+from live_pubsub import add_publish_args, publisher_from_args
 
 # ========== NEW: Direct yt-dlp Import and Helper Function ==========
 try:
@@ -62,6 +63,7 @@ DEFAULT_MODEL_PATH = r"C:\Users\wangs\monkeyv7\runs\train\dawn_semi_round3\weigh
 DEFAULT_VIDEO_SOURCE = "wildlife.mp4" 
 GLOBAL_MODEL_PATH = DEFAULT_MODEL_PATH
 GLOBAL_VIDEO_SOURCE = DEFAULT_VIDEO_SOURCE
+GLOBAL_PUBLISHER = None  # live counters for the dashboard (--publish_port)
 
 # --- Flask App Configuration ---
 app = Flask(__name__)
@@ -134,6 +136,8 @@ def generate_frames():
         for r in results:
             if r is None:
                 continue
+            if GLOBAL_PUBLISHER is not None:
+                GLOBAL_PUBLISHER.update(r)
             
             # --- 獲取推論繪圖結果 ---
             annotated_frame = r.plot()
@@ -229,10 +233,12 @@ if __name__ == '__main__':
     parser.add_argument("--video", type=str, default=DEFAULT_VIDEO_SOURCE, help="Video source (file path, RTSP, URL, 0 for webcam)")
     parser.add_argument("--model", type=str, default=DEFAULT_MODEL_PATH, help="Model path")
     parser.add_argument("--port", type=int, default=5000, help="Server port")
+    add_publish_args(parser)
     args = parser.parse_args()
     
     GLOBAL_VIDEO_SOURCE = args.video
     GLOBAL_MODEL_PATH = args.model
+    GLOBAL_PUBLISHER = publisher_from_args(args, f"live:{args.port}")
     
     print(f"🚀 Live Stream Dashboard on http://127.0.0.1:{args.port}/")
     app.run(host='0.0.0.0', port=args.port, debug=False)
\ No newline at end of file
@@ -1,6 +1,7 @@
 import os
 import fiftyone as fo
 import fiftyone.zoo as foz
+from relabel_labels import relabel_dirs, print_report
 
 # 定義類別列表
 classes = [
@@ -43,34 +44,9 @@ def update_txt_file_class_indices(class_name):
         os.remove(dataset_yaml)
         
     if os.path.exists(labels_dir):
-        for filename in os.listdir(labels_dir):
-            if filename.endswith('.txt'):
-                filepath = os.path.join(labels_dir, filename)
-
-                # 读取并处理.txt文件
-                with open(filepath, 'r') as file:
-                    lines = file.readlines()
-
-                # 更新类别索引
-                updated_lines = []
-                for line in lines:
-                    parts = line.strip().split()
-                    if len(parts) >= 5: # 假设每行至少有5个元素 (class index在第0个位置)
-                        class_idx_str = parts[0] # 原类别索引 (可能是名称也可能是数字)
-                        try:
-                            # 嘗試從映射表中取得正確索引
-                            updated_class_idx = str(class_to_index[class_name])
-                        except ValueError: # 原始截圖為 ValueError，但建議注意 KeyError
-                            # 如果转换失败，则按类别名称补全
-                            updated_class_idx = class_name
-                            # 這裡原截圖邏輯似乎是想處理異常，將名稱填回
-                        
-                        parts[0] = updated_class_idx
-                        updated_lines.append(' '.join(parts) + '\n')
-
-                # 写回更新后的行
-                with open(filepath, 'w') as file:
-                    file.writelines(updated_lines)
+        # 单一类别导出的标签一律改成合并后的类别索引 (并行处理、原子写入、未变动的文件不写入)
+        report = relabel_dirs([labels_dir], {"*": class_to_index[class_name]})
+        print_report(report)
         print(f"{class_name}类别的所有.txt文件的索引已更新。")
 
 # 主程式迴圈
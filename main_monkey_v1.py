@@ -2,6 +2,7 @@ import os
 import time
 import fiftyone as fo
 import fiftyone.zoo as foz
+from relabel_labels import relabel_dirs, print_report
 
 # 定義類別列表
 classes = [
@@ -27,34 +28,9 @@ def update_txt_file_class_indices(class_name):
         os.remove(dataset_yaml)
         
     if os.path.exists(labels_dir):
-        for filename in os.listdir(labels_dir):
-            if filename.endswith('.txt'):
-                filepath = os.path.join(labels_dir, filename)
-
-                # 讀取並處理 .txt 文件
-                with open(filepath, 'r') as file:
-                    lines = file.readlines()
-
-                # 更新類別索引
-                updated_lines = []
-                for line in lines:
-                    parts = line.strip().split()
-                    if len(parts) >= 5: # 假設每行至少有 5 個元素
-                        # parts[0] 是類別索引
-                        try:
-                            # 嘗試從映射表中取得正確索引
-                            updated_class_idx = str(class_to_index[class_name])
-                        except KeyError: 
-                            # 如果在映射表中找不到該類別，則保留原名稱或進行其他處理
-                            print(f"Warning: Class '{class_name}' not found in index map.")
-                            updated_class_idx = class_name
-                        
-                        parts[0] = updated_class_idx
-                        updated_lines.append(' '.join(parts) + '\n')
-
-                # 寫回更新後的行
-                with open(filepath, 'w') as file:
-                    file.writelines(updated_lines)
+        # 單一類別匯出的標籤一律改成合併後的類別索引 (平行處理、原子寫入、未變動的檔案不寫入)
+        report = relabel_dirs([labels_dir], {"*": class_to_index[class_name]})
+        print_report(report)
         print(f"[{class_name}] 類別的所有 .txt 標籤索引已更新完畢。")
 
 # 主程式迴圈
@@ -1,23 +1,9 @@
-import os
+from relabel_labels import relabel_dirs, print_report
 
 directories = ["datasets/wildlife/labels/train_laser", "datasets/wildlife/labels/val_laser"]
 
-for directory in directories:
-    for filename in os.listdir(directory):
-        if filename.endswith(".txt"):
-            filepath = os.path.join(directory, filename)
-            with open(filepath, 'r') as f:
-                lines = f.readlines()
-            
-            modified_lines = []
-            for line in lines:
-                if line.startswith('0 '):
-                    modified_lines.append('1' + line[1:])
-                else:
-                    modified_lines.append(line)
-            
-            with open(filepath, 'w') as f:
-                f.writelines(modified_lines)
-    print(f"All '0' labels in {directory} have been changed to '1'.")
+# 所有類別 0 的標籤改成 1 (平行處理、原子寫入；已經改過的檔案不會再寫入)
+report = relabel_dirs(directories, "0=1")
+print_report(report)
 
 print("All specified directories have been processed.")
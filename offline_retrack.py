@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+由原始偵測離線重新追蹤：改 conf / iou 門檻時不必重新推論。
+
+想看 conf=0.35 而不是 0.45 的統計時，原本要對整支影片重新執行 `yolo track`。這裡分成兩步：
+
+1. record：以很低的 conf 下限 (預設 0.05) 與寬鬆的 NMS iou 推論一次 (model.predict，不追蹤)，
+   把每一幀的原始偵測存成 detection_store 格式的 raw_detections.npz (track_id = -1)
+2. run / sweep：由 raw_detections.npz 篩選 conf >= 新門檻、必要時以更嚴格的 iou 再做一次各類別 NMS，
+   再把每一幀餵給與 model.track 相同設定的追蹤器 (bytetrack 預設用 array_bytetrack.py 的陣列實作，
+   與 ultralytics BYTETracker 逐步對應；其他追蹤器用 ultralytics)，
+   最後產生與分析模板相同的 session 目錄 (detections.npz、CSV、summary.json)，app_dashboard.py 可直接瀏覽。
+   sweep 以 process pool 平行處理多組門檻。
+   sweep 預設寫到 runs/retrack 而不是 runs/analyze：同一段影片的 N 組門檻若放在一起，
+   /trends 的 session 目錄會把同一段畫面計算 N 次 (以 app_dashboard.py --base runs/retrack 瀏覽)。
+
+NMS 依分數由高到低貪婪處理，所以先篩 conf 再 NMS 的結果與直接用新 conf 推論完全相同；
+iou 只能比錄製時更嚴格 (被抑制的框無法還原)，且結果是近似值。
+離線時沒有影像：BoT-SORT 的相機運動補償 (GMC) 與 ReID 會關閉。
+
+    python offline_retrack.py record --video wildlife.mp4 --model best.pt --output runs/raw/wildlife.npz
+    python offline_retrack.py run --raw runs/raw/wildlife.npz --conf 0.35 --session_dir runs/retrack/wildlife_c035
+    python offline_retrack.py sweep --raw runs/raw/wildlife.npz --conf 0.25 0.35 0.45 --iou 0.5 0.7 --base runs/retrack
+"""
+import json
+import time
+import argparse
+import importlib.util
+from types import SimpleNamespace
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from detection_store import STORE_NAME, DetectionStore, DetectionStoreWriter, write_store
+
+RAW_NAME = "raw_detections.npz"
+DEFAULT_CONF_FLOOR = 0.05
+DEFAULT_RECORD_IOU = 0.7
+TRACKER_FRAME_RATE = 30  # model.track 建立追蹤器時使用的 frame_rate
+
+
+def record(video, model_path, output, conf_floor=DEFAULT_CONF_FLOOR, iou=DEFAULT_RECORD_IOU, imgsz=None, device=None):
+    """推論一次並存下 conf >= conf_floor 的所有偵測 (bbox 為正規化 xc yc w h，幀編號由 1 起算)。"""
+    import cv2
+    from ultralytics import YOLO
+    cap = cv2.VideoCapture(str(video))
+    fps = cap.get(cv2.CAP_PROP_FPS) if cap.isOpened() and cap.get(cv2.CAP_PROP_FPS) > 0 else 30.0
+    cap.release()
+    model = YOLO(model_path)
+    kwargs = {"conf": conf_floor, "iou": iou, "stream": True, "verbose": False}
+    if imgsz:
+        kwargs["imgsz"] = imgsz
+    if device is not None:
+        kwargs["device"] = device
+    meta = {"raw": True, "video": str(video), "model": str(model_path), "conf_floor": conf_floor, "iou": iou,
+            "fps": fps, "names": {int(k): str(v) for k, v in model.names.items()}}
+    writer = DetectionStoreWriter(output, meta)
+    frames, frame_size, t0 = 0, None, time.perf_counter()
+    for frames, r in enumerate(model.predict(source=str(video), **kwargs), start=1):
+        boxes = r.boxes.cpu().numpy()
+        frame_size = (int(r.orig_shape[1]), int(r.orig_shape[0]))
+        writer.add_frame(frames, boxes.cls, boxes.conf, np.full(len(boxes), -1), boxes.xywhn)
+        if frames % 1000 == 0:
+            print(f"  {frames} frames, {frames / (time.perf_counter() - t0):.1f} fps")
+    writer.meta.update(frames=frames, frame_size=frame_size)
+    path = writer.close()
+    print(f"Recorded {frames} frames to {path} in {time.perf_counter() - t0:.1f}s")
+    return path
+
+
+def nms_keep(xyxy, conf, cls, iou):
+    """各類別的貪婪 NMS，回傳保留的索引 (依分數由高到低)。"""
+    order = np.argsort(-conf, kind="stable")
+    xyxy, cls = xyxy[order], cls[order]
+    area = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+    suppressed = np.zeros(len(order), dtype=bool)
+    for k in range(len(order)):
+        if suppressed[k]:
+            continue
+        rest = np.flatnonzero(~suppressed[k + 1:] & (cls[k + 1:] == cls[k])) + k + 1
+        if not len(rest):
+            continue
+        w = np.clip(np.minimum(xyxy[k, 2], xyxy[rest, 2]) - np.maximum(xyxy[k, 0], xyxy[rest, 0]), 0, None)
+        h = np.clip(np.minimum(xyxy[k, 3], xyxy[rest, 3]) - np.maximum(xyxy[k, 1], xyxy[rest, 1]), 0, None)
+        inter = w * h
+        suppressed[rest[inter / (area[k] + area[rest] - inter + 1e-9) > iou]] = True
+    return order[~suppressed]
+
+
+def overlapping_frames(frame, xyxy, cls, iou):
+    """
+    回傳有同類別框 IoU > iou 的幀 (只有這些幀的 NMS 結果會改變)。
+    同一幀內所有配對以位移 k = 1, 2, ... 批次產生，不必逐幀迴圈。
+    """
+    n = len(frame)
+    end = np.searchsorted(frame, frame, side="right")
+    area = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+    hits = []
+    k = 1
+    while True:
+        i = np.flatnonzero(np.arange(n) + k < end)
+        if not len(i):
+            break
+        j = i + k
+        i, j = i[cls[i] == cls[j]], j[cls[i] == cls[j]]
+        w = np.clip(np.minimum(xyxy[i, 2], xyxy[j, 2]) - np.maximum(xyxy[i, 0], xyxy[j, 0]), 0, None)
+        h = np.clip(np.minimum(xyxy[i, 3], xyxy[j, 3]) - np.maximum(xyxy[i, 1], xyxy[j, 1]), 0, None)
+        inter = w * h
+        hits.append(frame[i[inter / (area[i] + area[j] - inter + 1e-9) > iou]])
+        k += 1
+    return np.unique(np.concatenate(hits)) if hits else np.zeros(0, dtype=frame.dtype)
+
+
+class _Detections:
+    """BYTETracker.update() 需要的介面 (與 Boxes.cpu().numpy() 相同)：conf / cls / xywh / xyxy 與索引。"""
+
+    def __init__(self, xywh, conf, cls):
+        self.xywh, self.conf, self.cls = xywh, conf, cls
+
+    @property
+    def xyxy(self):
+        return np.concatenate([self.xywh[:, :2] - self.xywh[:, 2:] / 2, self.xywh[:, :2] + self.xywh[:, 2:] / 2], axis=1)
+
+    def __len__(self):
+        return len(self.conf)
+
+    def __getitem__(self, idx):
+        return _Detections(self.xywh[idx], self.conf[idx], self.cls[idx])
+
+
+def tracker_config(tracker_yaml="bytetrack.yaml"):
+    """讀取追蹤器 yaml；找不到檔案時使用 ultralytics 內建的 cfg/trackers (不必 import ultralytics / torch)。"""
+    import yaml
+    path = Path(tracker_yaml)
+    if not path.exists():
+        spec = importlib.util.find_spec("ultralytics")
+        if spec is None:
+            raise FileNotFoundError(f"Tracker config not found: {tracker_yaml}")
+        path = Path(spec.submodule_search_locations[0]) / "cfg" / "trackers" / path.name
+    with open(path, "r", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f)
+    # 離線沒有影像：關閉相機運動補償與 ReID
+    if "gmc_method" in cfg:
+        cfg["gmc_method"] = "none"
+    if "with_reid" in cfg:
+        cfg["with_reid"] = False
+    return cfg
+
+
+def make_tracker(tracker_yaml="bytetrack.yaml", backend="array"):
+    """
+    與 model.track(tracker=...) 相同的追蹤器設定。
+    bytetrack 預設使用陣列版 (array_bytetrack.py，結果相同、快很多)；backend="ultralytics" 或其他追蹤器用 ultralytics。
+    """
+    cfg = tracker_config(tracker_yaml)
+    if backend == "array" and cfg["tracker_type"] == "bytetrack":
+        from array_bytetrack import ArrayByteTracker
+        return ArrayByteTracker(SimpleNamespace(**cfg))
+    from ultralytics.utils import IterableSimpleNamespace
+    from ultralytics.trackers.track import TRACKER_MAP
+    tracker_cls = TRACKER_MAP[cfg["tracker_type"]]
+    try:
+        return tracker_cls(args=IterableSimpleNamespace(**cfg), frame_rate=TRACKER_FRAME_RATE)
+    except TypeError:  # 新版 ultralytics 不再有 frame_rate 參數
+        return tracker_cls(args=IterableSimpleNamespace(**cfg))
+
+
+def retrack(raw_path, conf, iou=None, tracker_yaml="bytetrack.yaml", backend="array"):
+    """
+    由原始偵測重新追蹤，回傳 (columns, meta)；columns 為 detection_store 的欄位 (bbox 為正規化 xc yc w h)。
+    iou 為 None 或不比錄製時嚴格時不再做 NMS。
+    """
+    with DetectionStore(raw_path) as store:
+        meta = store.meta
+        data = store.read(("frame", "cls", "conf", "bbox"))
+    if conf < meta.get("conf_floor", 0):
+        print(f"Warning: conf {conf} is below the recorded floor {meta['conf_floor']}; using the floor.")
+    width, height = meta.get("frame_size") or (1, 1)
+    scale = np.array([width, height, width, height], dtype=np.float64)
+    keep = data["conf"] >= conf
+    frame, cls, score = data["frame"][keep], data["cls"][keep].astype(np.float64), data["conf"][keep].astype(np.float64)
+    xywh = data["bbox"][keep].astype(np.float64) * scale
+    do_nms = iou is not None and iou < meta.get("iou", 1.0)
+
+    n_frames = int(meta.get("frames") or (frame.max() if len(frame) else 0))
+    bounds = np.searchsorted(frame, np.arange(1, n_frames + 2))
+    if do_nms:
+        keep = np.ones(len(frame), dtype=bool)
+        xyxy = np.concatenate([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], axis=1)
+        for f in overlapping_frames(frame, xyxy, cls, iou):
+            lo, hi = bounds[f - 1], bounds[f]
+            det = _Detections(xywh[lo:hi], score[lo:hi], cls[lo:hi])
+            keep[lo:hi] = False
+            keep[lo + nms_keep(det.xyxy, det.conf, det.cls, iou)] = True
+        frame, cls, score, xywh = frame[keep], cls[keep], score[keep], xywh[keep]
+        bounds = np.searchsorted(frame, np.arange(1, n_frames + 2))
+
+    tracker = make_tracker(tracker_yaml, backend)
+    if hasattr(tracker, "track"):
+        rows = tracker.track(frame, xywh, score, cls, n_frames)[:, :8]
+    else:
+        parts = []
+        empty = _Detections(np.zeros((0, 4)), np.zeros(0), np.zeros(0))
+        for f in range(1, n_frames + 1):
+            lo, hi = bounds[f - 1], bounds[f]
+            det = _Detections(xywh[lo:hi], score[lo:hi], cls[lo:hi]) if hi > lo else empty
+            # 沒有偵測的幀也要更新，追蹤器才會正確累計遺失的幀數
+            tracks = tracker.update(det, None)
+            if len(tracks):
+                parts.append(np.column_stack([np.full(len(tracks), f), tracks[:, :7]]))
+        rows = np.concatenate(parts) if parts else np.zeros((0, 8))
+    x1, y1, x2, y2 = rows[:, 1], rows[:, 2], rows[:, 3], rows[:, 4]
+    bbox = np.column_stack([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1]) / scale
+    columns = {"frame": rows[:, 0], "cls": rows[:, 7], "conf": rows[:, 6], "track_id": rows[:, 5], "bbox": bbox}
+    return columns, dict(meta, retrack={"conf": conf, "iou": iou if do_nms else meta.get("iou"),
+                                        "tracker": str(tracker_yaml), "backend": type(tracker).__name__,
+                                        "raw": str(raw_path)})
+
+
+def write_session(session_dir, columns, meta, stitch=True):
+    """把重新追蹤的結果寫成與分析模板相同的 session 目錄，回傳 summary。"""
+    from live_analyzer import LiveAggregates
+    from spatial_analytics import write_spatial_reports, spatial_summary
+    from track_stitching import stitch_tracks
+    session_dir = Path(session_dir)
+    session_dir.mkdir(parents=True, exist_ok=True)
+    fps = meta.get("fps") or 30.0
+    names = {int(k): v for k, v in (meta.get("names") or {}).items()}
+    frame_size = meta.get("frame_size")
+
+    frame = columns["frame"].astype(np.int64)
+    cls = columns["cls"].astype(np.int64)
+    raw_track_id = track_id = columns["track_id"].astype(np.int64)
+    bbox = columns["bbox"]
+    tracks_raw = len(np.unique(track_id[track_id >= 0]))
+    if stitch and len(frame):
+        track_id, links = stitch_tracks(frame, track_id, bbox[:, 0], bbox[:, 1], cls, fps)
+        links.to_csv(session_dir / "track_links.csv", index=False)
+    # 與分析模板相同：detections.npz 的 track_id 為縫合後的 ID，原始 ID 存在 raw_track_id
+    write_store(session_dir / STORE_NAME, meta=meta, **dict(columns, track_id=track_id), raw_track_id=raw_track_id)
+    agg = LiveAggregates(fps, names)
+    agg.add_rows(frame, cls, track_id)
+    video = Path(str(meta.get("video", ""))).name
+    agg.write_outputs(session_dir, video)
+    if len(frame):
+        write_spatial_reports(session_dir, frame, cls, track_id, bbox[:, 0], bbox[:, 1], bbox[:, 3], fps,
+                              lambda c: names.get(c, f"cls{c}"), frame_size)
+    summary = agg.summary(video)
+    for key in ("live", "active_tracks", "updated"):
+        summary.pop(key, None)
+    summary.update(frames=meta.get("frames", summary["frames"]), tracks_raw=tracks_raw, retrack=meta["retrack"],
+                   **spatial_summary(frame_size=frame_size))
+    (session_dir / "summary.json").write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+    return summary
+
+
+def run(raw_path, session_dir, conf, iou=None, tracker_yaml="bytetrack.yaml", stitch=True, backend="array"):
+    t0 = time.perf_counter()
+    columns, meta = retrack(raw_path, conf, iou, tracker_yaml, backend)
+    t1 = time.perf_counter()
+    summary = write_session(session_dir, columns, meta, stitch)
+    t2 = time.perf_counter()
+    frames = meta.get("frames") or 0
+    speed = frames / (meta.get("fps") or 30.0) / max(t2 - t0, 1e-9)
+    print(f"{session_dir}: conf={conf} iou={meta['retrack']['iou']} -> {summary['tracks_total']} tracks, "
+          f"{summary['objects_total']} detections; track {t1 - t0:.1f}s + stats {t2 - t1:.1f}s ({speed:.0f}x real time)")
+    return summary
+
+
+def _run_job(job):
+    return run(*job)
+
+
+def sweep(raw_path, base, confs, ious, tracker_yaml="bytetrack.yaml", stitch=True, workers=None, prefix=None,
+          backend="array"):
+    """每組 (conf, iou) 產生一個 session 目錄 <base>/<prefix>_c035_i050，以 process pool 平行處理。"""
+    prefix = prefix or Path(raw_path).stem
+    jobs = []
+    for conf in confs:
+        for iou in ious or [None]:
+            name = f"{prefix}_c{round(conf * 100):03d}" + (f"_i{round(iou * 100):03d}" if iou is not None else "")
+            jobs.append((raw_path, Path(base) / name, conf, iou, tracker_yaml, stitch, backend))
+    if (workers or 1) <= 1 or len(jobs) == 1:
+        return [_run_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        return list(pool.map(_run_job, jobs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record raw detections once, then re-track and re-analyze at any conf/iou.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("record", help="Run the detector once with a low confidence floor.")
+    p.add_argument("--video", required=True)
+    p.add_argument("--model", required=True)
+    p.add_argument("--output", default=None, help=f"Default: <video dir>/{RAW_NAME}")
+    p.add_argument("--conf_floor", type=float, default=DEFAULT_CONF_FLOOR)
+    p.add_argument("--iou", type=float, default=DEFAULT_RECORD_IOU, help="NMS IoU at record time (the loosest you will sweep).")
+    p.add_argument("--imgsz", type=int, default=None)
+    p.add_argument("--device", default=None)
+
+    for name, help_text in (("run", "Re-track one setting into a session directory."),
+                            ("sweep", "Re-track a grid of settings into sessions under --base.")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--raw", required=True, help="raw_detections.npz written by 'record'.")
+        p.add_argument("--tracker", default="bytetrack.yaml")
+        p.add_argument("--no_stitch", action="store_true", help="Skip offline track stitching.")
+        p.add_argument("--backend", choices=("array", "ultralytics"), default="array",
+                       help="ByteTrack implementation (array: vectorized, same results; other trackers always use ultralytics).")
+        if name == "run":
+            p.add_argument("--session_dir", required=True)
+            p.add_argument("--conf", type=float, required=True)
+            p.add_argument("--iou", type=float, default=None)
+        else:
+            p.add_argument("--base", default="runs/retrack",
+                           help="Kept apart from runs/analyze so /trends does not count the same footage once per setting.")
+            p.add_argument("--conf", type=float, nargs="+", required=True)
+            p.add_argument("--iou", type=float, nargs="*", default=None)
+            p.add_argument("--prefix", default=None, help="Session name prefix (default: the raw file name).")
+            p.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.video, args.model, args.output or str(Path(args.video).with_name(RAW_NAME)), args.conf_floor,
+               args.iou, args.imgsz, args.device)
+    elif args.command == "run":
+        run(args.raw, args.session_dir, args.conf, args.iou, args.tracker, not args.no_stitch, args.backend)
+    else:
+        sweep(args.raw, args.base, args.conf, args.iou, args.tracker, not args.no_stitch, args.workers, args.prefix,
+              args.backend)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Re-ID 評估：CMC (rank-k) 與 mAP。
+
+輸入為逐筆偵測的特徵、track ID 與幀編號。每一筆偵測輪流當 query，其餘偵測為 gallery；
+同一個 track 的其他偵測是正確答案。同一個 track 在 query 前後 exclude_window 幀內的偵測
+幾乎就是同一張畫面，視為 junk 不計分 (相當於 Market-1501 中同攝影機的排除規則)。
+
+相似度以正規化後的矩陣乘法一次算一批 query (chunk) 對一段 gallery (gallery_chunk)，
+每段只做一次排序，由 searchsorted 累計每個正確答案前面相似度更高的項目數 (名次)，
+CMC 與 AP 全部向量化。每一批 query 掃描 gallery 兩次：先取出正確答案的相似度，再計算名次；
+記憶體約為數個 chunk x gallery_chunk 的陣列，與 gallery 總數無關。
+結果可寫入 session 的 summary.json (鍵 "reid_eval")，方便比較不同追蹤器 / embedder 的設定。
+
+    python reid_eval.py --labels_dir runs/predict/xxx/labels --session_dir runs/analyze/cosine_xxx
+    python reid_eval.py --npz embeddings.npz --ranks 1 5 10   # npz 需含 features, track_id (frame 可選)
+"""
+import os
+import json
+import time
+import argparse
+from pathlib import Path
+import numpy as np
+
+DEFAULT_RANKS = (1, 5, 10)
+GALLERY_CHUNK = 8192
+
+
+def _block_similarity(x, ids, frames, q, lo, hi, exclude_window):
+    """query q 對 gallery[lo:hi] 的相似度 (float64) 與 (同 track, junk) 遮罩。"""
+    sim = (x[q] @ x[lo:hi].T).astype(np.float64)
+    same = ids[q][:, None] == ids[None, lo:hi]
+    junk = same & (np.abs(frames[q][:, None] - frames[None, lo:hi]) <= exclude_window)
+    self_rows = np.flatnonzero((q >= lo) & (q < hi))
+    junk[self_rows, q[self_rows] - lo] = True
+    return sim, same, junk
+
+
+def evaluate(features, track_ids, frames=None, ranks=DEFAULT_RANKS, exclude_window=30, chunk=256,
+             max_queries=None, seed=0, gallery_chunk=GALLERY_CHUNK):
+    """
+    回傳 {"mAP", "cmc": {"rank1": ...}, "n_queries", "n_gallery", "n_ids", ...}。
+    沒有任何正確答案 (整個 track 都落在 exclude_window 內) 的 query 不列入平均。
+    相似度相同的正確答案依序排名，AP 不會超過 1：
+
+    >>> evaluate([[1, 0], [1, 0], [1, 0], [0, 1], [0, 1]], [1, 1, 1, 2, 2], [0, 100, 200, 0, 100])["mAP"]
+    1.0
+    """
+    x = np.asarray(features, dtype=np.float32)
+    ids = np.asarray(track_ids)
+    n = len(x)
+    frames = np.zeros(n, dtype=np.int64) if frames is None else np.asarray(frames, dtype=np.int64)
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    x = x / np.maximum(norms, 1e-12)
+
+    queries = np.arange(n)
+    if max_queries and n > max_queries:
+        queries = np.sort(np.random.default_rng(seed).choice(n, max_queries, replace=False))
+    ranks = sorted({int(r) for r in ranks if 0 < int(r) <= n})
+    hits = np.zeros(len(ranks), dtype=np.int64)
+    ap_sum = 0.0
+    valid = 0
+    ranks_arr = np.asarray(ranks)
+
+    blocks = [(lo, min(lo + gallery_chunk, n)) for lo in range(0, n, gallery_chunk)]
+    for start in range(0, len(queries), chunk):
+        q = queries[start:start + chunk]
+        c = len(q)
+        row_shift = 4.0 * np.arange(c)[:, None]
+
+        # 1. 正確答案 (同 track 且非 junk) 與其相似度
+        rs, values = [], []
+        for lo, hi in blocks:
+            sim, same, junk = _block_similarity(x, ids, frames, q, lo, hi, exclude_window)
+            r, col = np.nonzero(same & ~junk)
+            rs.append(r)
+            values.append(sim[r, col])
+        r = np.concatenate(rs)
+        if not len(r):
+            continue
+        target = np.concatenate(values) + row_shift[r, 0]
+
+        # 2. 不做逐列 argsort：每列加上 4*row 的位移後整段排序一次，
+        #    再用 searchsorted 累計每個正確答案前面有幾個相似度更高的 gallery 項目
+        higher = np.zeros(len(r), dtype=np.int64)
+        for lo, hi in blocks:
+            sim, _, junk = _block_similarity(x, ids, frames, q, lo, hi, exclude_window)
+            sim[junk] = -2.0  # 餘弦相似度 >= -1，junk 一律排在最後
+            flat = np.sort(sim + row_shift, axis=None)
+            higher += (r + 1) * (hi - lo) - np.searchsorted(flat, target, side="right")
+        position = higher + 1
+        order = np.lexsort((position, r))
+        r, position = r[order], position[order]
+        n_pos = np.bincount(r, minlength=c)
+        row_start = np.concatenate([[0], np.cumsum(n_pos)[:-1]])
+        k = np.arange(len(r)) - row_start[r] + 1  # 第 k 個正確答案
+        position = np.maximum(position, k)  # 同分的正確答案只計更高分的項目，需依序往後排
+        ok = n_pos > 0
+        first = position[row_start[ok]]
+        hits += (first[:, None] <= ranks_arr[None, :]).sum(axis=0)
+        ap_sum += float((np.bincount(r, weights=k / position, minlength=c)[ok] / n_pos[ok]).sum())
+        valid += int(ok.sum())
+
+    return {
+        "mAP": ap_sum / valid if valid else None,
+        "cmc": {f"rank{r}": (float(h) / valid if valid else None) for r, h in zip(ranks, hits)},
+        "n_queries": valid,
+        "n_skipped_queries": int(len(queries) - valid),
+        "n_gallery": int(n),
+        "n_ids": int(len(np.unique(ids))),
+        "exclude_window": int(exclude_window),
+    }
+
+
+def update_session_summary(session_dir, metrics, key="reid_eval"):
+    """把指標合併寫入 <session_dir>/summary.json (先寫暫存檔再取代)。"""
+    path = Path(session_dir) / "summary.json"
+    summary = {}
+    if path.exists():
+        try:
+            summary = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            summary = {}
+    summary[key] = metrics
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+    return path
+
+
+def format_metrics(metrics):
+    if metrics.get("mAP") is None:
+        return "Re-ID eval: no query had a valid match (tracks too short for the exclusion window?)."
+    cmc = ", ".join(f"{k}={v:.3f}" for k, v in metrics["cmc"].items())
+    return (f"Re-ID eval: mAP={metrics['mAP']:.3f}, {cmc} "
+            f"({metrics['n_queries']} queries, {metrics['n_gallery']} gallery, {metrics['n_ids']} ids)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute CMC rank-k and mAP from per-detection embeddings and track IDs.")
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("--labels_dir", help="Tracking labels with features (cls ... track_id f0 f1 ...).")
+    src.add_argument("--npz", help="npz file with 'features' and 'track_id' (and optionally 'frame').")
+    parser.add_argument("--session_dir", default=None, help="Merge the metrics into <session_dir>/summary.json.")
+    parser.add_argument("--ranks", type=int, nargs="+", default=list(DEFAULT_RANKS))
+    parser.add_argument("--exclude_window", type=int, default=30, help="Same-track detections within this many frames are ignored.")
+    parser.add_argument("--chunk", type=int, default=256, help="Queries scored per batch.")
+    parser.add_argument("--gallery_chunk", type=int, default=GALLERY_CHUNK, help="Gallery entries scored per block.")
+    parser.add_argument("--max_queries", type=int, default=None, help="Evaluate a random subset of queries.")
+    args = parser.parse_args()
+
+    if args.labels_dir:
+        from label_loader import load_label_dir
+        data = load_label_dir(args.labels_dir, with_features=True)
+        features, track_ids, frames = data["features"], data["track_id"], data["frame"]
+    else:
+        with np.load(args.npz) as data:
+            features, track_ids = data["features"], data["track_id"]
+            frames = data["frame"] if "frame" in data else None
+    if features is None or not len(features):
+        print("Error: No embeddings found.")
+        raise SystemExit(1)
+
+    t0 = time.perf_counter()
+    metrics = evaluate(features, track_ids, frames, args.ranks, args.exclude_window, args.chunk, args.max_queries,
+                       gallery_chunk=args.gallery_chunk)
+    metrics["seconds"] = round(time.perf_counter() - t0, 3)
+    print(format_metrics(metrics))
+    if args.session_dir:
+        print(f"Saved to {update_session_summary(args.session_dir, metrics)}")
@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+"""
+跨影片 Re-ID Gallery：保存每次分析中每個 track 的代表性特徵，並支援近似最近鄰查詢，
+用來回答「這隻猴子是否出現在其他錄影中？」。
+
+目錄結構 (--gallery DIR)：
+    gallery.json   維度、特徵種類、筆數與索引狀態 (以原子方式覆寫，筆數以此檔為準)
+    vectors.f32    L2 正規化後的 float32 特徵，僅附加寫入
+    meta.jsonl     每筆特徵的中繼資料 (video, session, track_id, cls_name, 時間範圍 ...)
+    meta.idx       每筆中繼資料在 meta.jsonl 中的起始位移 (int64)，查詢結果只讀取需要的行
+    videos.i32     每筆特徵所屬影片的編號 (gallery.json 中 videos 清單的索引)
+    tracks.i64     每筆特徵的 track_id
+    assign.i32     每筆特徵所屬的 IVF 清單編號
+    ivf.npz        IVF (inverted file) 的群中心
+
+查詢時先找出最相似的 nprobe 個群中心，只在這些清單中做精確的內積排序；
+新資料直接指派到最近的群中心，資料量成長到訓練時的兩倍後自動重新訓練索引。
+排除同一支影片與依 (video, track_id) 查找都只用 videos.i32 / tracks.i64，不必解析 meta.jsonl。
+gallery.json 記錄特徵種類 (feature_kind()：模型雜湊、embed / probs、投影)，不同來源的特徵不會混在一起。
+
+使用方式：
+    python reid_gallery.py info  --gallery runs/reid_gallery
+    python reid_gallery.py query --gallery runs/reid_gallery --video monkey_video_1.mp4 --track_id 12 --k 10
+    python reid_gallery.py rebuild --gallery runs/reid_gallery
+"""
+import os
+import json
+import time
+import argparse
+from pathlib import Path
+import numpy as np
+
+MIN_TRAIN = 1024          # 少於此筆數時直接暴力搜尋
+DEFAULT_NPROBE = 8
+KMEANS_ITERS = 10
+KMEANS_SAMPLE = 65536
+CHUNK = 65536
+
+
+def _normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def _write_json_atomic(path, data):
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _spherical_kmeans(x, nlist, iters=KMEANS_ITERS, seed=0):
+    """在單位向量上做 k-means (以內積作為相似度)，回傳正規化後的群中心。"""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.concatenate([np.argmax(x[i:i + CHUNK] @ centroids.T, axis=1)
+                                 for i in range(0, len(x), CHUNK)])
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=nlist)
+        sums = np.zeros_like(centroids)
+        present = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)])[present]
+        sums[present] = np.add.reduceat(x[order], starts, axis=0)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = x[rng.choice(len(x), int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+def feature_kind(model_path, mode="embed", projection=None):
+    """特徵來源的標記：模型檔名與雜湊、特徵種類 (embed / probs)，以及套用的投影 (ProjectionStream 或 EmbeddingProjector)。"""
+    from embedding_projection import model_hash
+    kind = f"{mode}:{Path(str(model_path)).stem}.{model_hash(model_path)}"
+    projector = getattr(projection, "projector", projection)
+    if projector is not None:
+        kind += f"+{projector.method}{projector.dim}{'.int8' if projector.int8 else ''}.{projector.fingerprint()}"
+    return kind
+
+
+class ReIDGallery:
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.state_path = self.root / "gallery.json"
+        self.vectors_path = self.root / "vectors.f32"
+        self.meta_path = self.root / "meta.jsonl"
+        self.assign_path = self.root / "assign.i32"
+        self.index_path = self.root / "ivf.npz"
+        self.offsets_path = self.root / "meta.idx"
+        self.videos_path = self.root / "videos.i32"
+        self.tracks_path = self.root / "tracks.i64"
+        if self.state_path.exists():
+            self.state = json.loads(self.state_path.read_text(encoding="utf-8"))
+        else:
+            self.state = {"dim": None, "count": 0, "meta_bytes": 0, "nlist": 0, "trained_count": 0}
+        self._vectors = None
+        self._meta = None
+        self._centroids = None
+        self._lists = None
+        self._keys = None
+
+    def __len__(self):
+        return self.state["count"]
+
+    # --- 讀取 (lazy，並在寫入後失效) ---
+    def _invalidate(self):
+        self._vectors = self._meta = self._lists = self._keys = None
+
+    @property
+    def vectors(self):
+        if self._vectors is None:
+            count, dim = self.state["count"], self.state["dim"]
+            if not count:
+                return np.zeros((0, dim or 0), dtype=np.float32)
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, dim))
+        return self._vectors
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            self._meta = []
+            if self.meta_path.exists():
+                with open(self.meta_path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if len(self._meta) >= self.state["count"]:
+                            break  # 忽略中斷寫入時殘留的尾端資料
+                        self._meta.append(json.loads(line))
+        return self._meta
+
+    @property
+    def centroids(self):
+        if self._centroids is None and self.state["nlist"] and self.index_path.exists():
+            self._centroids = np.load(self.index_path)["centroids"]
+        return self._centroids
+
+    def _key_arrays(self):
+        """(video 編號, track_id, meta 位移)；舊版 gallery 缺少這些檔案時由 meta.jsonl 建立一次。"""
+        if self._keys is None:
+            count = self.state["count"]
+            files = ((self.videos_path, np.int32), (self.tracks_path, np.int64), (self.offsets_path, np.int64))
+            if "videos" not in self.state or any(
+                    not p.exists() or p.stat().st_size < count * np.dtype(t).itemsize for p, t in files):
+                self._build_keys()
+            self._keys = tuple(np.fromfile(p, dtype=t, count=count) for p, t in files)
+        return self._keys
+
+    def _build_keys(self):
+        videos, codes, tracks, offsets = {}, [], [], []
+        if self.meta_path.exists():
+            with open(self.meta_path, "rb") as f:
+                for _ in range(self.state["count"]):
+                    offsets.append(f.tell())
+                    m = json.loads(f.readline())
+                    codes.append(videos.setdefault(m.get("video"), len(videos)))
+                    tracks.append(m.get("track_id") if m.get("track_id") is not None else -1)
+        np.array(codes, dtype=np.int32).tofile(self.videos_path)
+        np.array(tracks, dtype=np.int64).tofile(self.tracks_path)
+        np.array(offsets, dtype=np.int64).tofile(self.offsets_path)
+        self.state["videos"] = list(videos)
+        _write_json_atomic(self.state_path, self.state)
+
+    def _video_code(self, video):
+        try:
+            return self.state.get("videos", []).index(video)
+        except ValueError:
+            return -1
+
+    def meta_at(self, ids):
+        """只讀取指定 id 的中繼資料 (依 meta.idx 的位移 seek)。"""
+        offsets = self._key_arrays()[2]
+        out = []
+        with open(self.meta_path, "rb") as f:
+            for gid in ids:
+                f.seek(int(offsets[gid]))
+                out.append(json.loads(f.readline()))
+        return out
+
+    def _inverted_lists(self):
+        """由 assign.i32 建立 (排序後的 id, 每個清單的起始位移)。"""
+        if self._lists is None:
+            assign = np.fromfile(self.assign_path, dtype=np.int32, count=self.state["count"])
+            order = np.argsort(assign, kind="stable").astype(np.int64)
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=self.state["nlist"]))])
+            self._lists = (order, offsets)
+        return self._lists
+
+    # --- 寫入 ---
+    def add(self, vectors, metas, feature_kind=None):
+        """
+        附加一批特徵與中繼資料，回傳新的 gallery id 列表。
+        feature_kind 與 gallery 記錄的不同 (其他模型 / 投影的特徵) 或維度不符時丟出 ValueError。
+        """
+        vectors = _normalize(np.atleast_2d(vectors))
+        if len(vectors) != len(metas):
+            raise ValueError("vectors and metas must have the same length")
+        if not len(vectors):
+            return []
+        stored_kind = self.state.get("feature_kind")
+        if feature_kind and stored_kind and feature_kind != stored_kind:
+            raise ValueError(f"Features from {feature_kind} cannot be mixed with the gallery's {stored_kind} features; "
+                             f"use a separate --gallery directory")
+        dim = self.state["dim"]
+        if dim is None:
+            self.state["dim"] = dim = vectors.shape[1]
+        elif vectors.shape[1] != dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match gallery dimension {dim} "
+                             f"({stored_kind or 'unknown features'}); use a separate --gallery directory")
+        if feature_kind and not stored_kind:
+            self.state["feature_kind"] = feature_kind
+
+        start = self.state["count"]
+        ids = list(range(start, start + len(vectors)))
+        self._invalidate()  # 關閉 memmap 後才能截斷檔案 (Windows)
+        self._key_arrays()
+        self._invalidate()
+        self._truncate_to_count()
+        videos = self.state["videos"]
+        codes, tracks, offsets = [], [], []
+        position = self.state.get("meta_bytes", 0)
+        with open(self.vectors_path, "ab") as f:
+            f.write(vectors.astype(np.float32).tobytes())
+        with open(self.meta_path, "ab") as f:
+            for gid, m in zip(ids, metas):
+                line = (json.dumps(dict(m, id=gid), ensure_ascii=False) + "\n").encode("utf-8")
+                f.write(line)
+                offsets.append(position)
+                position += len(line)
+                if m.get("video") not in videos:
+                    videos.append(m.get("video"))
+                codes.append(videos.index(m.get("video")))
+                tracks.append(m.get("track_id") if m.get("track_id") is not None else -1)
+        for path, values, dtype in ((self.videos_path, codes, np.int32), (self.tracks_path, tracks, np.int64),
+                                    (self.offsets_path, offsets, np.int64)):
+            with open(path, "ab") as f:
+                f.write(np.array(values, dtype=dtype).tobytes())
+        if self.state["nlist"]:
+            assign = np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+            with open(self.assign_path, "ab") as f:
+                f.write(assign.tobytes())
+
+        self.state["count"] = start + len(vectors)
+        self.state["meta_bytes"] = self.meta_path.stat().st_size
+        _write_json_atomic(self.state_path, self.state)
+        self._invalidate()
+
+        trained = self.state["trained_count"]
+        if self.state["count"] >= MIN_TRAIN and (not trained or self.state["count"] >= 2 * trained):
+            self.rebuild()
+        return ids
+
+    def _truncate_to_count(self):
+        """截掉上次中斷寫入時殘留在檔尾、未被 gallery.json 記錄的資料。"""
+        count, dim = self.state["count"], self.state["dim"]
+        committed = ((self.vectors_path, count * dim * 4), (self.meta_path, self.state.get("meta_bytes", 0)),
+                     (self.assign_path, count * 4 if self.state["nlist"] else 0),
+                     (self.videos_path, count * 4), (self.tracks_path, count * 8), (self.offsets_path, count * 8))
+        for path, nbytes in committed:
+            if path.exists() and path.stat().st_size > nbytes:
+                with open(path, "r+b") as f:
+                    f.truncate(nbytes)
+
+    def rebuild(self, nlist=None):
+        """重新訓練 IVF 群中心並重新指派所有特徵。"""
+        count = self.state["count"]
+        if count < MIN_TRAIN:
+            print(f"Gallery has {count} entries; brute-force search is used below {MIN_TRAIN}.")
+            return
+        x = np.asarray(self.vectors)
+        nlist = nlist or int(min(4096, max(16, 4 * np.sqrt(count))))
+        sample = x if count <= KMEANS_SAMPLE else x[np.random.default_rng(0).choice(count, KMEANS_SAMPLE, replace=False)]
+        print(f"Training IVF index: {count} entries, {nlist} lists...")
+        centroids = _spherical_kmeans(np.ascontiguousarray(sample), nlist)
+        assign = np.concatenate([np.argmax(x[i:i + CHUNK] @ centroids.T, axis=1)
+                                 for i in range(0, count, CHUNK)]).astype(np.int32)
+
+        tmp_index = self.root / "ivf.tmp.npz"
+        np.savez(tmp_index, centroids=centroids)
+        os.replace(tmp_index, self.index_path)
+        tmp_assign = self.assign_path.with_suffix(".i32.tmp")
+        assign.tofile(tmp_assign)
+        os.replace(tmp_assign, self.assign_path)
+        self.state.update(nlist=nlist, trained_count=count)
+        _write_json_atomic(self.state_path, self.state)
+        self._centroids = centroids
+        self._invalidate()
+
+    # --- 查詢 ---
+    def search(self, query, k=10, nprobe=DEFAULT_NPROBE, exclude_video=None):
+        """回傳與 query 最相似的 k 筆 (similarity, meta)。exclude_video 可排除同一支影片。"""
+        if not len(self):
+            return []
+        q = _normalize(np.asarray(query).ravel())
+        if self.state["nlist"]:
+            order, offsets = self._inverted_lists()
+            probe = np.argsort(-(self.centroids @ q))[:nprobe]
+            candidates = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probe])
+            candidates.sort()  # 依檔案順序讀取 memmap
+        else:
+            candidates = np.arange(len(self))
+        if exclude_video is not None:
+            video_codes = self._key_arrays()[0]
+            candidates = candidates[video_codes[candidates] != self._video_code(exclude_video)]
+        if not len(candidates):
+            return []
+        scores = self.vectors[candidates] @ q
+        top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return list(zip(scores[top].astype(float).tolist(), self.meta_at(candidates[top])))
+
+    def find(self, video, track_id):
+        """依 (video, track_id) 找出 gallery 中的項目 (同一支影片可能分析過多次，取最新的一筆)。"""
+        video_codes, tracks, _ = self._key_arrays()
+        code = self._video_code(video)
+        if code < 0:
+            return None
+        hits = np.flatnonzero((video_codes == code) & (tracks == track_id))
+        return self.meta_at(hits[-1:])[0] if len(hits) else None
+
+    def vector(self, gid):
+        return np.asarray(self.vectors[gid])
+
+
+def add_session_tracks(gallery_dir, video, session, tracks, fps=None, feature_kind=None):
+    """
+    把一次分析中每個 track 的代表性特徵寫入 gallery。
+    tracks: [{'track_id', 'cls_name', 'feature', 'start_frame', 'end_frame', 'n_obs'}, ...]
+    特徵與 gallery 不相容時只印出警告並回傳 []，不中斷分析。
+    """
+    if not tracks:
+        return []
+    video_name = Path(str(video)).name
+    created = time.strftime("%Y-%m-%d %H:%M:%S")
+    metas = []
+    for t in tracks:
+        m = {"video": video_name, "session": str(session), "track_id": int(t["track_id"]),
+             "cls_name": t.get("cls_name"), "start_frame": t.get("start_frame"), "end_frame": t.get("end_frame"),
+             "n_obs": int(t.get("n_obs") or 0), "created": created}
+        if fps and m["start_frame"] is not None:
+            m["start_sec"] = round(m["start_frame"] / fps, 3)
+            m["end_sec"] = round(m["end_frame"] / fps, 3)
+        metas.append(m)
+    gallery = ReIDGallery(gallery_dir)
+    try:
+        ids = gallery.add(np.vstack([t["feature"] for t in tracks]), metas, feature_kind)
+    except ValueError as e:
+        print(f"Warning: tracks from {video_name} were not added to Re-ID gallery {gallery_dir}: {e}")
+        return []
+    print(f"Added {len(ids)} tracks from {video_name} to Re-ID gallery {gallery_dir} (total {len(gallery)}).")
+    return ids
+
+
+def _print_results(results):
+    for rank, (sim, m) in enumerate(results, 1):
+        span = f"{m.get('start_sec', m.get('start_frame'))} - {m.get('end_sec', m.get('end_frame'))}"
+        print(f"{rank:>3}. sim={sim:.4f}  video={m.get('video')}  track_id={m.get('track_id')}  "
+              f"class={m.get('cls_name')}  span={span}  session={m.get('session')}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-video Re-ID gallery.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_info = sub.add_parser("info", help="Show gallery statistics.")
+    p_info.add_argument("--gallery", required=True)
+
+    p_rebuild = sub.add_parser("rebuild", help="Retrain the IVF index.")
+    p_rebuild.add_argument("--gallery", required=True)
+    p_rebuild.add_argument("--nlist", type=int, default=None)
+
+    p_query = sub.add_parser("query", help="Find the nearest tracks for a stored track or a .npy vector.")
+    p_query.add_argument("--gallery", required=True)
+    p_query.add_argument("--video", help="Video name of the query track.")
+    p_query.add_argument("--track_id", type=int, help="Track ID of the query track.")
+    p_query.add_argument("--vector", help="Path to a .npy query embedding (instead of --video/--track_id).")
+    p_query.add_argument("--k", type=int, default=10)
+    p_query.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE)
+    p_query.add_argument("--include_same_video", action="store_true", help="Also return matches from the query's own video.")
+    args = parser.parse_args()
+
+    gallery = ReIDGallery(args.gallery)
+    if args.command == "info":
+        gallery._key_arrays()
+        print(json.dumps(dict(gallery.state, videos=len(gallery.state["videos"])), ensure_ascii=False, indent=2))
+    elif args.command == "rebuild":
+        gallery.rebuild(args.nlist)
+    else:
+        exclude = None
+        if args.vector:
+            query = np.load(args.vector)
+        else:
+            if args.video is None or args.track_id is None:
+                parser.error("query needs --vector or both --video and --track_id")
+            entry = gallery.find(Path(args.video).name, args.track_id)
+            if entry is None:
+                print(f"Error: track {args.track_id} of {args.video} is not in the gallery.")
+                raise SystemExit(1)
+            query = gallery.vector(entry["id"])
+            exclude = None if args.include_same_video else entry["video"]
+        t0 = time.perf_counter()
+        results = gallery.search(query, k=args.k, nprobe=args.nprobe, exclude_video=exclude)
+        print(f"Query took {(time.perf_counter() - t0) * 1000:.1f} ms over {len(gallery)} tracks.")
+        _print_results(results)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+依類別對照表平行改寫 YOLO 標籤檔 (labels/*.txt) 的類別欄位。
+
+main*.py 的 update_txt_file_class_indices() 與 modify_labels.py 原本逐一 readlines / writelines 改寫每個檔案，
+中途中斷會留下寫到一半的標籤。這裡：
+- 對照表 (mapping) 以 'OLD=NEW' 指定，OLD 可為類別編號、匯出檔中的類別名稱或 '*' (其他所有類別)，
+  NEW 為類別編號或 'drop' (刪除該行)；也可以是 {old: new} 的 .json / .yaml 檔
+- 以 bytes 處理：只替換每行第一個欄位，其餘內容、換行字元與 BOM 原樣保留
+- 內容沒有變動的檔案不寫入 (mtime 不變，後續的快取仍然有效)
+- 需要改寫時先寫到同目錄的暫存檔再 os.replace，不會留下寫到一半的檔案
+- 檔案分批交給 thread pool 處理 (讀寫檔案時會釋放 GIL)，最後回報各項計數
+
+    python relabel_labels.py --dirs datasets/wildlife/labels/train_laser datasets/wildlife/labels/val_laser --map 0=1
+    python relabel_labels.py --dirs yolov5/open-images-v7/Monkey/labels --map "*=2" --dry_run
+"""
+import os
+import json
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+BOM = b"\xef\xbb\xbf"
+DROP = None
+ANY = b"*"
+BATCH_SIZE = 512
+
+
+def parse_mapping(spec):
+    """
+    'OLD=NEW[,OLD=NEW...]' 或 .json / .yaml 檔 -> {bytes: bytes 或 DROP}。
+    NEW 必須是類別編號或 'drop'。
+    """
+    if isinstance(spec, dict):
+        pairs = spec.items()
+    elif Path(spec).suffix.lower() in (".json", ".yaml", ".yml") and Path(spec).is_file():
+        with open(spec, "r", encoding="utf-8") as f:
+            if Path(spec).suffix.lower() == ".json":
+                pairs = json.load(f).items()
+            else:
+                import yaml
+                pairs = yaml.safe_load(f).items()
+    else:
+        pairs = []
+        for item in str(spec).split(","):
+            if not item.strip():
+                continue
+            if "=" not in item:
+                raise ValueError(f"Mapping entry must look like OLD=NEW: {item!r}")
+            old, new = item.split("=", 1)
+            pairs.append((old, new))
+    mapping = {}
+    for old, new in pairs:
+        old, new = str(old).strip(), str(new).strip()
+        if not old:
+            raise ValueError("Mapping entry has an empty class.")
+        if new.lower() == "drop":
+            mapping[old.encode("utf-8")] = DROP
+        elif new.lstrip("-").isdigit():
+            mapping[old.encode("utf-8")] = str(int(new)).encode("ascii")
+        else:
+            raise ValueError(f"New class must be an integer index or 'drop': {old}={new}")
+    if not mapping:
+        raise ValueError("Empty class mapping.")
+    return mapping
+
+
+def relabel_bytes(raw, mapping):
+    """改寫一個檔案的內容，回傳 (新內容, 改寫的行數, 刪除的行數)。"""
+    prefix = BOM if raw.startswith(BOM) else b""
+    default = mapping.get(ANY, ...)
+    out = [prefix]
+    changed = dropped = 0
+    for line in raw[len(prefix):].splitlines(keepends=True):
+        parts = line.split(None, 1)
+        if not parts:
+            out.append(line)
+            continue
+        token = parts[0]
+        new = mapping.get(token, default)
+        if new is ...:
+            out.append(line)
+        elif new is DROP:
+            dropped += 1
+        elif new == token:
+            out.append(line)
+        else:
+            start = line.index(token)
+            out.append(line[:start] + new + line[start + len(token):])
+            changed += 1
+    if not changed and not dropped:
+        return raw, 0, 0
+    return b"".join(out), changed, dropped
+
+
+def atomic_write(path, data):
+    """寫到同目錄的暫存檔後以 os.replace 取代 (同一檔案系統上是原子操作)。"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _relabel_batch(paths, mapping, dry_run):
+    counts = {"changed": 0, "unchanged": 0, "lines_changed": 0, "lines_dropped": 0}
+    changed_files, errors = [], []
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+            data, n_changed, n_dropped = relabel_bytes(raw, mapping)
+            if data is raw:
+                counts["unchanged"] += 1
+                continue
+            if not dry_run:
+                atomic_write(path, data)
+            counts["changed"] += 1
+            counts["lines_changed"] += n_changed
+            counts["lines_dropped"] += n_dropped
+            changed_files.append(path)
+        except OSError as e:
+            errors.append((path, str(e)))
+    return counts, changed_files, errors
+
+
+def scan_txt_files(directories):
+    """遞迴列出所有 .txt (略過找不到的資料夾並提示)。"""
+    files = []
+    for directory in directories:
+        if not os.path.isdir(directory):
+            print(f"⚠️ Warning: Directory not found: {directory}. Skipping.")
+            continue
+        for root, _, names in os.walk(directory):
+            files.extend(os.path.join(root, n) for n in names if n.endswith(".txt"))
+    return files
+
+
+def relabel_dirs(directories, mapping, workers=None, dry_run=False, batch_size=BATCH_SIZE):
+    """改寫資料夾下所有標籤檔，回傳報告 (dict)。mapping 可以是 parse_mapping() 接受的任何格式。"""
+    if not (isinstance(mapping, dict) and all(isinstance(k, bytes) for k in mapping)):
+        mapping = parse_mapping(mapping)
+    t0 = time.perf_counter()
+    files = scan_txt_files([str(d) for d in directories])
+    batches = [files[i:i + batch_size] for i in range(0, len(files), batch_size)]
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    report = {"files": len(files), "changed": 0, "unchanged": 0, "lines_changed": 0, "lines_dropped": 0,
+              "errors": [], "changed_files": [], "dry_run": bool(dry_run)}
+    if workers <= 1 or len(batches) <= 1:
+        results = [_relabel_batch(b, mapping, dry_run) for b in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda b: _relabel_batch(b, mapping, dry_run), batches))
+    for counts, changed_files, errors in results:
+        for key, value in counts.items():
+            report[key] += value
+        report["changed_files"].extend(changed_files)
+        report["errors"].extend(errors)
+    report["seconds"] = round(time.perf_counter() - t0, 3)
+    return report
+
+
+def print_report(report, show=20):
+    verb = "would change" if report["dry_run"] else "changed"
+    print(f"{report['files']} label files: {report['changed']} {verb}, {report['unchanged']} unchanged, "
+          f"{len(report['errors'])} errors ({report['lines_changed']} lines relabeled, "
+          f"{report['lines_dropped']} dropped) in {report['seconds']:.2f}s")
+    if report["dry_run"]:
+        for path in report["changed_files"][:show]:
+            print(f"  {path}")
+        if len(report["changed_files"]) > show:
+            print(f"  ... and {len(report['changed_files']) - show} more")
+    for path, message in report["errors"]:
+        print(f"❌ {path}: {message}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rewrite class indices in YOLO label files from a class mapping.")
+    parser.add_argument("--dirs", nargs="+", required=True, help="Label directories (searched recursively).")
+    parser.add_argument("--map", required=True,
+                        help="OLD=NEW pairs separated by commas (OLD may be '*'; NEW may be 'drop'), or a .json/.yaml file.")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--dry_run", action="store_true", help="Only report which files would change.")
+    parser.add_argument("--report", default=None, help="Also write the full report as JSON.")
+    args = parser.parse_args()
+
+    try:
+        mapping = parse_mapping(args.map)
+    except ValueError as e:
+        print(f"❌ {e}")
+        raise SystemExit(2)
+    report = relabel_dirs(args.dirs, mapping, args.workers, args.dry_run)
+    print_report(report)
+    if args.report:
+        Path(args.report).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
@@ -55,7 +55,8 @@ $ANALYZER_TEMPLATE_PY = Join-Path $BASE "cosine_similarity_template.py"
 
 $templateContent = Get-Content -Path $ANALYZER_TEMPLATE_PY -Raw
 
-$scriptContent = $templateContent -replace "__LABEL_DIR__", $LABEL_DIR `
+$scriptContent = $templateContent -replace "__BASE__", $BASE `
+                                  -replace "__LABEL_DIR__", $LABEL_DIR `
                                   -replace "__SESSION_DIR__", $SESSION_DIR `
                                   -replace "__YAML__", $DATASET_YAML
 
@@ -1,19 +1,26 @@
 # -*- coding: utf-8 -*-
+import os
 import cv2
 import torch
-import numpy as np
 import pandas as pd
 import argparse
 from ultralytics import YOLO
 from collections import defaultdict
 from itertools import combinations
 import matplotlib.pyplot as plt
-import seaborn as sns
+from density_plot import histplot
 from sklearn.metrics.pairwise import cosine_similarity
-
-def run_analysis(video_path, track_model_path, embed_model_path, output_dir):
+from crop_sampling import CropSampler, add_sampling_args, sampler_from_args
+from reid_gallery import add_session_tracks, feature_kind
+from sharded_tracking import DEFAULT_OVERLAP, add_sharding_args, run_sharded_tracking
+from analysis_checkpoint import Checkpointer, add_checkpoint_args
+from track_embedding_stats import TrackEmbeddingAccumulator
+
+def run_analysis(video_path, track_model_path, embed_model_path, output_dir, sampler=None, gallery_dir=None,
+                 workers=1, shard_overlap=DEFAULT_OVERLAP, resume=False, checkpoint_every=500):
     """
     執行完整的追蹤、特徵提取與餘弦距離分析流程。
+    逐幀模式下每 checkpoint_every 幀寫入 checkpoint，resume=True 時從上次的斷點繼續。
     """
     # --- 1. 載入模型 ---
     print(f"Loading tracking model from {track_model_path}...")
@@ -32,10 +39,59 @@ def run_analysis(video_path, track_model_path, embed_model_path, output_dir):
         print(f"Error: Could not open video {video_path}")
         return
 
-    track_features = defaultdict(list)
-    track_class = {}
+    # 每個 track 只保留特徵總和、數量與出現的幀範圍 (checkpoint 大小不隨偵測次數成長)
+    accumulator = TrackEmbeddingAccumulator()
+    fps = cap.get(cv2.CAP_PROP_FPS) or None
+    sampler = sampler or CropSampler()
+
+    def record_feature(track_id, class_id, frame, feature_vector):
+        """把一個特徵向量記錄到對應的 track。"""
+        accumulator.update(track_id, feature_vector.flatten(), track_model.names[class_id], frame)
+
+    def extract_feature(item):
+        """對一張裁切圖計算特徵並記錄到對應的 track。"""
+        track_id, class_id, crop = item["track_id"], item["cls_id"], item["image"]
+        # 使用 embedding 模型提取特徵
+        embedding_results = embed_model.predict(crop, verbose=False)
+
+        feature_vector = None
+        # 優先使用分類模型的 .probs 輸出
+        if embedding_results[0].probs is not None:
+            feature_vector = embedding_results[0].probs.data.cpu().numpy()
+        # 如果是偵測模型，回退到使用 BBox 的歸一化座標作為特徵
+        elif embedding_results[0].boxes is not None and len(embedding_results[0].boxes) > 0:
+            # 使用第一個偵測到的框的 xywhn 作為特徵
+            feature_vector = embedding_results[0].boxes.xywhn[0].cpu().numpy()
+            if track_id not in accumulator.tracks:
+                 print(f"Warning: Embedding model is a detection model. Using BBox data as a fallback feature for track ID {track_id}.")
+
+        if feature_vector is not None:
+            record_feature(track_id, class_id, item["frame"], feature_vector)
+        else:
+            print(f"Warning: Could not extract any features for track ID {track_id} from the cropped image.")
+
+    if workers > 1:
+        # 平行分段追蹤：每個 worker 各自追蹤一段影片並提取特徵，再於分段邊界縫合 Track ID。
+        # 先釋放 cap，下方的逐幀迴圈便會直接跳過。
+        cap.release()
+        records = run_sharded_tracking(video_path, track_model_path, "botsort.yaml", workers, shard_overlap,
+                                       embed_model=embed_model_path, embed_mode="probs", sampler=sampler)
+        for r in records:
+            if r["feature"] is not None:
+                # 逐幀模式的 frame_count 由 1 起算
+                record_feature(r["track_id"], r["cls_id"], r["frame"] + 1, r["feature"])
 
     frame_count = 0
+    ckpt = None
+    if workers <= 1:
+        ckpt = Checkpointer(output_dir, video_path, checkpoint_every, resume)
+        if ckpt.state:
+            accumulator = ckpt.state["accumulator"]
+            sampler = ckpt.state["sampler"]
+            frame_count = ckpt.resume(cap, track_model, "botsort.yaml")
+    elif resume:
+        print("Warning: --resume is only supported in serial mode (--workers 1); starting from the beginning.")
+
     while cap.isOpened():
         success, frame = cap.read()
         if not success:
@@ -50,45 +106,37 @@ def run_analysis(video_path, track_model_path, embed_model_path, output_dir):
         
         if results[0].boxes.id is not None:
             boxes = results[0].boxes.xyxy.cpu().numpy()
-            track_ids = results[0].boxes.id.int().cpu().tolist()
+            track_ids = [ckpt.track_id(t) for t in results[0].boxes.id.int().cpu().tolist()]
             class_ids = results[0].boxes.cls.int().cpu().tolist()
+            confs = results[0].boxes.conf.cpu().tolist()
             
-            for box, track_id, class_id in zip(boxes, track_ids, class_ids):
+            for box, track_id, class_id, conf in zip(boxes, track_ids, class_ids, confs):
                 # 裁切物件
                 x1, y1, x2, y2 = map(int, box)
                 crop = frame[y1:y2, x1:x2]
                 
                 if crop.size > 0:
-                    # 使用 embedding 模型提取特徵
-                    embedding_results = embed_model.predict(crop, verbose=False)
-                    
-                    feature_vector = None
-                    # 優先使用分類模型的 .probs 輸出
-                    if embedding_results[0].probs is not None:
-                        feature_vector = embedding_results[0].probs.data.cpu().numpy()
-                    # 如果是偵測模型，回退到使用 BBox 的歸一化座標作為特徵
-                    elif embedding_results[0].boxes is not None and len(embedding_results[0].boxes) > 0:
-                        # 使用第一個偵測到的框的 xywhn 作為特徵
-                        feature_vector = embedding_results[0].boxes.xywhn[0].cpu().numpy()
-                        if track_id not in track_class:
-                             print(f"Warning: Embedding model is a detection model. Using BBox data as a fallback feature for track ID {track_id}.")
-                    
-                    if feature_vector is not None:
-                        track_features[track_id].append(feature_vector.flatten())
-                        if track_id not in track_class:
-                            track_class[track_id] = track_model.names[class_id]
-                    else:
-                        print(f"Warning: Could not extract any features for track ID {track_id} from the cropped image.")
+                    # 由取樣策略決定哪些裁切圖需要計算特徵 (top_k 模式會延後到影片結束)
+                    for item in sampler.offer(track_id, frame_count, crop, conf, cls_id=class_id):
+                        extract_feature(item)
+
+        if ckpt.due(frame_count):
+            ckpt.save(frame_count, track_model, {"accumulator": accumulator, "sampler": sampler})
 
     cap.release()
+    for item in sampler.flush():
+        extract_feature(item)
     print("Tracking and feature extraction complete.")
+    print(sampler.summary())
 
     # --- 4. 計算代表性特徵 ---
     print("Calculating representative features for each track ID...")
     representative_features = {}
-    for track_id, features in track_features.items():
-        if features:
-            representative_features[track_id] = np.mean(features, axis=0)
+    track_class = {}
+    for track_id, stats in accumulator:
+        if stats.count:
+            representative_features[track_id] = stats.mean
+            track_class[track_id] = stats.cls_name
 
     # --- 5. 計算餘弦距離 ---
     print("Calculating cosine distances...")
@@ -153,8 +201,9 @@ def run_analysis(video_path, track_model_path, embed_model_path, output_dir):
     if plot_data_list: # Only plot if there's data to plot
         combined_df = pd.concat(plot_data_list, ignore_index=True)
 
-        plt.figure(figsize=(12, 7))
-        sns.histplot(data=combined_df, x='distance', hue='type', kde=True, common_norm=False)
+        fig, ax = plt.subplots(figsize=(12, 7))
+        histplot(ax, {name: g['distance'].to_numpy() for name, g in combined_df.groupby('type', sort=False)}, kde=True)
+        ax.legend(title='type')
         plt.title('Distribution of Intra-class and Inter-class Cosine Distances (BoT-SORT)')
         plt.xlabel('Cosine Distance (1 - Similarity)')
         plt.ylabel('Count')
@@ -167,6 +216,13 @@ def run_analysis(video_path, track_model_path, embed_model_path, output_dir):
     else:
         print("No distances were calculated or data is missing required columns. Skipping plot generation.")
 
+    # 最後才寫入 gallery：特徵與 gallery 不相容時只會警告，上面的輸出都已存檔
+    if gallery_dir:
+        add_session_tracks(gallery_dir, video_path, os.path.basename(os.path.normpath(output_dir)),
+                           accumulator.gallery_rows(), fps, feature_kind(embed_model_path, "probs"))
+
+    if ckpt:
+        ckpt.done()
     print("Analysis finished.")
 
 
@@ -176,12 +232,16 @@ if __name__ == '__main__':
     parser.add_argument('--track_model', required=True, help="Path to the YOLOv8 detection/tracking model (.pt).")
     parser.add_argument('--embed_model', required=True, help="Path to the YOLOv8 classification model for embedding (.pt).")
     parser.add_argument('--output', default='analysis_results', help="Directory to save the output files.")
+    parser.add_argument('--gallery', default=None, help="Re-ID gallery directory to add this session's tracks to.")
+    add_sampling_args(parser)
+    add_sharding_args(parser)
+    add_checkpoint_args(parser)
     
     args = parser.parse_args()
     
     # 建立輸出目錄
-    import os
     if not os.path.exists(args.output):
         os.makedirs(args.output)
         
-    run_analysis(args.video, args.track_model, args.embed_model, args.output)
+    run_analysis(args.video, args.track_model, args.embed_model, args.output, sampler_from_args(args), args.gallery,
+                 args.workers, args.shard_overlap, args.resume, args.checkpoint_every)
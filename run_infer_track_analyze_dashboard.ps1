@@ -74,7 +74,8 @@ $ANALYZER_TEMPLATE_PY = Join-Path $BASE "analyze_and_serve_template.py"
 $rawPythonScriptTemplate = Get-Content -Path $ANALYZER_TEMPLATE_PY -Raw
 
 # Perform replacements to inject PowerShell variables
-$pythonScriptContent = $rawPythonScriptTemplate -replace "__LABEL_DIR__", $LABEL_DIR `
+$pythonScriptContent = $rawPythonScriptTemplate -replace "__BASE__", $BASE `
+                                                -replace "__LABEL_DIR__", $LABEL_DIR `
                                                 -replace "__VIDEO__", $VIDEO `
                                                 -replace "__SESSION_DIR__", $SESSION_DIR `
                                                 -replace "__YAML__", $YAML
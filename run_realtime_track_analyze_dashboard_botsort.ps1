@@ -3,13 +3,16 @@
 並自動生成統計報表（CSV/JSON/PNG）＋啟動 Flask 儀表板（Plotly 互動圖表）。
 支援：本地影片檔案、RTSP/HTTP 串流、網路影片 URL 等作為輸入 source。
 推論時可即時彈出視窗觀看追蹤結果，統計分析在追蹤結束後生成。
+加上 -LIVE 時，追蹤期間另以 live_analyzer.py 即時更新統計 (http://127.0.0.1:<LIVE_PORT>/)。
 #>
 
 param(
   [string]$MODEL = "",
   [string]$VIDEO = "", # 影片來源：可以是本地檔案路徑、RTSP/HTTP URL、網路影片 URL
   [string]$TRACKER = "botsort.yaml",
-  [int]$PORT = 5050
+  [int]$PORT = 5050,
+  [switch]$LIVE,
+  [int]$LIVE_PORT = 5051
 )
 
 $ErrorActionPreference = "Stop"
@@ -39,14 +42,32 @@ $PRED_DIR   = Join-Path $RUNS ("predict\$SESSION")
 $SESSION_DIR= Join-Path $ANALYZE $SESSION
 New-Item -ItemType Directory -Force -Path $RUNS, $ANALYZE, $PRED_DIR, $SESSION_DIR | Out-Null
 
+$DATASET_CAND = @(
+  (Join-Path $BASE "datasets\wildlife\wildlife.yaml"),
+  (Join-Path $BASE "dataset\wildlife\wildlife.yaml")
+)
+$YAML = $null
+foreach ($c in $DATASET_CAND) { if (Test-Path $c) { $YAML = $c; break } }
+
+$liveProc = $null
+if ($LIVE) {
+  # 追蹤期間跟隨 labels 目錄，即時更新統計並寫入 $SESSION_DIR
+  $liveArgs = @((Join-Path $BASE "live_analyzer.py"), "--labels_dir", (Join-Path $PRED_DIR "labels"), "--session_dir", $SESSION_DIR, "--video", $VIDEO, "--port", $LIVE_PORT)
+  if ($YAML) { $liveArgs += @("--yaml", $YAML) }
+  $liveProc = Start-Process -FilePath $PYTHON -ArgumentList $liveArgs -PassThru -WindowStyle Hidden
+  Write-Host "-> Live statistics: http://127.0.0.1:$LIVE_PORT/"
+}
+
 Write-Host "`n[1/4] Tracking inference: $TRACKER on source: $VIDEO ..."
 # Ultralytics track 支援即時推論，彈出視窗同步觀看
+# $PRED_DIR 已預先建立：exist_ok=True 讓輸出直接寫入該目錄 (-LIVE 跟隨的就是 $PRED_DIR\labels)，而不是 track_xxx2
 if ($USE_PY) {
-  & $PYTHON -m ultralytics track model="$MODEL" source="$VIDEO" tracker="$TRACKER" imgsz=1280 device=0 conf=0.45 iou=0.6 save=True save_txt=True save_conf=True save_crop=True project="$RUNS\predict" name="$SESSION"
+  & $PYTHON -m ultralytics track model="$MODEL" source="$VIDEO" tracker="$TRACKER" imgsz=1280 device=0 conf=0.45 iou=0.6 save=True save_txt=True save_conf=True save_crop=True project="$RUNS\predict" name="$SESSION" exist_ok=True
 } else {
-  & $YOLO_EXE track model="$MODEL" source="$VIDEO" tracker="$TRACKER" imgsz=1280 device=0 conf=0.45 iou=0.6 save=True save_txt=True save_conf=True save_crop=True project="$RUNS\predict" name="$SESSION"
+  & $YOLO_EXE track model="$MODEL" source="$VIDEO" tracker="$TRACKER" imgsz=1280 device=0 conf=0.45 iou=0.6 save=True save_txt=True save_conf=True save_crop=True project="$RUNS\predict" name="$SESSION" exist_ok=True
 }
 # 對於即時串流，需手動 Ctrl+C 停止，腳本才會繼續執行
+if ($liveProc) { Stop-Process -Id $liveProc.Id -ErrorAction SilentlyContinue }
 
 # 動態尋找 Ultralytics 實際使用的輸出目錄（因為它可能在目錄已存在時添加後綴，例如 track_xyz -> track_xyz2）
 $actualPredDir = Get-ChildItem -Path (Join-Path $RUNS "predict") -Directory | Where-Object { $_.Name -like "$SESSION*" } | Sort-Object CreationTime -Descending | Select-Object -First 1
@@ -76,13 +97,6 @@ if ($VIDEO -like "http*") {
     }
 }
 
-$DATASET_CAND = @(
-  (Join-Path $BASE "datasets\wildlife\wildlife.yaml"),
-  (Join-Path $BASE "dataset\wildlife\wildlife.yaml")
-)
-$YAML = $null
-foreach ($c in $DATASET_CAND) { if (Test-Path $c) { $YAML = $c; break } }
-
 $ANALYZER_PY = Join-Path $SESSION_DIR "analyze_and_realtime.py"
 $ANALYZER_TEMPLATE_PY = Join-Path $BASE "analyze_and_realtime_template.py" 
 
@@ -90,7 +104,8 @@ $ANALYZER_TEMPLATE_PY = Join-Path $BASE "analyze_and_realtime_template.py"
 $rawPythonScriptTemplate = Get-Content -Path $ANALYZER_TEMPLATE_PY -Raw
 
 # Perform replacements to inject PowerShell variables
-$pythonScriptContent = $rawPythonScriptTemplate -replace "__LABEL_DIR__", $LABEL_DIR `
+$pythonScriptContent = $rawPythonScriptTemplate -replace "__BASE__", $BASE `
+                                                -replace "__LABEL_DIR__", $LABEL_DIR `
                                                 -replace "__VIDEO__", $analysisVideoSource `
                                                 -replace "__SESSION_DIR__", $SESSION_DIR `
                                                 -replace "__YAML__", $YAML
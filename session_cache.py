@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+以檔案簽章 (mtime_ns, size) 驗證的 LRU 快取，給常駐儀表板使用。
+
+每個項目記錄它依賴的檔案清單與當時的簽章；取用時只對這些檔案做 stat()，
+簽章未變就直接回傳已解析的資料 / 已產生的 Plotly div，不讀檔也不重建圖表。
+分析程式覆寫 CSV 或 summary.json 時 mtime / size 改變，下次取用就會重建。
+check_interval 秒內重複取用同一項目連 stat() 都省略 (儀表板自動重新整理時)。
+超過 max_entries 個項目時淘汰最久未使用的。
+
+    cache = SessionCache(max_entries=16)
+    value = cache.get(("page", name), [sess / "summary.json", sess / "a.csv"], lambda: build(sess))
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+
+def file_signature(paths):
+    """各檔案的 (mtime_ns, size)；不存在的檔案為 None。"""
+    sig = []
+    for p in paths:
+        try:
+            st = os.stat(p)
+            sig.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            sig.append(None)
+    return tuple(sig)
+
+
+class SessionCache:
+    def __init__(self, max_entries=16, check_interval=1.0):
+        self.max_entries = max(1, int(max_entries))
+        self.check_interval = float(check_interval)
+        self._entries = OrderedDict()  # key -> [signature, value, last_checked]
+        self._lock = threading.RLock()
+        self.hits = self.misses = 0
+
+    def peek(self, key):
+        """回傳目前快取的值 (不驗證、不更新 LRU 順序)，沒有時回傳 None。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry else None
+
+    def get(self, key, paths, build):
+        """paths 的簽章與快取相同時回傳快取值，否則呼叫 build() 重建。"""
+        with self._lock:
+            now = time.monotonic()
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[2] < self.check_interval:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            sig = file_signature(paths)
+            if entry is not None and entry[0] == sig:
+                entry[2] = now
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            value = build()
+            # 以建立前取得的簽章保存：建立期間檔案又被改寫時，下次取用會再重建一次
+            self._entries[key] = [sig, value, now]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
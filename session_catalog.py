@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+跨 session 的分析目錄 (SQLite)。
+
+app_dashboard.py 一次只能看一個 track_YYYYMMDD_HHMMSS；要回答「這個月每天猴子的總停留時間」
+得手動打開幾十個 CSV。這裡把 runs/analyze 下每個 session 的統計匯入一個 SQLite 檔 (只需標準函式庫)：
+
+    sessions      每個 session 一列：開始時間 (由目錄名稱解析)、日期、影片、fps、幀數、track 數 ...
+    tracks        每個 track 一列：主要類別、筆數、秒數、首末幀 (來自 track_lifespans.csv / detections.npz)
+    class_totals  每個 session 各類別的偵測筆數
+    minute_stats  每分鐘、每個類別的偵測筆數與不重複 track 數 (由 detections.npz 彙總)
+
+索引建立在 session 開始時間、類別與 (session, track) 上，跨數月資料的查詢只讀取彙總表。
+同步時以各來源檔案的 (mtime, size) 判斷 session 是否變更，只重新匯入有變動的 session。
+
+使用方式：
+    python session_catalog.py sync  --base runs/analyze
+    python session_catalog.py query dwell_by_day --start 2025-10-01 --end 2025-10-31 --cls monkey
+    python session_catalog.py query activity_by_hour --start 2025-10-01
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import argparse
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+CATALOG_NAME = "catalog.sqlite"
+SOURCE_FILES = ("summary.json", "track_lifespans.csv", "class_totals.csv", "detections.npz")
+_SESSION_TIME_RE = re.compile(r"(\d{8})_(\d{6})")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    started_at TEXT NOT NULL,          -- 'YYYY-MM-DD HH:MM:SS' (本地時間)
+    day TEXT NOT NULL,                 -- 'YYYY-MM-DD'
+    video TEXT, fps REAL, frames INTEGER, tracks_total INTEGER, objects_total INTEGER,
+    avg_lifespan_sec REAL, signature TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_started ON sessions(started_at);
+CREATE INDEX IF NOT EXISTS idx_sessions_day ON sessions(day);
+
+CREATE TABLE IF NOT EXISTS tracks (
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    track_id INTEGER NOT NULL, cls_name TEXT, frames INTEGER, seconds REAL,
+    first_frame INTEGER, last_frame INTEGER,
+    PRIMARY KEY (session_id, track_id)
+);
+CREATE INDEX IF NOT EXISTS idx_tracks_cls ON tracks(cls_name, session_id);
+
+CREATE TABLE IF NOT EXISTS class_totals (
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    cls_name TEXT NOT NULL, count INTEGER NOT NULL,
+    PRIMARY KEY (session_id, cls_name)
+);
+CREATE INDEX IF NOT EXISTS idx_class_totals_cls ON class_totals(cls_name);
+
+CREATE TABLE IF NOT EXISTS minute_stats (
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    minute_at TEXT NOT NULL,           -- 'YYYY-MM-DD HH:MM'
+    cls_name TEXT NOT NULL, detections INTEGER NOT NULL, tracks INTEGER NOT NULL,
+    PRIMARY KEY (session_id, minute_at, cls_name)
+);
+CREATE INDEX IF NOT EXISTS idx_minute_stats_time ON minute_stats(minute_at, cls_name);
+"""
+
+
+def connect(db_path):
+    conn = sqlite3.connect(str(db_path), timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")  # 儀表板讀取時仍可同步寫入
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def session_started_at(session_dir):
+    """由目錄名稱 (track_YYYYMMDD_HHMMSS) 解析開始時間，無法解析時使用 summary.json 的 mtime。"""
+    m = _SESSION_TIME_RE.search(Path(session_dir).name)
+    if m:
+        try:
+            return datetime.strptime(m.group(1) + m.group(2), "%Y%m%d%H%M%S")
+        except ValueError:
+            pass
+    return datetime.fromtimestamp(int((Path(session_dir) / "summary.json").stat().st_mtime))
+
+
+def session_signature(session_dir):
+    sig = {}
+    for name in SOURCE_FILES:
+        try:
+            st = os.stat(Path(session_dir) / name)
+            sig[name] = [st.st_mtime_ns, st.st_size]
+        except OSError:
+            sig[name] = None
+    return json.dumps(sig, sort_keys=True)
+
+
+def _minute_rollup(session_dir, started_at, fps, track_cls):
+    """由 detections.npz 彙總每分鐘、每類別的偵測筆數與 track 數；類別取各 track 的主要類別。"""
+    from detection_store import DetectionStore
+    with DetectionStore(Path(session_dir) / "detections.npz") as store:
+        data = store.read(("frame", "track_id"))
+    if not len(data["frame"]):
+        return pd.DataFrame(), pd.DataFrame()
+    df = pd.DataFrame({"frame": data["frame"].astype(np.int64), "track_id": data["track_id"].astype(np.int64)})
+    spans = df.groupby("track_id")["frame"].agg(first_frame="min", last_frame="max").reset_index()
+    df["cls_name"] = df["track_id"].map(track_cls).fillna("unknown")
+    df["minute"] = df["frame"] // max(int(round(fps * 60)), 1)
+    rollup = (df.groupby(["minute", "cls_name"])["track_id"].agg(detections="size", tracks="nunique").reset_index())
+    base = pd.Timestamp(started_at)
+    rollup["minute_at"] = (base + pd.to_timedelta(rollup["minute"], unit="m")).dt.strftime("%Y-%m-%d %H:%M")
+    return rollup, spans
+
+
+def ingest_session(conn, session_dir, force=False):
+    """匯入 (或重新匯入) 一個 session；未變更時略過。回傳是否有匯入。"""
+    session_dir = Path(session_dir)
+    if not (session_dir / "track_lifespans.csv").exists() or not (session_dir / "summary.json").exists():
+        return False
+    name = session_dir.name
+    signature = session_signature(session_dir)
+    row = conn.execute("SELECT id, signature FROM sessions WHERE name = ?", (name,)).fetchone()
+    if row and row[1] == signature and not force:
+        return False
+
+    summary = json.loads((session_dir / "summary.json").read_text(encoding="utf-8"))
+    started = session_started_at(session_dir)
+    fps = float(summary.get("fps") or 30.0)
+    frames = summary.get("frames")
+    life = pd.read_csv(session_dir / "track_lifespans.csv")
+    totals = pd.read_csv(session_dir / "class_totals.csv") if (session_dir / "class_totals.csv").exists() else pd.DataFrame()
+    track_cls = dict(zip(life["track_id"], life["cls_name"])) if "cls_name" in life else {}
+    rollup, spans = pd.DataFrame(), pd.DataFrame()
+    if (session_dir / "detections.npz").exists():
+        rollup, spans = _minute_rollup(session_dir, started, fps, track_cls)
+    if len(spans):
+        life = life.merge(spans, on="track_id", how="left")
+    else:
+        life["first_frame"] = life["last_frame"] = None
+
+    with conn:  # 單一交易：先刪除舊資料再寫入
+        if row:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (row[0],))
+        cur = conn.execute(
+            "INSERT INTO sessions (name, started_at, day, video, fps, frames, tracks_total, objects_total, "
+            "avg_lifespan_sec, signature) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (name, started.strftime("%Y-%m-%d %H:%M:%S"), started.strftime("%Y-%m-%d"), summary.get("video"), fps,
+             frames if isinstance(frames, int) else None, summary.get("tracks_total"), summary.get("objects_total"),
+             summary.get("avg_lifespan_sec"), signature))
+        sid = cur.lastrowid
+        conn.executemany(
+            "INSERT INTO tracks (session_id, track_id, cls_name, frames, seconds, first_frame, last_frame) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(sid, int(r.track_id), str(r.cls_name), int(r.frames), float(r.seconds),
+              None if pd.isna(r.first_frame) else int(r.first_frame),
+              None if pd.isna(r.last_frame) else int(r.last_frame))
+             for r in life.itertuples(index=False)])
+        if len(totals):
+            conn.executemany("INSERT INTO class_totals (session_id, cls_name, count) VALUES (?, ?, ?)",
+                             [(sid, str(c), int(n)) for c, n in zip(totals["class"], totals["count"])])
+        if len(rollup):
+            conn.executemany(
+                "INSERT INTO minute_stats (session_id, minute_at, cls_name, detections, tracks) VALUES (?, ?, ?, ?, ?)",
+                [(sid, m, str(c), int(d), int(t)) for m, c, d, t in
+                 zip(rollup["minute_at"], rollup["cls_name"], rollup["detections"], rollup["tracks"])])
+    return True
+
+
+def sync(conn, base, force=False):
+    """匯入 base 下所有新增或變更的 session，並移除已刪除的 session。回傳 (匯入數, 移除數)。"""
+    base = Path(base)
+    present = set()
+    imported = 0
+    for p in sorted(base.iterdir()):
+        if p.is_dir() and (p / "summary.json").exists() and (p / "track_lifespans.csv").exists():
+            present.add(p.name)
+            try:
+                imported += ingest_session(conn, p, force)
+            except Exception as e:
+                print(f"Warning: could not import {p.name}: {e}")
+    stale = [(sid,) for sid, name in conn.execute("SELECT id, name FROM sessions") if name not in present]
+    with conn:
+        conn.executemany("DELETE FROM sessions WHERE id = ?", stale)
+    return imported, len(stale)
+
+
+def _range_clause(column, start, end, cls=None, cls_column="cls_name"):
+    """組出 WHERE 子句；end 為日期時包含當天。"""
+    where, params = [], []
+    if start:
+        where.append(f"{column} >= ?")
+        params.append(start)
+    if end:
+        where.append(f"{column} < ?")
+        params.append(end + " 99" if len(end) == 10 else end)  # 'YYYY-MM-DD 99' 大於當天任何時間
+    if cls:
+        where.append(f"{cls_column} = ?")
+        params.append(cls)
+    return (" WHERE " + " AND ".join(where)) if where else "", params
+
+
+def dwell_by_day(conn, start=None, end=None, cls=None):
+    """每天、每類別的總停留秒數與 track 數。"""
+    where, params = _range_clause("s.started_at", start, end, cls, "t.cls_name")
+    return pd.read_sql_query(
+        "SELECT s.day AS day, t.cls_name AS cls_name, SUM(t.seconds) AS dwell_seconds, COUNT(*) AS tracks "
+        f"FROM tracks t JOIN sessions s ON s.id = t.session_id{where} GROUP BY s.day, t.cls_name ORDER BY s.day",
+        conn, params=params)
+
+
+def detections_by_day(conn, start=None, end=None, cls=None):
+    where, params = _range_clause("s.started_at", start, end, cls, "c.cls_name")
+    return pd.read_sql_query(
+        "SELECT s.day AS day, c.cls_name AS cls_name, SUM(c.count) AS detections "
+        f"FROM class_totals c JOIN sessions s ON s.id = c.session_id{where} GROUP BY s.day, c.cls_name ORDER BY s.day",
+        conn, params=params)
+
+
+def activity_by_hour(conn, start=None, end=None, cls=None):
+    """一天中各小時的偵測筆數與 track 數 (跨 session 加總)，用 minute_stats。"""
+    where, params = _range_clause("minute_at", start, end, cls)
+    return pd.read_sql_query(
+        "SELECT CAST(substr(minute_at, 12, 2) AS INTEGER) AS hour, cls_name, SUM(detections) AS detections, "
+        f"SUM(tracks) AS track_minutes FROM minute_stats{where} GROUP BY hour, cls_name ORDER BY hour",
+        conn, params=params)
+
+
+def list_sessions(conn, start=None, end=None):
+    where, params = _range_clause("started_at", start, end)
+    return pd.read_sql_query(
+        "SELECT name, started_at, video, fps, frames, tracks_total, objects_total, avg_lifespan_sec "
+        f"FROM sessions{where} ORDER BY started_at", conn, params=params)
+
+
+def class_names(conn):
+    return [r[0] for r in conn.execute("SELECT DISTINCT cls_name FROM tracks ORDER BY cls_name")]
+
+
+QUERIES = {
+    "dwell_by_day": dwell_by_day,
+    "detections_by_day": detections_by_day,
+    "activity_by_hour": activity_by_hour,
+    "sessions": lambda conn, start=None, end=None, cls=None: list_sessions(conn, start, end),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-session analytics catalog (SQLite).")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_sync = sub.add_parser("sync", help="Import new or changed sessions.")
+    p_sync.add_argument("--base", default="runs/analyze")
+    p_sync.add_argument("--db", default=None, help=f"Catalog file (default: <base>/{CATALOG_NAME}).")
+    p_sync.add_argument("--force", action="store_true", help="Re-import every session.")
+    p_query = sub.add_parser("query", help="Run a multi-session query.")
+    p_query.add_argument("name", choices=sorted(QUERIES))
+    p_query.add_argument("--base", default="runs/analyze")
+    p_query.add_argument("--db", default=None)
+    p_query.add_argument("--start", default=None, help="YYYY-MM-DD[ HH:MM]")
+    p_query.add_argument("--end", default=None, help="YYYY-MM-DD[ HH:MM] (a date includes the whole day)")
+    p_query.add_argument("--cls", default=None)
+    p_query.add_argument("--csv", default=None, help="Also save the result to this CSV.")
+    args = parser.parse_args()
+
+    conn = connect(args.db or Path(args.base) / CATALOG_NAME)
+    t0 = time.perf_counter()
+    if args.command == "sync":
+        imported, removed = sync(conn, args.base, args.force)
+        print(f"Imported {imported} session(s), removed {removed} in {time.perf_counter() - t0:.2f}s.")
+    else:
+        df = QUERIES[args.name](conn, args.start, args.end, args.cls)
+        print(df.to_string(index=False))
+        print(f"({len(df)} rows, {1000 * (time.perf_counter() - t0):.1f} ms)")
+        if args.csv:
+            df.to_csv(args.csv, index=False)
+    conn.close()
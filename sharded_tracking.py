@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+影片分段 (sharding) 平行追蹤，並在分段邊界縫合 (stitch) Track ID。
+
+單一 process 以 cap.read() 逐幀追蹤長影片時只會用到一顆 CPU 核心。這裡把影片切成
+N 段連續的幀範圍，每段交給一個 worker process 獨立追蹤與提取特徵：
+
+    shard i 擁有 [start_i, start_{i+1}) 的幀，但從 start_i - overlap 開始追蹤，
+    讓追蹤器在重疊區「暖機」，同時兩個 shard 在重疊區看到相同的畫面。
+    暖機區只追蹤，不交給 CropSampler 取樣、也不提取特徵 (這些幀的結果最後只保留前一個 shard 的)。
+
+縫合時在重疊區逐幀比較兩個 shard 的框 (IoU)，累積投票後以匈牙利演算法
+(linear_sum_assignment) 一對一配對 local track；沒有配對成功、且在邊界附近開始/結束的
+track 再以平均特徵的餘弦相似度配對。最後每一幀只保留擁有該幀的 shard 的偵測結果，
+輸出格式與逐幀處理時相同：每筆偵測為
+    {"frame", "track_id", "cls_id", "conf", "box", "feature"}
+其中 frame 由 0 起算，feature 可能為 None (未通過取樣或提取失敗)。
+"""
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cv2
+from scipy.optimize import linear_sum_assignment
+
+DEFAULT_OVERLAP = 30
+
+
+def plan_shards(total_frames, workers, overlap=DEFAULT_OVERLAP):
+    """回傳每個 shard 的 (warmup_start, own_start, own_end)，own_end 不含。"""
+    workers = max(1, min(workers, total_frames // max(1, 2 * overlap) or 1))
+    bounds = np.linspace(0, total_frames, workers + 1).astype(int)
+    return [(max(0, int(s) - overlap) if i else 0, int(s), int(e))
+            for i, (s, e) in enumerate(zip(bounds[:-1], bounds[1:]))]
+
+
+def extract_embedding(model, crop, mode):
+    """
+    mode='embed'：YOLO.embed() 的輸出 (calculate_cosine_similarity*.py 的做法)。
+    mode='probs'：分類模型的 .probs，偵測模型則回退到第一個框的 xywhn (run_full_analysis_botsort.py 的做法)。
+    """
+    if mode == "embed":
+        results = model.embed(source=[crop], verbose=False)
+        return results[0].flatten().cpu().numpy() if results and results[0] is not None else None
+    results = model.predict(crop, verbose=False)
+    if results[0].probs is not None:
+        return results[0].probs.data.cpu().numpy().flatten()
+    if results[0].boxes is not None and len(results[0].boxes) > 0:
+        return results[0].boxes.xywhn[0].cpu().numpy().flatten()
+    return None
+
+
+def _track_shard(job):
+    """在 worker process 中追蹤一個幀範圍 (必須是模組層級函式才能被 pickle)。"""
+    from ultralytics import YOLO
+    from crop_sampling import CropSampler
+    import torch
+
+    torch.set_num_threads(job["threads"])
+    warmup_start, own_start, own_end = job["range"]
+    track_model = YOLO(job["track_model"])
+    embed_model = YOLO(job["embed_model"]) if job["embed_model"] else None
+    sampler = CropSampler(**job["sampler"])
+
+    cap = cv2.VideoCapture(job["video"])
+    cap.set(cv2.CAP_PROP_POS_FRAMES, warmup_start)
+    frame_idx = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    while frame_idx < warmup_start and cap.grab():  # 部分編碼無法精準 seek
+        frame_idx += 1
+
+    records = []
+    while frame_idx < own_end:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        results = track_model.track(frame, persist=True, tracker=job["tracker"], verbose=False)
+        boxes = results[0].boxes
+        if boxes is not None and boxes.id is not None:
+            for box, track_id, cls_id, conf in zip(boxes.xyxy.cpu().numpy(), boxes.id.int().cpu().tolist(),
+                                                   boxes.cls.int().cpu().tolist(), boxes.conf.cpu().tolist()):
+                rec = {"frame": frame_idx, "track_id": track_id, "cls_id": cls_id, "conf": conf,
+                       "box": box.astype(np.float32), "feature": None}
+                records.append(rec)
+                x1, y1, x2, y2 = map(int, box)
+                crop = frame[y1:y2, x1:x2]
+                # 暖機 / 重疊區的幀只用來讓追蹤器建立狀態，由前一個 shard 負責取樣與提取特徵
+                if embed_model is not None and crop.size > 0 and frame_idx >= own_start:
+                    for item in sampler.offer(track_id, frame_idx, crop, conf, rec=len(records) - 1):
+                        records[item["rec"]]["feature"] = extract_embedding(embed_model, item["image"], job["embed_mode"])
+        frame_idx += 1
+        if (frame_idx - warmup_start) % 500 == 0:
+            print(f"  [shard {job['index']}] frame {frame_idx}/{own_end}")
+    cap.release()
+
+    for item in sampler.flush():
+        records[item["rec"]]["feature"] = extract_embedding(embed_model, item["image"], job["embed_mode"])
+    return records, sampler.offered, sampler.accepted
+
+
+def _box_iou(a, b):
+    """a: (N,4), b: (M,4) xyxy -> (N,M) IoU。"""
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(br - tl, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def _mean_features(records):
+    feats = defaultdict(list)
+    for r in records:
+        if r["feature"] is not None:
+            feats[r["track_id"]].append(r["feature"])
+    out = {}
+    for tid, fs in feats.items():
+        m = np.mean(fs, axis=0)
+        out[tid] = m / max(np.linalg.norm(m), 1e-12)
+    return out
+
+
+def _assign(score, min_score):
+    """score: dict[(a, b)] -> 分數，回傳分數 >= min_score 的一對一最佳配對。"""
+    if not score:
+        return {}
+    rows = sorted({a for a, _ in score})
+    cols = sorted({b for _, b in score})
+    r_idx = {a: i for i, a in enumerate(rows)}
+    c_idx = {b: j for j, b in enumerate(cols)}
+    mat = np.zeros((len(rows), len(cols)))
+    for (a, b), v in score.items():
+        mat[r_idx[a], c_idx[b]] = v
+    ri, ci = linear_sum_assignment(-mat)
+    return {cols[j]: rows[i] for i, j in zip(ri, ci) if mat[i, j] >= min_score}
+
+
+def stitch_shards(shard_records, ranges, iou_thr=0.5, min_match_frames=3, sim_thr=0.8, reid_window=None):
+    """
+    把各 shard 的 local track ID 縫合成全域 ID，並去除重疊區的重複偵測。
+    shard_records[i] 為第 i 個 shard 的偵測列表，ranges 為 plan_shards() 的輸出。
+    """
+    next_id = 1
+    prev_map = {}
+    stitched = []
+    for i, (records, (warmup_start, own_start, own_end)) in enumerate(zip(shard_records, ranges)):
+        mapping = {}
+        if i:
+            prev = shard_records[i - 1]
+            overlap = [r for r in prev if r["frame"] >= warmup_start]
+            current = [r for r in records if r["frame"] < own_start]
+
+            # 1. 重疊區逐幀 IoU 投票
+            by_frame = defaultdict(lambda: ([], []))
+            for r in overlap:
+                by_frame[r["frame"]][0].append(r)
+            for r in current:
+                by_frame[r["frame"]][1].append(r)
+            votes = defaultdict(float)
+            for a_list, b_list in by_frame.values():
+                if not a_list or not b_list:
+                    continue
+                iou = _box_iou(np.stack([r["box"] for r in a_list]), np.stack([r["box"] for r in b_list]))
+                for ai, bi in zip(*np.nonzero(iou >= iou_thr)):
+                    votes[(a_list[ai]["track_id"], b_list[bi]["track_id"])] += 1
+            matched = _assign(votes, min_match_frames)
+
+            # 2. 邊界附近斷掉的 track 以特徵相似度配對
+            window = reid_window if reid_window is not None else max(own_start - warmup_start, 1)
+            prev_last = defaultdict(int)
+            for r in prev:
+                prev_last[r["track_id"]] = max(prev_last[r["track_id"]], r["frame"])
+            cur_first = {}
+            for r in records:
+                cur_first[r["track_id"]] = min(cur_first.get(r["track_id"], r["frame"]), r["frame"])
+            ended = {t for t, f in prev_last.items() if f >= own_start - window and t not in matched.values()}
+            started = {t for t, f in cur_first.items() if f <= own_start + window and t not in matched}
+            if ended and started:
+                prev_feats = _mean_features([r for r in prev if r["track_id"] in ended])
+                cur_feats = _mean_features([r for r in records if r["track_id"] in started])
+                sims = {(a, b): float(fa @ fb) for a, fa in prev_feats.items() for b, fb in cur_feats.items()}
+                matched.update(_assign(sims, sim_thr))
+
+            mapping = {b: prev_map[a] for b, a in matched.items() if a in prev_map}
+
+        for r in records:
+            if not own_start <= r["frame"] < own_end:
+                continue
+            tid = r["track_id"]
+            if tid not in mapping:
+                mapping[tid] = next_id
+                next_id += 1
+            stitched.append(dict(r, track_id=mapping[tid]))
+        # 重疊區的 local track 也要有全域 ID，才能延續到下一個 shard
+        for r in records:
+            if r["track_id"] not in mapping:
+                mapping[r["track_id"]] = next_id
+                next_id += 1
+        prev_map = mapping
+    stitched.sort(key=lambda r: r["frame"])
+    return stitched
+
+
+def run_sharded_tracking(video_path, track_model, tracker, workers, overlap=DEFAULT_OVERLAP,
+                         embed_model=None, embed_mode="embed", sampler=None):
+    """
+    平行追蹤整支影片並縫合 Track ID，回傳依幀排序的偵測列表。
+    sampler (CropSampler) 的設定會傳給每個 worker，各 worker 的取樣數量再累加回 sampler。
+    """
+    cap = cv2.VideoCapture(video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if cap.isOpened() else 0
+    cap.release()
+    if total_frames <= 0:
+        raise ValueError(f"Cannot determine frame count of {video_path}; sharded mode needs a seekable video file.")
+
+    ranges = plan_shards(total_frames, workers, overlap)
+    threads = max(1, (os.cpu_count() or 1) // len(ranges))
+    jobs = [{"index": i, "range": r, "video": video_path, "track_model": track_model, "tracker": tracker,
+             "embed_model": embed_model, "embed_mode": embed_mode, "threads": threads,
+             "sampler": sampler.config() if sampler is not None else {}}
+            for i, r in enumerate(ranges)]
+    print(f"Sharded tracking: {total_frames} frames in {len(ranges)} shards (overlap {overlap} frames).")
+    with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+        outputs = list(pool.map(_track_shard, jobs))
+    shard_records = [records for records, _, _ in outputs]
+    if sampler is not None:
+        sampler.offered += sum(offered for _, offered, _ in outputs)
+        sampler.accepted += sum(accepted for _, _, accepted in outputs)
+
+    stitched = stitch_shards(shard_records, ranges)
+    print(f"Stitched {sum(len(r) for r in shard_records)} shard detections into {len(stitched)} detections "
+          f"and {len({r['track_id'] for r in stitched})} tracks.")
+    return stitched
+
+
+def add_sharding_args(parser):
+    group = parser.add_argument_group("parallel sharding")
+    group.add_argument("--workers", type=int, default=1, help="Track the video in N parallel shards (1 = serial).")
+    group.add_argument("--shard_overlap", type=int, default=DEFAULT_OVERLAP, help="Frames shared by neighbouring shards for ID stitching.")
+    return parser
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+空間佔用熱圖與軌跡統計。
+
+分析模板原本只用到 cls / conf / track_id，框的位置解析後就丟掉了。這裡以整個 session 的陣列運算計算：
+- 各類別的佔用熱圖：把每筆偵測的位置 (框中心或底邊中點) 落在 gw x gh 的格子上，
+  以一次 np.bincount 得到 (類別, gy, gx) 的次數；次數 / fps 即為停留秒數
+- 各 track 的軌跡：路徑長度、淨位移、平均 / 最大速度、靜止時間比例
+  (依 (track_id, frame) 排序後相鄰兩筆相減，再以 bincount 依 track 加總)
+
+影片大小已知時距離以像素為單位，否則為正規化座標 (0~1)。
+靜止的門檻以「每秒移動不到畫面對角線的 stationary_speed 比例」表示，與解析度無關。
+
+    python spatial_analytics.py --session_dir runs/analyze/track_xxx --yaml datasets/wildlife/data.yaml
+輸出 occupancy_grid.csv (cls_name, gx, gy, detections, seconds) 與 trajectory_stats.csv。
+CLI 與分析模板一致：影片大小預設取 summary.json 的 frame_size，類別名稱取 yaml 的 names，
+track_id 使用縫合後的 ID (session 有 track_links.csv 時依連結表換算原始 ID)。
+"""
+import json
+import time
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+DEFAULT_GRID = (64, 36)
+DEFAULT_STATIONARY_SPEED = 0.02
+
+
+def anchor_points(xc, yc, h=None, anchor="center"):
+    """框中心，或 anchor="bottom" 時為底邊中點 (地面上的位置)。"""
+    xc = np.asarray(xc, dtype=np.float64)
+    yc = np.asarray(yc, dtype=np.float64)
+    if anchor == "bottom" and h is not None:
+        yc = yc + np.asarray(h, dtype=np.float64) / 2
+    return xc, yc
+
+
+def occupancy_grid(cls, x, y, grid=DEFAULT_GRID, n_classes=None):
+    """正規化座標 x, y 在 grid=(gw, gh) 上的次數，回傳 (n_classes, gh, gw) 的 int64 陣列。"""
+    gw, gh = grid
+    cls = np.asarray(cls, dtype=np.int64)
+    n_classes = int(n_classes if n_classes is not None else (cls.max() + 1 if len(cls) else 0))
+    gx = np.clip((np.asarray(x) * gw).astype(np.int64), 0, gw - 1)
+    gy = np.clip((np.asarray(y) * gh).astype(np.int64), 0, gh - 1)
+    idx = (cls * gh + gy) * gw + gx
+    return np.bincount(idx, minlength=n_classes * gh * gw).reshape(n_classes, gh, gw)
+
+
+def occupancy_table(grid_counts, fps, cls_name=None):
+    """只保留非零格子的長表格：cls_name, gx, gy, detections, seconds。"""
+    c, gy, gx = np.nonzero(grid_counts)
+    counts = grid_counts[c, gy, gx]
+    name = cls_name or (lambda i: f"cls{i}")
+    table = pd.DataFrame({"cls_name": [name(int(i)) for i in c], "gx": gx, "gy": gy,
+                          "detections": counts, "seconds": counts / (fps or 30.0)})
+    # 多個類別編號可能對應到同一個名稱
+    return table.groupby(["cls_name", "gx", "gy"], as_index=False, sort=False).sum()
+
+
+def trajectory_stats(frame, track_id, x, y, fps, cls=None, frame_size=None,
+                     stationary_speed=DEFAULT_STATIONARY_SPEED):
+    """
+    每個 track 的路徑長度、淨位移、平均 / 最大速度與靜止時間比例，回傳 DataFrame。
+    同一個 track 中斷 (中間缺幀) 時，前後兩筆以實際的幀差計算速度。
+    """
+    fps = float(fps or 30.0)
+    frame = np.asarray(frame, dtype=np.int64)
+    track_id = np.asarray(track_id, dtype=np.int64)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if frame_size:
+        x, y = x * frame_size[0], y * frame_size[1]
+        diag = float(np.hypot(*frame_size))
+    else:
+        diag = float(np.sqrt(2.0))
+    if not len(frame):
+        return pd.DataFrame(columns=["track_id", "detections", "duration_sec", "path_length", "net_displacement",
+                                     "mean_speed", "max_speed", "stationary_fraction", "units"])
+    # (track_id, frame) 合成單一整數鍵後排序一次，比 lexsort 快
+    f0, t0 = frame.min(), track_id.min()
+    span = int(frame.max() - f0) + 1
+    if (int(track_id.max() - t0) + 1) * span < 2 ** 62:
+        order = np.argsort((track_id - t0) * span + (frame - f0), kind="stable")
+    else:
+        order = np.lexsort((frame, track_id))
+    frame, track_id, x, y = frame[order], track_id[order], x[order], y[order]
+
+    new_track = np.concatenate([[True], track_id[1:] != track_id[:-1]])
+    first = np.flatnonzero(new_track)
+    counts = np.diff(np.append(first, len(track_id)))
+    tids = track_id[first]
+    last = first + counts - 1
+    n = len(tids)
+    step_track = np.repeat(np.arange(n), counts)[1:]  # 第 i 步 (i -> i+1) 所屬的 track
+    dt = np.diff(frame) / fps
+    dist = np.hypot(np.diff(x), np.diff(y))
+    valid = ~new_track[1:] & (dt > 0)
+    st, dt, dist = step_track[valid], dt[valid], dist[valid]
+    speed = dist / dt
+
+    path = np.bincount(st, weights=dist, minlength=n)
+    tracked = np.bincount(st, weights=dt, minlength=n)
+    still = np.bincount(st, weights=dt * (speed < stationary_speed * diag), minlength=n)
+    max_speed = np.zeros(n)
+    if len(st):
+        # st 已依 track 排序：以 reduceat 取各 track 的最大值
+        has_steps = np.flatnonzero(np.bincount(st, minlength=n))
+        starts = np.searchsorted(st, has_steps)
+        max_speed[has_steps] = np.maximum.reduceat(speed, starts)
+    duration = (frame[last] - frame[first]) / fps
+
+    stats = pd.DataFrame({
+        "track_id": tids,
+        "detections": counts,
+        "duration_sec": duration,
+        "path_length": path,
+        "net_displacement": np.hypot(x[last] - x[first], y[last] - y[first]),
+        "mean_speed": np.divide(path, tracked, out=np.zeros(n), where=tracked > 0),
+        "max_speed": max_speed,
+        "stationary_fraction": np.divide(still, tracked, out=np.zeros(n), where=tracked > 0),
+    })
+    if cls is not None and n:
+        cls = np.asarray(cls, dtype=np.int64)[order]
+        n_cls = int(cls.max()) + 1
+        votes = np.bincount(np.repeat(np.arange(n), counts) * n_cls + cls, minlength=n * n_cls).reshape(n, n_cls)
+        stats.insert(1, "cls", votes.argmax(axis=1))
+    stats["units"] = "px" if frame_size else "norm"
+    return stats
+
+
+def write_spatial_reports(out_dir, frame, cls, track_id, xc, yc, h, fps, cls_name=None, frame_size=None,
+                          grid=DEFAULT_GRID, anchor="center", stationary_speed=DEFAULT_STATIONARY_SPEED):
+    """計算並寫出 occupancy_grid.csv 與 trajectory_stats.csv，回傳 (occupancy, trajectories)。"""
+    out_dir = Path(out_dir)
+    name = cls_name or (lambda i: f"cls{i}")
+    x, y = anchor_points(xc, yc, h, anchor)
+    occupancy = occupancy_table(occupancy_grid(cls, x, y, grid), fps, name)
+    trajectories = trajectory_stats(frame, track_id, x, y, fps, cls, frame_size, stationary_speed)
+    classes = trajectories.pop("cls") if "cls" in trajectories else []
+    trajectories.insert(1, "cls_name", [name(int(c)) for c in classes])
+    occupancy.to_csv(out_dir / "occupancy_grid.csv", index=False)
+    trajectories.to_csv(out_dir / "trajectory_stats.csv", index=False)
+    return occupancy, trajectories
+
+
+def spatial_summary(grid=DEFAULT_GRID, anchor="center", frame_size=None):
+    """寫入 summary.json 的設定，儀表板依此還原熱圖大小與單位。"""
+    return {"occupancy_grid": list(grid), "anchor": anchor,
+            "frame_size": list(frame_size) if frame_size else None}
+
+
+def spatial_figures(occupancy, trajectories, grid=DEFAULT_GRID):
+    """
+    儀表板用的 Plotly 圖：{"heatmap": 各類別佔用熱圖 (下拉選單切換類別),
+    "motion": 各類別的平均速度分佈與靜止時間比例}。沒有資料的圖為 None。
+    """
+    import plotly.graph_objs as go
+    from plotly.subplots import make_subplots
+    gw, gh = grid
+    figures = {"heatmap": None, "motion": None}
+    if occupancy is not None and len(occupancy):
+        classes = list(pd.unique(occupancy["cls_name"]))
+        fig = go.Figure()
+        for i, name in enumerate(classes):
+            part = occupancy[occupancy["cls_name"] == name]
+            z = np.zeros((gh, gw))
+            np.add.at(z, (part["gy"].to_numpy(), part["gx"].to_numpy()), part["seconds"].to_numpy())
+            fig.add_trace(go.Heatmap(z=z, colorscale="Hot", reversescale=True, visible=(i == 0), name=str(name),
+                                     colorbar={"title": "seconds"}))
+        buttons = [{"label": str(name), "method": "update",
+                    "args": [{"visible": [j == i for j in range(len(classes))]}]} for i, name in enumerate(classes)]
+        fig.update_layout(title="Occupancy (seconds per cell)", updatemenus=[{"buttons": buttons, "x": 1.0, "y": 1.15}],
+                          yaxis={"autorange": "reversed", "scaleanchor": "x", "constrain": "domain"},
+                          xaxis={"constrain": "domain"})
+        figures["heatmap"] = fig
+    if trajectories is not None and len(trajectories):
+        units = trajectories["units"].iloc[0]
+        fig = make_subplots(rows=1, cols=2, subplot_titles=(f"Mean speed per track ({units}/s)",
+                                                            "Stationary fraction per track"))
+        for name, part in trajectories.groupby("cls_name"):
+            fig.add_trace(go.Box(y=part["mean_speed"], name=str(name), boxmean=True, showlegend=False), row=1, col=1)
+            fig.add_trace(go.Box(y=part["stationary_fraction"], name=str(name), showlegend=False), row=1, col=2)
+        figures["motion"] = fig
+    return figures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Occupancy heatmaps and per-track trajectory statistics for a session.")
+    parser.add_argument("--session_dir", required=True, help="Session directory containing detections.npz.")
+    parser.add_argument("--fps", type=float, default=None, help="Default: the fps in summary.json (or 30).")
+    parser.add_argument("--frame_size", type=int, nargs=2, default=None, metavar=("WIDTH", "HEIGHT"),
+                        help="Video size in pixels. Default: the frame_size in summary.json (normalized units if absent).")
+    parser.add_argument("--yaml", default=None, help="Dataset yaml with class names (default: names stored with the session).")
+    parser.add_argument("--grid", type=int, nargs=2, default=list(DEFAULT_GRID), metavar=("GW", "GH"))
+    parser.add_argument("--anchor", choices=("center", "bottom"), default="center")
+    parser.add_argument("--stationary_speed", type=float, default=DEFAULT_STATIONARY_SPEED,
+                        help="Speed below this fraction of the frame diagonal per second counts as stationary.")
+    args = parser.parse_args()
+
+    from detection_store import STORE_NAME, DetectionStore
+    from live_analyzer import load_names
+    from track_stitching import apply_links
+    session_dir = Path(args.session_dir)
+    summary_path = session_dir / "summary.json"
+    summary = json.loads(summary_path.read_text(encoding="utf-8")) if summary_path.exists() else {}
+    fps = args.fps or summary.get("fps") or 30.0
+    frame_size = tuple(args.frame_size or summary.get("frame_size") or ()) or None
+    t0 = time.perf_counter()
+    with DetectionStore(session_dir / STORE_NAME) as store:
+        data = store.read(("frame", "cls", "track_id", "raw_track_id", "bbox"))
+        stored_names = store.meta.get("names") or {}
+    links_path = session_dir / "track_links.csv"
+    if links_path.exists():  # 與模板相同的縫合結果 (舊的 store 或只跑過 track_stitching.py 的 session)
+        data["track_id"] = apply_links(data["raw_track_id"], pd.read_csv(links_path))
+    names = load_names(args.yaml) or {int(k): str(v) for k, v in stored_names.items()}
+    t1 = time.perf_counter()
+    bbox = data["bbox"]
+    occupancy, trajectories = write_spatial_reports(session_dir, data["frame"], data["cls"], data["track_id"],
+                                                    bbox[:, 0], bbox[:, 1], bbox[:, 3], fps,
+                                                    lambda c: names.get(c, f"cls{c}"), frame_size,
+                                                    tuple(args.grid), args.anchor, args.stationary_speed)
+    if summary:
+        summary.update(spatial_summary(tuple(args.grid), args.anchor, frame_size))
+        summary_path.write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"{len(data['frame'])} detections, {len(trajectories)} tracks: load {t1 - t0:.2f}s, "
+          f"compute + write {time.perf_counter() - t1:.2f}s")
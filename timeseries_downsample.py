@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+長時間序列 (例如 objects_per_frame) 的降取樣。
+
+24 小時的影片有數百萬幀，逐幀繪圖會讓 PNG 繪製變慢、HTML 頁面數十 MB。這裡提供兩種保留形狀的方法：
+- minmax：把資料分成 n/2 個桶，每桶保留最小與最大值 (尖峰與低谷一定保留，適合靜態圖)
+- lttb：Largest-Triangle-Three-Buckets，每桶保留與前後點圍成最大三角形的點 (適合互動圖)
+
+互動圖先送出整段的降取樣結果，使用者縮放時由 range_loader_script() 產生的 JS 呼叫
+JSON 範圍 API (window() 的輸出) 取得該範圍的高解析度資料：
+
+    from timeseries_downsample import downsample, window, range_loader_script
+    xs, ys = downsample(frame, objects, 2000, "lttb")
+    payload = window(frame, objects, start=1000, end=5000, points=2000)   # {"x": [...], "y": [...], ...}
+"""
+import json
+import numpy as np
+
+DEFAULT_POINTS = 2000
+METHODS = ("lttb", "minmax")
+
+
+def minmax_downsample(x, y, n_out):
+    """每桶保留最小值與最大值 (依原順序)，並保留首尾兩點；回傳 (x, y)。"""
+    x, y = np.asarray(x), np.asarray(y)
+    n = len(x)
+    buckets = int(n_out) // 2
+    if n <= n_out or buckets < 1:
+        return x, y
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    bucket = np.repeat(np.arange(buckets), np.diff(edges))
+    order = np.lexsort((y, bucket))  # 桶內依 y 排序，桶的位置不變
+    idx = np.concatenate([[0, n - 1], order[edges[:-1]], order[edges[1:] - 1]])
+    idx = np.unique(idx)
+    return x[idx], y[idx]
+
+
+def lttb(x, y, n_out):
+    """Largest-Triangle-Three-Buckets；回傳 (x, y)，點數為 n_out (資料較少時原樣回傳)。"""
+    x, y = np.asarray(x), np.asarray(y)
+    n = len(x)
+    n_out = int(n_out)
+    if n <= n_out or n_out < 3:
+        return x, y
+    xf, yf = x.astype(np.float64), y.astype(np.float64)
+    # 首尾兩點固定，中間 n-2 點分成 n_out-2 桶
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    sizes = np.diff(edges)
+    mean_x = np.add.reduceat(xf[1:n - 1], edges[:-1] - 1) / sizes
+    mean_y = np.add.reduceat(yf[1:n - 1], edges[:-1] - 1) / sizes
+    mean_x = np.append(mean_x[1:], xf[-1])  # 每個桶的「下一桶」平均點，最後一桶的下一點為終點
+    mean_y = np.append(mean_y[1:], yf[-1])
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs((xf[a] - mean_x[i]) * (yf[lo:hi] - yf[a]) - (xf[a] - xf[lo:hi]) * (mean_y[i] - yf[a]))
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+    return x[idx], y[idx]
+
+
+def downsample(x, y, n_out=DEFAULT_POINTS, method="lttb"):
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsampling method '{method}' (choose from {', '.join(METHODS)}).")
+    return (lttb if method == "lttb" else minmax_downsample)(x, y, n_out)
+
+
+def window(x, y, start=None, end=None, points=DEFAULT_POINTS, method="lttb"):
+    """
+    取出 x 在 [start, end] 內的資料 (x 需已排序，兩側各多帶一點讓線條延伸到邊界)，
+    降取樣到 points 點，回傳可直接 JSON 化的 dict。
+    """
+    x, y = np.asarray(x), np.asarray(y)
+    lo = 0 if start is None else max(int(np.searchsorted(x, start, side="left")) - 1, 0)
+    hi = len(x) if end is None else min(int(np.searchsorted(x, end, side="right")) + 1, len(x))
+    xs, ys = downsample(x[lo:hi], y[lo:hi], points, method)
+    return {"x": xs.tolist(), "y": ys.tolist(), "start": start, "end": end,
+            "points_total": int(hi - lo), "points": int(len(xs)), "method": method}
+
+
+def range_loader_script(selector, url):
+    """
+    回傳一段 <script>：selector 選到的 Plotly 圖縮放 / 平移時，向 url?start=&end= 取得該範圍的
+    降取樣資料並替換第一條線；雙擊還原時重新取得整段。
+    """
+    return """<script>
+window.addEventListener("load", function () {
+  var gd = document.querySelector(%s);
+  if (!gd || !gd.on) return;
+  var url = %s, seq = 0;
+  gd.on("plotly_relayout", function (ev) {
+    var q;
+    if (ev["xaxis.autorange"]) q = "";
+    else if (ev["xaxis.range[0]"] !== undefined) q = "?start=" + Math.floor(ev["xaxis.range[0]"]) + "&end=" + Math.ceil(ev["xaxis.range[1]"]);
+    else if (ev["xaxis.range"]) q = "?start=" + Math.floor(ev["xaxis.range"][0]) + "&end=" + Math.ceil(ev["xaxis.range"][1]);
+    else return;
+    var my = ++seq;
+    fetch(url + q).then(function (r) { return r.json(); }).then(function (d) {
+      if (my === seq) Plotly.restyle(gd, {x: [d.x], y: [d.y]}, [0]);
+    });
+  });
+});
+</script>""" % (json.dumps(selector), json.dumps(url))
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+逐 Track 特徵向量的線上 (online) 統計。
+
+每個 track 只保留三個量：特徵總和、L2 正規化後特徵的總和、以及數量。
+由這些封閉形式的總和即可得到：
+- 代表性特徵 (平均向量) = sum / n
+- ID 內平均兩兩餘弦相似度 = (||Σu||² - Σ||u||²) / (n(n-1))
+  其中 u 為正規化後的特徵，零向量的 u 視為 0 (與 sklearn 的 cosine_similarity 一致)。
+
+每個 track 的記憶體為 O(d)，不隨該 track 的偵測次數增加。
+"""
+import numpy as np
+
+
+class TrackEmbeddingStats:
+    """單一 track 的常數記憶體累加器。"""
+
+    __slots__ = ("cls_name", "count", "feature_sum", "unit_sum", "unit_sq", "first_frame", "last_frame")
+
+    def __init__(self, dim, cls_name=None):
+        self.cls_name = cls_name
+        self.count = 0
+        self.feature_sum = np.zeros(dim, dtype=np.float64)
+        self.unit_sum = np.zeros(dim, dtype=np.float64)
+        self.unit_sq = 0  # Σ||u||²，也就是非零特徵的數量
+        self.first_frame = None
+        self.last_frame = None
+
+    def update(self, feature, frame=None):
+        f = np.asarray(feature, dtype=np.float64).ravel()
+        self.count += 1
+        if frame is not None:
+            self.first_frame = frame if self.first_frame is None else min(self.first_frame, frame)
+            self.last_frame = frame if self.last_frame is None else max(self.last_frame, frame)
+        self.feature_sum += f
+        norm = np.linalg.norm(f)
+        if norm > 0:
+            self.unit_sum += f / norm
+            self.unit_sq += 1
+
+    @property
+    def mean(self):
+        return self.feature_sum / self.count if self.count else self.feature_sum
+
+    def avg_pairwise_similarity(self):
+        """回傳所有 i<j 配對的平均餘弦相似度；少於兩筆特徵時回傳 None。"""
+        n = self.count
+        if n < 2:
+            return None
+        off_diagonal = float(self.unit_sum @ self.unit_sum) - self.unit_sq
+        return off_diagonal / (n * (n - 1))
+
+
+class TrackEmbeddingAccumulator:
+    """以 track_id 為鍵的 TrackEmbeddingStats 集合，偵測結果可逐筆串流更新。"""
+
+    def __init__(self):
+        self.tracks = {}
+
+    def update(self, track_id, feature, cls_name=None, frame=None):
+        stats = self.tracks.get(track_id)
+        if stats is None:
+            stats = TrackEmbeddingStats(np.asarray(feature).size, cls_name)
+            self.tracks[track_id] = stats
+        stats.update(feature, frame)
+        return stats
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __iter__(self):
+        return iter(self.tracks.items())
+
+    @property
+    def total_count(self):
+        return sum(s.count for s in self.tracks.values())
+
+    def intra_id_rows(self):
+        """產生與舊版 groupby + cosine_similarity 相同欄位的 ID 內相似度資料列。"""
+        rows = []
+        for track_id, stats in self.tracks.items():
+            avg_sim = stats.avg_pairwise_similarity()
+            if avg_sim is not None:
+                rows.append({'track_id': track_id, 'class': stats.cls_name,
+                             'avg_similarity': avg_sim, 'avg_distance': 1 - avg_sim})
+        return rows
+
+    def representative_rows(self):
+        """每個 track 的代表性特徵 (平均向量)。"""
+        return [{'track_id': track_id, 'cls_name': stats.cls_name, 'feature': stats.mean}
+                for track_id, stats in self.tracks.items() if stats.count]
+
+    def gallery_rows(self):
+        """代表性特徵加上出現的幀範圍與觀測次數，供 reid_gallery 寫入。"""
+        return [{'track_id': track_id, 'cls_name': stats.cls_name, 'feature': stats.mean,
+                 'start_frame': stats.first_frame, 'end_frame': stats.last_frame, 'n_obs': stats.count}
+                for track_id, stats in self.tracks.items() if stats.count]
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+離線縫合 (stitch) 被追蹤器切斷的 track。
+
+ByteTrack / BoT-SORT 在遮擋或漏偵測後常把同一隻動物切成多個短 track，
+使 track 數偏高、壽命與停留時間偏低。這裡在整個 session 的偵測資料上做一次後處理：
+
+1. 每個 tracklet 的起點 / 終點：幀、位置 (正規化座標) 與以頭尾 tail 筆偵測估計的速度
+2. 候選連結 A -> B：B 在 A 結束後 max_gap_sec 秒內開始、同類別、
+   B 的起點距 A 的終點不超過 max_dist + max_speed * 間隔秒數。
+   以 (時間桶, 格子) 為鍵排序所有起點，每個終點只查詢相鄰 2 x 3 x 3 個鍵的範圍 (np.searchsorted)，
+   不需要比較所有 tracklet 兩兩配對
+3. 成本：運動連續性 (A 向前外插與 B 向後外插的位置誤差，除以閘門半徑) + 間隔時間，
+   有 embeddings 時再加上平均特徵的餘弦距離；超過 max_cost 的候選捨棄
+4. 指派：每個終點最多連到一個起點、每個起點最多被一個終點連到，成本總和最小。
+   候選圖拆成連通分量，各分量分別以 linear_sum_assignment 求解 (只有一條邊的分量直接採用)
+5. 沿著連結把每條鏈的 track_id 改為鏈首的 track_id
+
+B 一定在 A 結束後才開始，縫合後的 track 在時間上不會重疊。
+
+    python track_stitching.py --session_dir runs/analyze/track_xxx            # 寫出 track_links.csv
+    python track_stitching.py --session_dir ... --embeddings embeddings.npz   # npz 含 features, track_id (同 reid_eval.py)
+"""
+import json
+import time
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+DEFAULT_MAX_GAP_SEC = 2.0
+DEFAULT_MAX_DIST = 0.05      # 正規化座標；間隔 0 秒時的閘門半徑
+DEFAULT_MAX_SPEED = 0.25     # 正規化座標 / 秒；閘門半徑隨間隔時間增加的速度
+DEFAULT_MAX_COST = 1.5
+DEFAULT_TAIL = 5
+DEFAULT_EMBEDDING_WEIGHT = 1.0
+GAP_WEIGHT = 0.5
+MAX_COMPONENT = 2000         # 超過這個大小的連通分量改用貪婪法 (依成本由小到大)
+BATCH_PAIRS = 2_000_000      # 候選配對分批產生，限制記憶體用量
+
+
+def tracklet_ends(frame, track_id, x, y, cls=None, tail=DEFAULT_TAIL):
+    """每個 track 的起點 / 終點、頭尾速度 (每幀) 與多數類別，回傳 dict of arrays (依 track_id 排序)。"""
+    frame = np.asarray(frame, dtype=np.int64)
+    track_id = np.asarray(track_id, dtype=np.int64)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    f0, t0 = frame.min(), track_id.min()
+    span = int(frame.max() - f0) + 1
+    if (int(track_id.max() - t0) + 1) * span < 2 ** 62:
+        order = np.argsort((track_id - t0) * span + (frame - f0), kind="stable")
+    else:
+        order = np.lexsort((frame, track_id))
+    frame, track_id, x, y = frame[order], track_id[order], x[order], y[order]
+    first = np.flatnonzero(np.concatenate([[True], track_id[1:] != track_id[:-1]]))
+    counts = np.diff(np.append(first, len(track_id)))
+    last = first + counts - 1
+    head = np.minimum(first + tail - 1, last)  # 起點後第 tail 筆
+    back = np.maximum(last - tail + 1, first)  # 終點前第 tail 筆
+
+    def velocity(a, b):
+        df = (frame[b] - frame[a]).astype(np.float64)
+        ok = df > 0
+        vx = np.divide(x[b] - x[a], df, out=np.zeros(len(a)), where=ok)
+        vy = np.divide(y[b] - y[a], df, out=np.zeros(len(a)), where=ok)
+        return vx, vy
+
+    vx0, vy0 = velocity(first, head)
+    vx1, vy1 = velocity(back, last)
+    ends = {"track_id": track_id[first], "start": frame[first], "end": frame[last], "n": counts,
+            "x0": x[first], "y0": y[first], "x1": x[last], "y1": y[last],
+            "vx0": vx0, "vy0": vy0, "vx1": vx1, "vy1": vy1}
+    if cls is not None:
+        cls = np.asarray(cls, dtype=np.int64)[order]
+        n, n_cls = len(first), int(cls.max()) + 1
+        votes = np.bincount(np.repeat(np.arange(n), counts) * n_cls + cls, minlength=n * n_cls).reshape(n, n_cls)
+        ends["cls"] = votes.argmax(axis=1)
+    else:
+        ends["cls"] = np.zeros(len(first), dtype=np.int64)
+    return ends
+
+
+def _candidate_pairs(ends, max_gap, radius):
+    """以 (時間桶, 格子) 索引找出所有可能的 (終點 i, 起點 j)，產生器 (分批)。"""
+    n = len(ends["track_id"])
+    cell = max(radius, 1e-6)
+    nx = int(np.ceil(1.0 / cell)) + 3
+    ny = nx
+
+    def grid(v):
+        # 限制在內部格子 (1..nx-2)，相鄰的 ±1 查詢鍵不會超出範圍或重複
+        return np.clip(np.floor(v / cell).astype(np.int64) + 1, 1, nx - 2)
+
+    # 起點鍵：(start // max_gap, gx, gy)；終點 fa 的候選起點落在 fa // max_gap 或下一個時間桶
+    tb = ends["start"] // max_gap
+    skey = (tb * nx + grid(ends["x0"])) * ny + grid(ends["y0"])
+    sorder = np.argsort(skey, kind="stable")
+    skey_sorted = skey[sorder]
+    etb = ends["end"] // max_gap
+    egx, egy = grid(ends["x1"]), grid(ends["y1"])
+    offsets = [(dt, dx, dy) for dt in (0, 1) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+    qkeys = np.stack([((etb + dt) * nx + egx + dx) * ny + egy + dy for dt, dx, dy in offsets], axis=1)
+    lo = np.searchsorted(skey_sorted, qkeys, side="left")
+    hi = np.searchsorted(skey_sorted, qkeys, side="right")
+
+    counts = (hi - lo).sum(axis=1)
+    cum = np.cumsum(counts)
+    start_i = 0
+    while start_i < n:
+        base = cum[start_i - 1] if start_i else 0
+        stop_i = int(np.searchsorted(cum, base + BATCH_PAIRS, side="right"))
+        stop_i = max(stop_i, start_i + 1)
+        l, h = lo[start_i:stop_i].ravel(), hi[start_i:stop_i].ravel()
+        c = h - l
+        total = int(c.sum())
+        if total:
+            i = np.repeat(np.repeat(np.arange(start_i, stop_i), len(offsets)), c)
+            within = np.arange(total) - np.repeat(np.cumsum(c) - c, c)
+            j = sorder[np.repeat(l, c) + within]
+            yield i, j
+        start_i = stop_i
+
+
+def candidate_links(ends, fps, embeddings=None, max_gap_sec=DEFAULT_MAX_GAP_SEC, max_dist=DEFAULT_MAX_DIST,
+                    max_speed=DEFAULT_MAX_SPEED, max_cost=DEFAULT_MAX_COST,
+                    embedding_weight=DEFAULT_EMBEDDING_WEIGHT):
+    """
+    通過時間 / 距離閘門的候選連結與成本，回傳 (i, j, gap_frames, distance, cost)；i、j 為 ends 的索引。
+    embeddings: (track_ids, 已正規化的特徵矩陣) 或 None。
+    """
+    fps = float(fps or 30.0)
+    max_gap = max(1, int(round(max_gap_sec * fps)))
+    radius = max_dist + max_speed * max_gap_sec
+    emb_row = None
+    if embeddings is not None and len(embeddings[0]):
+        # 每個 tracklet 在特徵矩陣中的列；沒有特徵的為 -1
+        emb_ids, emb = np.asarray(embeddings[0], dtype=np.int64), embeddings[1]
+        pos = np.clip(np.searchsorted(emb_ids, ends["track_id"]), 0, len(emb_ids) - 1)
+        emb_row = np.where(emb_ids[pos] == ends["track_id"], pos, -1)
+    out = []
+    for i, j in _candidate_pairs(ends, max_gap, radius):
+        gap = ends["start"][j] - ends["end"][i]
+        keep = (gap > 0) & (gap <= max_gap) & (ends["cls"][i] == ends["cls"][j])
+        i, j, gap = i[keep], j[keep], gap[keep]
+        dist = np.hypot(ends["x0"][j] - ends["x1"][i], ends["y0"][j] - ends["y1"][i])
+        gate = max_dist + max_speed * gap / fps
+        keep = dist <= gate
+        i, j, gap, dist, gate = i[keep], j[keep], gap[keep], dist[keep], gate[keep]
+        # A 的終點向前外插到 B 開始的幀，B 的起點向後外插到 A 結束的幀，取兩者誤差的平均
+        fwd = np.hypot(ends["x1"][i] + ends["vx1"][i] * gap - ends["x0"][j],
+                       ends["y1"][i] + ends["vy1"][i] * gap - ends["y0"][j])
+        bwd = np.hypot(ends["x0"][j] - ends["vx0"][j] * gap - ends["x1"][i],
+                       ends["y0"][j] - ends["vy0"][j] * gap - ends["y1"][i])
+        # 短 tracklet 的速度估計很吵，外插誤差不會比直接距離更差
+        cost = np.minimum((fwd + bwd) / 2, dist) / gate + GAP_WEIGHT * gap / max_gap
+        if emb_row is not None:
+            ri, rj = emb_row[i], emb_row[j]
+            both = (ri >= 0) & (rj >= 0)
+            sim = np.zeros(len(i))
+            if both.any():
+                sim[both] = np.einsum("ij,ij->i", emb[ri[both]], emb[rj[both]])
+            cost = cost + embedding_weight * np.where(both, (1.0 - sim) / 2, 0.0)
+        keep = cost <= max_cost
+        out.append((i[keep], j[keep], gap[keep], dist[keep], cost[keep]))
+    if not out:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, np.zeros(0), np.zeros(0)
+    return tuple(np.concatenate(parts) for parts in zip(*out))
+
+
+def assign_links(i, j, cost, n, max_cost=DEFAULT_MAX_COST):
+    """
+    一對一的最小成本指派：終點 i 最多一個後繼、起點 j 最多一個前驅。
+    以 cost - max_cost (<= 0) 為權重，不連結的成本為 0，因此只有比「不連結」好的連結會被採用。
+    回傳被採用的候選索引。
+    """
+    if not len(i):
+        return np.zeros(0, dtype=np.int64)
+    graph = coo_matrix((np.ones(len(i)), (i, n + j)), shape=(2 * n, 2 * n))
+    _, labels = connected_components(graph, directed=False)
+    comp = labels[i]
+    sizes = np.bincount(comp)
+    single = sizes[comp] == 1
+    chosen = [np.flatnonzero(single)]
+    multi = np.flatnonzero(~single)
+    if len(multi):
+        multi = multi[np.argsort(comp[multi], kind="stable")]
+        bounds = np.flatnonzero(np.diff(comp[multi])) + 1
+        for edges in np.split(multi, bounds):
+            ui, inv_i = np.unique(i[edges], return_inverse=True)
+            uj, inv_j = np.unique(j[edges], return_inverse=True)
+            if len(ui) > MAX_COMPONENT or len(uj) > MAX_COMPONENT:
+                chosen.append(_greedy(edges, i, j, cost))
+                continue
+            mat = np.zeros((len(ui), len(uj)))
+            mat[inv_i, inv_j] = cost[edges] - max_cost
+            ri, ci = linear_sum_assignment(mat)
+            lookup = np.full((len(ui), len(uj)), -1, dtype=np.int64)
+            lookup[inv_i, inv_j] = edges
+            picked = lookup[ri, ci]
+            chosen.append(picked[(picked >= 0) & (mat[ri, ci] < 0)])
+    return np.sort(np.concatenate(chosen))
+
+
+def _greedy(edges, i, j, cost):
+    used_i, used_j, picked = set(), set(), []
+    for e in edges[np.argsort(cost[edges], kind="stable")]:
+        if i[e] not in used_i and j[e] not in used_j:
+            used_i.add(i[e])
+            used_j.add(j[e])
+            picked.append(e)
+    return np.asarray(picked, dtype=np.int64)
+
+
+def chain_roots(i, j, n):
+    """依連結 i -> j 找出每個 tracklet 所在鏈的第一個 tracklet (pointer jumping)。"""
+    parent = np.arange(n)
+    parent[j] = i
+    while True:
+        nxt = parent[parent]
+        if np.array_equal(nxt, parent):
+            return parent
+        parent = nxt
+
+
+def load_track_embeddings(npz_path):
+    """每筆偵測的 features + track_id (reid_eval.py 的格式) -> (排序後的 track_ids, 正規化的平均特徵)。"""
+    with np.load(npz_path, allow_pickle=False) as data:
+        features = np.asarray(data["features"], dtype=np.float64)
+        track_id = np.asarray(data["track_id"], dtype=np.int64)
+    valid = track_id >= 0
+    features, track_id = features[valid], track_id[valid]
+    ids, inv = np.unique(track_id, return_inverse=True)
+    sums = np.zeros((len(ids), features.shape[1]))
+    np.add.at(sums, inv, features)
+    norms = np.linalg.norm(sums, axis=1, keepdims=True)
+    return ids, sums / np.where(norms > 0, norms, 1.0)
+
+
+def stitch_tracks(frame, track_id, x, y, cls=None, fps=30.0, embeddings=None, max_gap_sec=DEFAULT_MAX_GAP_SEC,
+                  max_dist=DEFAULT_MAX_DIST, max_speed=DEFAULT_MAX_SPEED, max_cost=DEFAULT_MAX_COST,
+                  tail=DEFAULT_TAIL, embedding_weight=DEFAULT_EMBEDDING_WEIGHT):
+    """
+    回傳 (每筆偵測縫合後的 track_id, 連結表 DataFrame)。
+    track_id < 0 (未追蹤) 的偵測不參與縫合，原樣保留。
+    連結表欄位：from_track, to_track, gap_frames, distance, cost, stitched_id
+    """
+    track_id = np.asarray(track_id, dtype=np.int64)
+    columns = ["from_track", "to_track", "gap_frames", "distance", "cost", "stitched_id"]
+    tracked = track_id >= 0
+    if not tracked.any():
+        return track_id.copy(), pd.DataFrame(columns=columns)
+    sel = np.flatnonzero(tracked)
+    ends = tracklet_ends(np.asarray(frame)[sel], track_id[sel], np.asarray(x)[sel], np.asarray(y)[sel],
+                         None if cls is None else np.asarray(cls)[sel], tail)
+    n = len(ends["track_id"])
+    i, j, gap, dist, cost = candidate_links(ends, fps, embeddings, max_gap_sec, max_dist, max_speed, max_cost,
+                                            embedding_weight)
+    keep = assign_links(i, j, cost, n, max_cost)
+    i, j, gap, dist, cost = i[keep], j[keep], gap[keep], dist[keep], cost[keep]
+    roots = chain_roots(i, j, n)
+    stitched = ends["track_id"][roots]
+    out = track_id.copy()
+    out[sel] = stitched[np.searchsorted(ends["track_id"], track_id[sel])]
+    links = pd.DataFrame({"from_track": ends["track_id"][i], "to_track": ends["track_id"][j], "gap_frames": gap,
+                          "distance": dist, "cost": cost, "stitched_id": stitched[j]})
+    return out, links.sort_values(["stitched_id", "gap_frames"], kind="stable").reset_index(drop=True)
+
+
+def apply_links(track_id, links):
+    """依連結表 (to_track -> stitched_id) 把原始 track_id 換成縫合後的 ID，與 stitch_tracks() 的結果相同。"""
+    out = np.array(track_id, dtype=np.int64)
+    if len(links):
+        src = links["to_track"].to_numpy(np.int64)
+        order = np.argsort(src)
+        src, dst = src[order], links["stitched_id"].to_numpy(np.int64)[order]
+        pos = np.minimum(np.searchsorted(src, out), len(src) - 1)
+        hit = src[pos] == out
+        out[hit] = dst[pos[hit]]
+    return out
+
+
+def add_stitch_args(parser):
+    parser.add_argument("--max_gap_sec", type=float, default=DEFAULT_MAX_GAP_SEC,
+                        help="Longest gap between a track's end and the next track's start.")
+    parser.add_argument("--max_dist", type=float, default=DEFAULT_MAX_DIST,
+                        help="Gate radius at zero gap, in normalized image units.")
+    parser.add_argument("--max_speed", type=float, default=DEFAULT_MAX_SPEED,
+                        help="Gate radius growth per second of gap (normalized units / s).")
+    parser.add_argument("--max_cost", type=float, default=DEFAULT_MAX_COST, help="Candidates above this cost are never linked.")
+    parser.add_argument("--tail", type=int, default=DEFAULT_TAIL, help="Detections used to estimate start/end velocity.")
+    return parser
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stitch fragmented track IDs of a session offline.")
+    parser.add_argument("--session_dir", required=True, help="Session directory containing detections.npz.")
+    parser.add_argument("--fps", type=float, default=None, help="Default: the fps in summary.json (or 30).")
+    parser.add_argument("--embeddings", default=None, help="Optional npz with per-detection features and track_id.")
+    add_stitch_args(parser)
+    args = parser.parse_args()
+
+    from detection_store import STORE_NAME, DetectionStore
+    session_dir = Path(args.session_dir)
+    summary_path = session_dir / "summary.json"
+    summary = json.loads(summary_path.read_text(encoding="utf-8")) if summary_path.exists() else {}
+    fps = args.fps or summary.get("fps") or 30.0
+    with DetectionStore(session_dir / STORE_NAME) as store:
+        data = store.read(("frame", "cls", "raw_track_id", "bbox"))
+    data["track_id"] = data.pop("raw_track_id")  # 已縫合過的 session 仍從追蹤器的原始 ID 開始
+    embeddings = load_track_embeddings(args.embeddings) if args.embeddings else None
+    t0 = time.perf_counter()
+    stitched, links = stitch_tracks(data["frame"], data["track_id"], data["bbox"][:, 0], data["bbox"][:, 1],
+                                    data["cls"], fps, embeddings, args.max_gap_sec, args.max_dist, args.max_speed,
+                                    args.max_cost, args.tail)
+    took = time.perf_counter() - t0
+    links.to_csv(session_dir / "track_links.csv", index=False)
+    raw = len(np.unique(data["track_id"][data["track_id"] >= 0]))
+    print(f"{raw} tracklets -> {raw - len(links)} tracks ({len(links)} links) in {took:.2f}s; "
+          f"wrote {session_dir / 'track_links.csv'}")